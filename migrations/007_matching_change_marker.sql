@@ -0,0 +1,24 @@
+-- Маркер изменений для инкрементального состояния мэтчера:
+-- обновляется, когда пользователь входит/выходит из пула или меняется эмбеддинг.
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS matching_updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+CREATE INDEX IF NOT EXISTS idx_users_matching_updated
+ON users (university_id, matching_updated_at);
+
+CREATE OR REPLACE FUNCTION touch_matching_updated_at() RETURNS trigger AS $$
+BEGIN
+    IF NEW.embedding IS DISTINCT FROM OLD.embedding
+       OR NEW.is_searching_interest_match IS DISTINCT FROM OLD.is_searching_interest_match
+       OR NEW.gender IS DISTINCT FROM OLD.gender
+       OR NEW.university_id IS DISTINCT FROM OLD.university_id THEN
+        NEW.matching_updated_at := clock_timestamp();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_matching_updated_at ON users;
+CREATE TRIGGER trg_users_matching_updated_at
+BEFORE UPDATE ON users
+FOR EACH ROW EXECUTE FUNCTION touch_matching_updated_at();
@@ -0,0 +1,17 @@
+-- NOTIFY для онлайн-мэтчера: новая (или снова доступная) pending заявка
+CREATE OR REPLACE FUNCTION notify_coffee_request_pending() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        'coffee_request_pending',
+        json_build_object('request_id', NEW.request_id, 'university_id', NEW.university_id)::text
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_coffee_request_pending ON coffee_requests;
+CREATE TRIGGER trg_coffee_request_pending
+AFTER INSERT OR UPDATE OF status, partner_user_id ON coffee_requests
+FOR EACH ROW
+WHEN (NEW.status = 'pending' AND NEW.partner_user_id IS NULL)
+EXECUTE FUNCTION notify_coffee_request_pending();
@@ -0,0 +1,24 @@
+-- Журнал запусков мэтчера: время по фазам, размеры пула, пиковая память
+CREATE TABLE IF NOT EXISTS matching_runs (
+    run_id BIGSERIAL PRIMARY KEY,
+    university_id INTEGER NOT NULL REFERENCES universities(id),
+    kind VARCHAR(20) NOT NULL,  -- 'requests' | 'interest'
+    engine VARCHAR(30),
+    started_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    finished_at TIMESTAMP WITH TIME ZONE,
+    fetch_ms REAL,
+    history_ms REAL,
+    similarity_ms REAL,
+    sort_ms REAL,
+    select_ms REAL,
+    write_ms REAL,
+    pool_size INTEGER,
+    candidate_edges BIGINT,
+    pairs INTEGER,
+    written INTEGER,
+    peak_memory_mb REAL,
+    error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_matching_runs_uni_started
+ON matching_runs (university_id, kind, started_at DESC);
@@ -0,0 +1,22 @@
+-- Групповые встречи (3–4 человека) из мэтчинга по интересам
+CREATE TABLE IF NOT EXISTS meeting_groups (
+    group_id SERIAL PRIMARY KEY,
+    university_id INTEGER NOT NULL REFERENCES universities(id),
+    -- организатор: ему предлагаем договориться о месте и времени
+    lead_user_id BIGINT NOT NULL REFERENCES users(user_id),
+    avg_similarity REAL NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    is_notification_sent BOOLEAN DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS meeting_group_members (
+    group_id INTEGER NOT NULL REFERENCES meeting_groups(group_id) ON DELETE CASCADE,
+    user_id BIGINT NOT NULL REFERENCES users(user_id),
+    PRIMARY KEY (group_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_meeting_groups_uni_created
+ON meeting_groups (university_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_meeting_group_members_user
+ON meeting_group_members (user_id);
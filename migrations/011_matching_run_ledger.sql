@@ -0,0 +1,23 @@
+-- Журнал планов мэтчинга: план запуска пишется до применения, каждая запись
+-- применяется идемпотентно со своим статусом; упавший запуск доприменяется
+ALTER TABLE matching_runs
+ADD COLUMN IF NOT EXISTS plan_status VARCHAR(20),  -- NULL | 'planned' | 'applied' | 'abandoned'
+ADD COLUMN IF NOT EXISTS resumed_from_run_id BIGINT REFERENCES matching_runs(run_id);
+
+CREATE INDEX IF NOT EXISTS idx_matching_runs_unfinished_plans
+ON matching_runs (university_id, kind, started_at DESC)
+WHERE plan_status = 'planned';
+
+CREATE TABLE IF NOT EXISTS matching_run_pairs (
+    run_id BIGINT NOT NULL REFERENCES matching_runs(run_id) ON DELETE CASCADE,
+    ord INTEGER NOT NULL,
+    entry_type VARCHAR(20) NOT NULL,  -- 'interest_pair' | 'group' | 'request_pair'
+    members BIGINT[] NOT NULL,
+    request_ids INTEGER[],  -- request_pair: (основная заявка, заявка партнера)
+    raw_similarity REAL,
+    score REAL,
+    status VARCHAR(20) NOT NULL DEFAULT 'planned',  -- 'planned' | 'applied' | 'skipped'
+    result_id BIGINT,  -- match_id / group_id / request_id
+    applied_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (run_id, ord)
+);
@@ -0,0 +1,15 @@
+-- Граф ближайших соседей по эмбеддингам: top-k самых похожих пользователей вуза
+-- для каждого пользователя. Поддерживает worker (инкрементально при изменении
+-- эмбеддингов), читают лента заявок и ре-мэтч — одним поиском по индексу.
+CREATE TABLE IF NOT EXISTS user_neighbors (
+    user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    neighbor_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    university_id INTEGER NOT NULL REFERENCES universities(id),
+    rank SMALLINT NOT NULL,  -- 1 — самый похожий
+    similarity REAL NOT NULL,  -- cosine similarity
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, neighbor_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_neighbors_university
+ON user_neighbors (university_id, user_id);
@@ -0,0 +1,6 @@
+-- get_interest_pool_changes фильтрует только по matching_updated_at (без вуза —
+-- чтобы видеть и ушедших из него), составной индекс из migrations/007 ему не подходит
+DROP INDEX IF EXISTS idx_users_matching_updated;
+
+CREATE INDEX IF NOT EXISTS idx_users_matching_updated_at
+ON users (matching_updated_at);
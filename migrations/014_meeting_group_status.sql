@@ -0,0 +1,13 @@
+-- Жизненный цикл групповых встреч, как у interest_matches:
+-- active -> expired (срок на встречу прошел, участники могут вернуться в поиск)
+ALTER TABLE meeting_groups
+ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'active',
+ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW() + INTERVAL '72 hours';
+
+-- группы, созданные до миграции, получают срок от created_at
+UPDATE meeting_groups
+SET expires_at = created_at + INTERVAL '72 hours'
+WHERE created_at IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_meeting_groups_status
+ON meeting_groups (status, university_id);
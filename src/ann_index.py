@@ -0,0 +1,166 @@
+"""IVF-индекс для приближённого поиска ближайших соседей по нормированным эмбеддингам."""
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк query x centroids считаем за раз при назначении кластеров
+ASSIGN_CHUNK_ROWS = 4096
+
+
+def assign_clusters(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Индекс ближайшего (по cosine) центроида для каждой строки x."""
+    labels = np.empty(x.shape[0], dtype=np.int64)
+    for start in range(0, x.shape[0], ASSIGN_CHUNK_ROWS):
+        chunk = x[start:start + ASSIGN_CHUNK_ROWS]
+        labels[start:start + ASSIGN_CHUNK_ROWS] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+def minibatch_kmeans(
+    x: np.ndarray,
+    k: int,
+    batch_size: int = 1024,
+    n_iter: int = 30,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Сферический mini-batch k-means (Sculley, 2010) для нормированных строк.
+    Возвращает центроиды (k, dim) с единичной нормой.
+    """
+    n = x.shape[0]
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+
+    centroids = x[rng.choice(n, size=k, replace=False)].astype(np.float32, copy=True)
+    counts = np.zeros(k, dtype=np.float64)
+
+    for _ in range(n_iter):
+        batch = x[rng.choice(n, size=min(batch_size, n), replace=False)]
+        labels = np.argmax(batch @ centroids.T, axis=1)
+
+        for c in np.unique(labels):
+            members = batch[labels == c]
+            counts[c] += len(members)
+            lr = len(members) / counts[c]
+            centroids[c] = (1 - lr) * centroids[c] + lr * members.mean(axis=0)
+
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        np.divide(centroids, norms, out=centroids, where=norms > 0)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted file index: точки разбиты по кластерам k-means, запрос
+    сканирует только nprobe ближайших кластеров.
+    """
+
+    def __init__(self, normed: np.ndarray, n_lists: int | None = None, seed: int = 0):
+        self.data = normed
+        n = normed.shape[0]
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n)))
+
+        self.centroids = minibatch_kmeans(normed, n_lists, seed=seed)
+        labels = assign_clusters(normed, self.centroids)
+
+        self.order = np.argsort(labels, kind="stable")
+        self.offsets = np.searchsorted(labels[self.order], np.arange(len(self.centroids) + 1))
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int):
+        """
+        Top-k соседей для каждого запроса. Возвращает (indices, scores) формы (q, k),
+        отсортированные по убыванию score; недостающие позиции: index = -1, score = -inf.
+        """
+        q = queries.shape[0]
+        nprobe = max(1, min(nprobe, self.n_lists))
+
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        best_idx = np.full((q, k), -1, dtype=np.int64)
+        best_score = np.full((q, k), -np.inf, dtype=np.float32)
+
+        for c in range(self.n_lists):
+            members = self.order[self.offsets[c]:self.offsets[c + 1]]
+            if not len(members):
+                continue
+            query_rows = np.nonzero((probes == c).any(axis=1))[0]
+            if not len(query_rows):
+                continue
+
+            scores = queries[query_rows] @ self.data[members].T
+            merged_score = np.concatenate([best_score[query_rows], scores], axis=1)
+            merged_idx = np.concatenate(
+                [best_idx[query_rows], np.broadcast_to(members, scores.shape)], axis=1
+            )
+            top = np.argpartition(-merged_score, k - 1, axis=1)[:, :k]
+            best_score[query_rows] = np.take_along_axis(merged_score, top, axis=1)
+            best_idx[query_rows] = np.take_along_axis(merged_idx, top, axis=1)
+
+        order = np.argsort(-best_score, axis=1, kind="stable")
+        return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_score, order, axis=1)
+
+
+def exact_top_k(normed: np.ndarray, query_rows: np.ndarray, k: int) -> np.ndarray:
+    """Точные top-k соседи (без самой точки) для строк query_rows."""
+    scores = normed[query_rows] @ normed.T
+    scores[np.arange(len(query_rows)), query_rows] = -np.inf
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+
+def ann_neighbors(
+    normed: np.ndarray,
+    k: int,
+    nprobe: int,
+    target_recall: float = 0.0,
+    recall_sample: int = 200,
+    seed: int = 0,
+):
+    """
+    Top-k соседей каждой точки пула через IVF.
+
+    Recall@k оценивается по случайной выборке из recall_sample точек
+    против точного поиска; пока он ниже target_recall, nprobe удваивается.
+    Возвращает (neighbors (n, k), scores (n, k), stats).
+    """
+    n = normed.shape[0]
+    k = max(1, min(k, n - 1))
+    index = IVFIndex(normed, seed=seed)
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(n, size=min(recall_sample, n), replace=False)
+    exact = exact_top_k(normed, sample, k)
+
+    while True:
+        # k + 1: первым соседом обычно окажется сама точка
+        idx, scores = index.search(normed, k + 1, nprobe)
+        is_self = idx == np.arange(n)[:, None]
+        # если себя в top-(k+1) нет — отбрасываем последнего
+        is_self[~is_self.any(axis=1), -1] = True
+        neighbors = idx[~is_self].reshape(n, k)
+        neighbor_scores = scores[~is_self].reshape(n, k)
+
+        hits = sum(
+            len(np.intersect1d(neighbors[row], exact[pos]))
+            for pos, row in enumerate(sample)
+        )
+        recall = hits / (len(sample) * k)
+
+        if recall >= target_recall or nprobe >= index.n_lists:
+            break
+        nprobe = min(nprobe * 2, index.n_lists)
+
+    stats = {"n_lists": index.n_lists, "nprobe": nprobe, "k": k, "recall": recall}
+    logger.info(
+        f"ANN: {n} точек, {index.n_lists} кластеров, nprobe={nprobe}, "
+        f"recall@{k}={recall:.3f} (цель {target_recall:.2f}, выборка {len(sample)})"
+    )
+    return neighbors, neighbor_scores, stats
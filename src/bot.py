@@ -42,6 +42,8 @@ from db import (
     expire_pending_requests,
     unmatch_request,
     cancel_request_by_creator,
+    find_rematch_request,
+    pair_pending_requests,
     get_shop_details,
     mark_feedback_as_requested,
     get_meetings_for_feedback,
@@ -70,10 +72,13 @@ from db import (
     get_pending_interest_match,
     get_interest_match_by_id,
     get_new_interest_matches_for_notification,
+    get_new_meeting_groups_for_notification,
     propose_meeting,
     accept_meeting_proposal,
     decline_interest_match,
     expire_interest_matches,
+    expire_meeting_groups,
+    has_active_meeting_group,
     get_stale_interest_proposals,
     mark_proposal_reminder_sent,
     # Пол
@@ -114,6 +119,11 @@ logger = logging.getLogger(__name__)
 
 MAX_NEGOTIATION_ROUNDS = 5
 
+# Мгновенный ре-мэтч после отмены: те же окно и магазин, что у мэтчера
+REMATCH_TIME_WINDOW_MINUTES = int(os.getenv("MATCH_TIME_WINDOW_MINUTES", "60"))
+REMATCH_SAME_SHOP_ONLY = os.getenv("MATCH_SAME_SHOP_ONLY", "true").lower() in ("1", "true", "yes")
+REMATCH_MIN_SIMILARITY = float(os.getenv("REMATCH_MIN_SIMILARITY", "0.3"))
+
 
 def display_similarity(raw_score: float) -> int:
     """Remap cosine similarity [0.15, 1.0] -> [55%, 95%] для отображения."""
@@ -536,8 +546,10 @@ async def post_init(app):
     app.job_queue.run_repeating(auto_cancel_job, interval=300, first=40)
     # Мэтчинг по интересам
     app.job_queue.run_repeating(notify_interest_matches_job, interval=120, first=35)
+    app.job_queue.run_repeating(notify_meeting_groups_job, interval=120, first=45)
     app.job_queue.run_repeating(remind_interest_proposals_job, interval=1800, first=120)
     app.job_queue.run_repeating(expire_interest_matches_job, interval=1800, first=90)
+    app.job_queue.run_repeating(expire_meeting_groups_job, interval=1800, first=100)
 
 
 async def find_company_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -1130,6 +1142,10 @@ async def handle_cancel_request_as_creator(
             logger.error(
                 f"Failed to send cancellation notification to partner {partner_id}: {e}"
             )
+
+        await instant_rematch(
+            context, user_id=partner_id, request_id=request_id, exclude_user_id=creator_id
+        )
     else:
         logger.warning(
             f"FAILURE: Creator {creator_id} failed to cancel matched request {request_id}."
@@ -1186,6 +1202,14 @@ async def handle_unmatch_request(
                 f"Failed to send unmatch notification to creator {creator_id}: {e}"
             )
 
+        await instant_rematch(
+            context,
+            user_id=creator_id,
+            request_id=request_id,
+            exclude_user_id=partner_id,
+            request_is_pending=True,
+        )
+
     else:
         logger.warning(
             f"FAILURE: User {partner_id} failed to unmatch from request {request_id}."
@@ -1198,6 +1222,59 @@ async def handle_unmatch_request(
     return ConversationHandler.END
 
 
+async def instant_rematch(
+    context: ContextTypes.DEFAULT_TYPE,
+    user_id: int,
+    request_id: int,
+    exclude_user_id: int,
+    request_is_pending: bool = False,
+) -> bool:
+    """
+    Сразу подбирает освободившемуся пользователю новую встречу рядом по
+    времени с отмененной request_id, не дожидаясь пакетного мэтчинга.
+
+    request_is_pending=True (партнер отказался): заявка user_id снова pending,
+    к ней присоединяется создатель лучшей подходящей заявки. Иначе (создатель
+    отменил встречу) user_id сам присоединяется к лучшей pending заявке.
+    """
+    uni_id = BOT_CONFIG["university_id"]
+    candidate = find_rematch_request(
+        user_id=user_id,
+        request_id=request_id,
+        uni_id=uni_id,
+        exclude_user_ids=[exclude_user_id],
+        window_minutes=REMATCH_TIME_WINDOW_MINUTES,
+        same_shop=REMATCH_SAME_SHOP_ONLY,
+        min_similarity=REMATCH_MIN_SIMILARITY,
+    )
+    if candidate is None:
+        return False
+
+    candidate_request_id, candidate_user_id, similarity = candidate
+    if request_is_pending:
+        paired_request_id = request_id
+        success = pair_pending_requests(request_id, candidate_request_id, uni_id)
+    else:
+        paired_request_id = candidate_request_id
+        success = pair_user_for_request(
+            request_id=candidate_request_id, partner_user_id=user_id, uni_id=uni_id
+        )
+
+    if not success:
+        logger.info(f"Instant rematch for user {user_id}: request {candidate_request_id} already taken")
+        return False
+
+    logger.info(
+        f"SUCCESS: instant rematch User {user_id} <-> User {candidate_user_id} "
+        f"(request {paired_request_id}, sim={similarity:.3f})"
+    )
+    try:
+        await notify_users_about_pairing(request_id=paired_request_id, context=context)
+    except Exception as e:
+        logger.error(f"Failed to send instant rematch notifications for request {paired_request_id}: {e}")
+    return True
+
+
 async def notify_users_about_pairing(
     request_id: int, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -2559,6 +2636,49 @@ async def notify_interest_matches_job(context: ContextTypes.DEFAULT_TYPE):
             logger.error(f"Failed to send interest match notification for match_id {match_id}: {e}")
 
 
+async def notify_meeting_groups_job(context: ContextTypes.DEFAULT_TYPE):
+    """Джоб: уведомления участникам новых групповых встреч (3–4 человека)."""
+    logger.info("JOB: checking for new meeting groups to notify...")
+    groups = get_new_meeting_groups_for_notification(uni_id=BOT_CONFIG["university_id"])
+    if not groups:
+        return
+
+    logger.info(f"Found {len(groups)} new meeting groups to notify.")
+
+    for group in groups:
+        group_id = group["group_id"]
+        similarity_pct = display_similarity(group["avg_similarity"])
+
+        for member in group["members"]:
+            others = []
+            for other in group["members"]:
+                if other["user_id"] == member["user_id"]:
+                    continue
+                name = other["first_name"] or "Участник"
+                contact = f" (@{other['username']})" if other["username"] else ""
+                bio = other["bio"] or "Не указано"
+                bio_excerpt = (bio[:150] + "...") if len(bio) > 150 else bio
+                others.append(f"• {name}{contact}: {bio_excerpt}")
+
+            if member["user_id"] == group["lead_user_id"]:
+                next_step = "Вы организатор: напишите участникам и предложите место и время встречи."
+            else:
+                next_step = "Организатор группы предложит место и время — можно написать участникам и самим."
+
+            text = (
+                f"👥 Групповая встреча по интересам!\n\n"
+                f"Мы собрали для вас компанию из {len(group['members'])} человек с похожими интересами:\n\n"
+                + "\n".join(others)
+                + f"\n\n📊 Совместимость группы: {similarity_pct}%\n\n{next_step}"
+            )
+            try:
+                await context.bot.send_message(chat_id=member["user_id"], text=text)
+            except Exception as e:
+                logger.error(f"Failed to send group notification for group_id {group_id} to {member['user_id']}: {e}")
+
+        logger.info(f"Sent meeting group notifications for group_id: {group_id}")
+
+
 async def remind_interest_proposals_job(context: ContextTypes.DEFAULT_TYPE):
     """Джоб: напоминание партнеру, который не ответил на предложение встречи (>6 часов)."""
     logger.info("JOB: checking for stale interest proposals to remind...")
@@ -2631,6 +2751,31 @@ async def expire_interest_matches_job(context: ContextTypes.DEFAULT_TYPE):
             logger.error(f"Failed to notify about expired interest match {match_id}: {e}")
 
 
+async def expire_meeting_groups_job(context: ContextTypes.DEFAULT_TYPE):
+    """Джоб: экспирация групповых встреч по expires_at."""
+    logger.info("JOB: checking for expired meeting groups...")
+    expired = expire_meeting_groups(uni_id=BOT_CONFIG["university_id"])
+    if not expired:
+        return
+
+    logger.info(f"Expired {len(expired)} meeting groups.")
+
+    text = (
+        "⏰ Срок групповой встречи истек.\n\n"
+        "Вы можете вернуться в режим поиска по интересам."
+    )
+    keyboard = [
+        [InlineKeyboardButton("🔍 Вернуться в поиск", callback_data="interest_reenter")],
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    for group_id, members in expired:
+        for user_id in members:
+            try:
+                await context.bot.send_message(chat_id=user_id, text=text, reply_markup=reply_markup)
+            except Exception as e:
+                logger.error(f"Failed to notify {user_id} about expired meeting group {group_id}: {e}")
+
+
 async def handle_interest_reenter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Повторный вход в режим поиска по интересам (из кнопки после экспирации/отклонения)."""
     query = update.callback_query
@@ -2648,7 +2793,7 @@ async def handle_interest_reenter(update: Update, context: ContextTypes.DEFAULT_
 
     # Проверяем, нет ли уже активного мэтча
     active_match = get_pending_interest_match(user_id, uni_id)
-    if active_match:
+    if active_match or has_active_meeting_group(user_id, uni_id):
         await query.edit_message_text(
             "У вас уже есть активный мэтч по интересам. "
             "Откройте «🔍 Мэтчинг по интересам» для подробностей."
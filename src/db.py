@@ -1,5 +1,7 @@
+import io
 import os
 import time
+import numpy as np
 import psycopg2
 import psycopg2.extras
 from psycopg2 import pool
@@ -15,6 +17,20 @@ logger = logging.getLogger(__name__)
 
 DB_POOL = None
 
+# Сколько строк пакетные записи отправляют одним statement
+BATCH_WRITE_CHUNK = 1000
+
+# Advisory locks мэтчера: pg_advisory_lock(класс, university_id).
+# Сессионные — лидерство реплики на время запуска, транзакционные — запись пар.
+MATCHER_LOCK_NAMESPACE = 0x52430000
+MATCHER_LOCK_CLASSES = {
+    "interest": 1,
+    "requests": 2,
+    "online": 3,
+    "interest_write": 11,
+    "requests_write": 12,
+}
+
 
 def init_db_pool(max_retries=10, retry_delay=3):
     global DB_POOL
@@ -198,7 +214,8 @@ def get_pending_requests(user_id: int, uni_id: int) -> list:
         u.coffee_streak,
         CASE
             WHEN u.embedding IS NOT NULL AND viewer.embedding IS NOT NULL
-            THEN GREATEST(0, ROUND((1 - (u.embedding <=> viewer.embedding))::numeric * 100))
+            -- соседи из графа — готовая similarity, pgvector только для остальных заявок
+            THEN GREATEST(0, ROUND(COALESCE(n.similarity, 1 - (u.embedding <=> viewer.embedding))::numeric * 100))
             ELSE NULL
         END as similarity_percent
     FROM
@@ -209,6 +226,11 @@ def get_pending_requests(user_id: int, uni_id: int) -> list:
         users AS u ON r.creator_user_id = u.user_id
     LEFT JOIN
         users AS viewer ON viewer.user_id = %s AND viewer.university_id = %s
+    LEFT JOIN
+        user_neighbors AS n
+        ON n.user_id = viewer.user_id
+       AND n.neighbor_id = r.creator_user_id
+       AND n.university_id = viewer.university_id
     WHERE
         r.status = 'pending'
         AND r.creator_user_id != %s
@@ -473,6 +495,230 @@ def pair_user_for_request(request_id: int, partner_user_id: int, uni_id: int) ->
     return success
 
 
+def find_rematch_request(
+    user_id: int,
+    request_id: int,
+    uni_id: int,
+    exclude_user_ids: list,
+    window_minutes: int,
+    same_shop: bool,
+    min_similarity: float,
+):
+    """
+    Мгновенный ре-мэтч: ближайшая по эмбеддингу pending заявка для user_id
+    в окне ±window_minutes от встречи request_id (заявка в любом статусе).
+    Similarity берется из графа соседей user_neighbors, если кандидат там есть.
+
+    Кандидаты — заявки других создателей, которые не истекут в ближайшие
+    10 минут, без exclude_user_ids и без тех, с кем user_id уже встречался.
+    Один запрос по pending заявкам вуза — укладывается в миллисекунды,
+    поэтому вызывается прямо из хэндлера отмены.
+    Возвращает (request_id, creator_user_id, similarity) или None.
+    """
+    sql = """
+    SELECT
+        r.request_id,
+        r.creator_user_id,
+        sim.similarity
+    FROM coffee_requests AS freed
+    JOIN users AS viewer ON viewer.user_id = %s AND viewer.university_id = freed.university_id
+    JOIN coffee_requests AS r
+        ON r.university_id = freed.university_id
+       AND r.request_id != freed.request_id
+       AND r.status = 'pending'
+       AND r.partner_user_id IS NULL
+       AND r.meet_time > NOW() + INTERVAL '10 minutes'
+       AND r.meet_time BETWEEN freed.meet_time - make_interval(mins => %s)
+                           AND freed.meet_time + make_interval(mins => %s)
+       AND (NOT %s OR r.shop_id = freed.shop_id)
+    JOIN users AS u ON u.user_id = r.creator_user_id
+    LEFT JOIN user_neighbors AS n
+        ON n.user_id = viewer.user_id
+       AND n.neighbor_id = r.creator_user_id
+       AND n.university_id = viewer.university_id
+    -- соседи из графа — готовая similarity, pgvector только для остальных кандидатов окна
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(n.similarity, 1 - (u.embedding <=> viewer.embedding)) AS similarity
+    ) AS sim
+    WHERE
+        freed.request_id = %s
+        AND freed.university_id = %s
+        AND r.creator_user_id != ALL(%s::bigint[])
+        AND u.embedding IS NOT NULL
+        AND viewer.embedding IS NOT NULL
+        AND sim.similarity >= %s
+        AND NOT EXISTS (
+            SELECT 1 FROM coffee_requests AS h
+            WHERE h.status = 'matched'
+              AND h.university_id = freed.university_id
+              AND ((h.creator_user_id = viewer.user_id AND h.partner_user_id = r.creator_user_id)
+                OR (h.creator_user_id = r.creator_user_id AND h.partner_user_id = viewer.user_id))
+        )
+    ORDER BY sim.similarity DESC, r.meet_time
+    LIMIT 1;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (
+                    user_id,
+                    window_minutes,
+                    window_minutes,
+                    same_shop,
+                    request_id,
+                    uni_id,
+                    [user_id, *exclude_user_ids],
+                    min_similarity,
+                ))
+                row = cur.fetchone()
+                return (row[0], row[1], float(row[2])) if row else None
+    except Exception as e:
+        logger.error(f"find_rematch_request(): {e}")
+        return None
+
+
+def pair_pending_requests(request_id: int, partner_request_id: int, uni_id: int) -> bool:
+    """
+    Создатель partner_request_id становится партнером по request_id, его
+    собственная заявка закрывается — одной транзакцией, только если обе
+    заявки ещё pending. Как и при ручном мэтчинге, уведомление отправляет бот
+    (is_match_notification_sent = TRUE).
+    """
+    pair_sql = """
+    UPDATE coffee_requests r
+    SET
+        partner_user_id = p.creator_user_id,
+        status = 'matched',
+        is_match_notification_sent = TRUE,
+        is_confirmed_by_partner = CASE
+            WHEN r.meet_time < (NOW() + INTERVAL '45 minutes') THEN TRUE
+            ELSE FALSE
+        END,
+        is_confirmed_by_creator = CASE
+            WHEN r.meet_time < (NOW() + INTERVAL '45 minutes') THEN TRUE
+            ELSE FALSE
+        END,
+        is_confirmation_sent = CASE
+            WHEN r.meet_time < (NOW() + INTERVAL '45 minutes') THEN TRUE
+            ELSE FALSE
+        END
+    FROM coffee_requests p
+    WHERE
+        r.request_id = %s
+        AND r.status = 'pending'
+        AND r.partner_user_id IS NULL
+        AND r.university_id = %s
+        AND p.request_id = %s
+        AND p.status = 'pending'
+        AND p.partner_user_id IS NULL
+        AND p.university_id = %s;
+    """
+    close_sql = """
+    UPDATE coffee_requests
+    SET status = 'cancelled'
+    WHERE request_id = %s AND status = 'pending' AND university_id = %s;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(pair_sql, (request_id, uni_id, partner_request_id, uni_id))
+                if cur.rowcount != 1:
+                    conn.rollback()
+                    return False
+                cur.execute(close_sql, (partner_request_id, uni_id))
+                if cur.rowcount != 1:
+                    conn.rollback()
+                    return False
+                conn.commit()
+                return True
+    except Exception as e:
+        logger.error(f"pair_pending_requests(): {e}")
+        return False
+
+
+def _pair_requests_chunk(cur, chunk: list, uni_id: int) -> set:
+    """Пары заявок одним statement; возвращает main_request_id записанных пар."""
+    pair_sql = """
+    UPDATE coffee_requests r
+    SET
+        partner_user_id = b.partner_user_id,
+        status = 'matched',
+        is_match_notification_sent = FALSE,
+        is_confirmed_by_partner = CASE
+            WHEN r.meet_time < (NOW() + INTERVAL '45 minutes') THEN TRUE
+            ELSE FALSE
+        END,
+        is_confirmed_by_creator = CASE
+            WHEN r.meet_time < (NOW() + INTERVAL '45 minutes') THEN TRUE
+            ELSE FALSE
+        END,
+        is_confirmation_sent = CASE
+            WHEN r.meet_time < (NOW() + INTERVAL '45 minutes') THEN TRUE
+            ELSE FALSE
+        END
+    FROM unnest(%s::int[], %s::bigint[], %s::int[]) AS b(request_id, partner_user_id, partner_request_id)
+    WHERE
+        r.request_id = b.request_id
+        AND r.status = 'pending'
+        AND r.partner_user_id IS NULL
+        AND r.university_id = %s
+        -- заявку партнера могли принять вручную, пока мэтчер считал
+        AND EXISTS (
+            SELECT 1 FROM coffee_requests p
+            WHERE p.request_id = b.partner_request_id
+              AND p.status = 'pending'
+              AND p.partner_user_id IS NULL
+        )
+    RETURNING r.request_id;
+    """
+    close_sql = """
+    UPDATE coffee_requests
+    SET status = 'cancelled'
+    WHERE request_id = ANY(%s::int[])
+      AND status = 'pending'
+      AND university_id = %s;
+    """
+    cur.execute(pair_sql, (
+        [p[0] for p in chunk],
+        [p[1] for p in chunk],
+        [p[2] for p in chunk],
+        uni_id,
+    ))
+    matched = {row[0] for row in cur.fetchall()}
+    partner_requests = [p[2] for p in chunk if p[0] in matched]
+    if partner_requests:
+        cur.execute(close_sql, (partner_requests, uni_id))
+    return matched
+
+
+def pair_requests_batch(pairs: list, uni_id: int) -> list:
+    """
+    Запись результата ML-мэтчинга заявок одной транзакцией.
+
+    pairs: [(main_request_id, partner_user_id, partner_request_id)].
+    Основная заявка получает партнера (is_match_notification_sent = FALSE —
+    уведомит notify_new_matches_job), собственная pending заявка партнера
+    закрывается, чтобы его не замэтчили второй раз.
+    Возвращает список bool, выровненный по pairs: False — одна из заявок уже не pending.
+    """
+    if not pairs:
+        return []
+
+    paired = set()
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                _lock_matcher_writes(cur, "requests_write", uni_id)
+                for start in range(0, len(pairs), BATCH_WRITE_CHUNK):
+                    paired |= _pair_requests_chunk(cur, pairs[start:start + BATCH_WRITE_CHUNK], uni_id)
+                conn.commit()
+    except Exception as e:
+        logger.error(f"pair_requests_batch(): {e}")
+        return [False] * len(pairs)
+
+    return [p[0] in paired for p in pairs]
+
+
 def log_cancellation_event(conn, request_id: int, user_id: int, event_type: str):
     sql = """
     INSERT INTO cancellation_logs (request_id, user_id, event_type, event_time)
@@ -1042,6 +1288,700 @@ def get_pending_requests_for_matching(uni_id: int):
         return []
 
 
+# --- Бинарная выгрузка пула для мэтчера (COPY ... FORMAT binary) ---
+
+PGCOPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+PG_EPOCH_US = np.datetime64("2000-01-01T00:00:00", "us")
+
+# Бинарное представление типов Postgres (big-endian)
+_COPY_FIELD_DTYPES = {
+    "int2": np.dtype(">i2"),
+    "int4": np.dtype(">i4"),
+    "int8": np.dtype(">i8"),
+    "timestamptz": np.dtype(">i8"),  # микросекунды от 2000-01-01 UTC
+}
+
+
+def decode_copy_binary(buf, fields: list) -> dict:
+    """
+    Разбирает вывод COPY ... TO STDOUT (FORMAT binary) с колонками фиксированной
+    ширины без NULL. fields: [(name, kind)], kind — ключ _COPY_FIELD_DTYPES или "vector"
+    (pgvector: int16 dim, int16 unused, float4[dim]).
+
+    Все строки декодируются одним np.frombuffer по structured dtype, без
+    Python-объектов на строку. Возвращает {name: np.ndarray}; vector -> float32 (n, dim).
+    """
+    buf = memoryview(buf)
+    if bytes(buf[:11]) != PGCOPY_SIGNATURE:
+        raise ValueError("not a PGCOPY binary stream")
+    ext_len = int(np.frombuffer(buf, dtype=">i4", count=1, offset=15)[0])
+    body = buf[19 + ext_len:len(buf) - 2]  # trailer: int16 -1
+
+    layout = [("nfields", ">i2")]
+    for name, kind in fields:
+        if kind == "vector":
+            # размерность берём из первой строки: сразу за int32 длиной поля
+            offset = np.dtype(layout).itemsize + 4
+            dim = int(np.frombuffer(body, dtype=">i2", count=1, offset=offset)[0]) if len(body) else 0
+            layout += [(f"{name}_len", ">i4"), (f"{name}_dim", ">i2"), (f"{name}_unused", ">i2"),
+                       (name, ">f4", (dim,))]
+        else:
+            layout += [(f"{name}_len", ">i4"), (name, _COPY_FIELD_DTYPES[kind])]
+    row_dtype = np.dtype(layout)
+
+    if len(body) % row_dtype.itemsize:
+        raise ValueError("variable-width rows in COPY stream")
+    rows = np.frombuffer(body, dtype=row_dtype)
+
+    if len(rows) and (rows["nfields"] != len(fields)).any():
+        raise ValueError("unexpected field count in COPY stream")
+
+    result = {}
+    for name, kind in fields:
+        expected = row_dtype.fields[name][0].itemsize + (4 if kind == "vector" else 0)
+        if len(rows) and (rows[f"{name}_len"] != expected).any():
+            raise ValueError(f"unexpected length of field {name} in COPY stream")
+        if kind == "vector":
+            result[name] = np.ascontiguousarray(rows[name], dtype=np.float32)
+        elif kind == "timestamptz":
+            result[name] = PG_EPOCH_US + rows[name].astype(np.int64).astype("timedelta64[us]")
+        else:
+            result[name] = rows[name].astype(np.int64)
+    return result
+
+
+def _copy_binary_query(sql: str, params: tuple, fields: list) -> dict | None:
+    """SELECT -> COPY (SELECT ...) TO STDOUT binary -> массивы. None при ошибке."""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                query = cur.mogrify(sql, params).decode()
+                stream = io.BytesIO()
+                cur.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT binary)", stream)
+        return decode_copy_binary(stream.getbuffer(), fields)
+    except Exception as e:
+        logger.error(f"_copy_binary_query: {e}")
+        return None
+
+
+def fetch_interest_pool_arrays(uni_id: int, with_embeddings: bool = True) -> dict | None:
+    """
+    Пул мэтчинга по интересам в виде массивов:
+    user_ids int64 (n,), embeddings float32 (n, dim), genders object (n,) — 'M'/'F'/None.
+    with_embeddings=False — без колонки embedding (векторы берутся из src.embedding_store).
+    None — бинарная выгрузка не удалась (вызывающий откатывается на get_interest_search_users).
+    """
+    sql = f"""
+    SELECT
+        user_id,
+        {"embedding," if with_embeddings else ""}
+        (CASE gender WHEN 'M' THEN 1 WHEN 'F' THEN 2 ELSE 0 END)::int2 AS gender_code
+    FROM users
+    WHERE is_searching_interest_match = TRUE
+      AND embedding IS NOT NULL
+      AND university_id = %s
+    """
+    fields = [("user_id", "int8"), ("embedding", "vector"), ("gender_code", "int2")]
+    data = _copy_binary_query(sql, (uni_id,), fields if with_embeddings else [fields[0], fields[2]])
+    if data is None:
+        return None
+    pool = {
+        "user_ids": data["user_id"],
+        "genders": np.array([None, "M", "F"], dtype=object)[data["gender_code"]],
+    }
+    if with_embeddings:
+        pool["embeddings"] = data["embedding"]
+    return pool
+
+
+def fetch_request_pool_arrays(uni_id: int, request_ids: list | None = None,
+                              with_embeddings: bool = True) -> dict | None:
+    """
+    То же, что get_pending_requests_for_matching, но массивами: request_ids, creator_ids,
+    embeddings float32 (n, dim), meet_times datetime64[us] (UTC), shop_ids.
+    request_ids — выгрузить только эти заявки.
+    with_embeddings=False — без колонки embedding (векторы берутся из src.embedding_store).
+    """
+    sql = f"""
+    SELECT
+        r.request_id,
+        r.creator_user_id,
+        {"u.embedding," if with_embeddings else ""}
+        r.meet_time,
+        r.shop_id
+    FROM coffee_requests r
+    JOIN users u ON r.creator_user_id = u.user_id
+    WHERE r.status = 'pending'
+      AND r.partner_user_id IS NULL
+      AND r.meet_time > NOW()
+      AND r.university_id = %s
+      AND u.embedding IS NOT NULL
+      AND (%s::int[] IS NULL OR r.request_id = ANY(%s::int[]))
+    ORDER BY r.meet_time ASC
+    """
+    fields = [
+        ("request_id", "int4"),
+        ("creator_user_id", "int8"),
+        *([("embedding", "vector")] if with_embeddings else []),
+        ("meet_time", "timestamptz"),
+        ("shop_id", "int4"),
+    ]
+    data = _copy_binary_query(sql, (uni_id, request_ids, request_ids), fields)
+    if data is None:
+        return None
+    pool = {
+        "request_ids": data["request_id"],
+        "creator_ids": data["creator_user_id"],
+        "meet_times": data["meet_time"],
+        "shop_ids": data["shop_id"],
+    }
+    if with_embeddings:
+        pool["embeddings"] = data["embedding"]
+    return pool
+
+
+def fetch_user_embedding_arrays(uni_id: int) -> dict | None:
+    """Все эмбеддинги вуза: user_ids int64 (n,), embeddings float32 (n, dim). None при ошибке."""
+    sql = """
+    SELECT user_id, embedding
+    FROM users
+    WHERE embedding IS NOT NULL
+      AND university_id = %s
+    """
+    data = _copy_binary_query(sql, (uni_id,), [("user_id", "int8"), ("embedding", "vector")])
+    if data is None:
+        return None
+    return {"user_ids": data["user_id"], "embeddings": data["embedding"]}
+
+
+def _replace_user_neighbors_chunk(cur, user_ids, neighbor_ids, scores, uni_id: int):
+    """Заменяет списки соседей пользователей chunk'а: DELETE + INSERT из массивов."""
+    k = neighbor_ids.shape[1]
+    found = neighbor_ids >= 0
+    cur.execute(
+        "DELETE FROM user_neighbors WHERE user_id = ANY(%s::bigint[]) AND university_id = %s;",
+        (user_ids.tolist(), uni_id),
+    )
+    cur.execute(
+        """
+        INSERT INTO user_neighbors (user_id, neighbor_id, university_id, rank, similarity)
+        SELECT n.user_id, n.neighbor_id, %s, n.rank, n.similarity
+        FROM unnest(%s::bigint[], %s::bigint[], %s::smallint[], %s::real[])
+            AS n(user_id, neighbor_id, rank, similarity)
+        -- пользователь или сосед мог удалиться, пока worker считал граф
+        JOIN users AS owner ON owner.user_id = n.user_id AND owner.university_id = %s
+        JOIN users AS neighbor ON neighbor.user_id = n.neighbor_id AND neighbor.university_id = %s;
+        """,
+        (
+            uni_id,
+            np.repeat(user_ids, k)[found.ravel()].tolist(),
+            neighbor_ids[found].tolist(),
+            np.tile(np.arange(1, k + 1), len(user_ids))[found.ravel()].tolist(),
+            scores[found].astype(float).tolist(),
+            uni_id,
+            uni_id,
+        ),
+    )
+
+
+def replace_user_neighbors(
+    uni_id: int,
+    user_ids,
+    neighbor_ids,
+    scores,
+    removed_user_ids=None,
+) -> bool:
+    """
+    Записывает top-k соседей пользователей в user_neighbors.
+
+    user_ids (n,), neighbor_ids (n, k) — user_id соседей по убыванию similarity
+    (-1 — пусто), scores (n, k). Списки user_ids заменяются целиком, chunk'ами по
+    BATCH_WRITE_CHUNK пользователей (каждый chunk — своя транзакция). Списки
+    removed_user_ids удаляются; removed_user_ids=None — полная синхронизация:
+    удаляются списки всех пользователей вуза не из user_ids.
+    """
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    neighbor_ids = np.asarray(neighbor_ids, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float32)
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                for start in range(0, len(user_ids), BATCH_WRITE_CHUNK):
+                    chunk = slice(start, start + BATCH_WRITE_CHUNK)
+                    _replace_user_neighbors_chunk(cur, user_ids[chunk], neighbor_ids[chunk], scores[chunk], uni_id)
+                    conn.commit()
+                if removed_user_ids is None:
+                    cur.execute(
+                        """
+                        DELETE FROM user_neighbors
+                        WHERE university_id = %s AND user_id != ALL(%s::bigint[]);
+                        """,
+                        (uni_id, user_ids.tolist()),
+                    )
+                elif len(removed_user_ids):
+                    cur.execute(
+                        "DELETE FROM user_neighbors WHERE user_id = ANY(%s::bigint[]) AND university_id = %s;",
+                        (np.asarray(removed_user_ids, dtype=np.int64).tolist(), uni_id),
+                    )
+                conn.commit()
+                return True
+    except Exception as e:
+        logger.error(f"[uni={uni_id}] replace_user_neighbors(): {e}")
+        return False
+
+
+def get_pending_request_ids(uni_id: int) -> set | None:
+    """ID pending заявок без партнера, доступных для мэтчинга. None при ошибке."""
+    sql = """
+        SELECT r.request_id
+        FROM coffee_requests r
+        JOIN users u ON r.creator_user_id = u.user_id
+        WHERE r.status = 'pending'
+          AND r.partner_user_id IS NULL
+          AND r.meet_time > NOW()
+          AND r.university_id = %s
+          AND u.embedding IS NOT NULL;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (uni_id,))
+                return {row[0] for row in cur.fetchall()}
+    except Exception as e:
+        logger.error(f"get_pending_request_ids: {e}")
+        return None
+
+
+def get_pending_requests_load(uni_id: int, urgent_minutes: int, lead_seconds: int) -> dict | None:
+    """
+    Нагрузка на пакетный мэтчинг заявок:
+    pending — заявки, доступные для мэтчинга; urgent — из них со встречей в ближайшие
+    urgent_minutes; next_expiry_seconds — через сколько секунд expire_pending_requests
+    (meet_time - 10 минут) закроет ближайшую заявку, у которой до этого больше lead_seconds
+    (None — таких нет).
+    """
+    sql = """
+        SELECT
+            COUNT(*),
+            COUNT(*) FILTER (WHERE r.meet_time < NOW() + make_interval(mins => %s)),
+            EXTRACT(EPOCH FROM MIN(r.meet_time - INTERVAL '10 minutes') FILTER (
+                WHERE r.meet_time - INTERVAL '10 minutes' > NOW() + make_interval(secs => %s)
+            ) - NOW())
+        FROM coffee_requests r
+        JOIN users u ON r.creator_user_id = u.user_id
+        WHERE r.status = 'pending'
+          AND r.partner_user_id IS NULL
+          AND r.meet_time > NOW() + INTERVAL '10 minutes'
+          AND r.university_id = %s
+          AND u.embedding IS NOT NULL;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (urgent_minutes, lead_seconds, uni_id))
+                pending, urgent, next_expiry = cur.fetchone()
+                return {
+                    "pending": pending,
+                    "urgent": urgent,
+                    "next_expiry_seconds": float(next_expiry) if next_expiry is not None else None,
+                }
+    except Exception as e:
+        logger.error(f"get_pending_requests_load: {e}")
+        return None
+
+
+def open_matching_run(uni_id: int, kind: str, engine: str, started_at: datetime) -> int | None:
+    """Строка запуска в matching_runs в момент старта (до плана и записи пар). Возвращает run_id."""
+    sql = """
+        INSERT INTO matching_runs (university_id, kind, engine, started_at)
+        VALUES (%s, %s, %s, %s)
+        RETURNING run_id;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (uni_id, kind, engine, started_at))
+                run_id = cur.fetchone()[0]
+                conn.commit()
+                return run_id
+    except Exception as e:
+        logger.error(f"open_matching_run: {e}")
+        return None
+
+
+def record_matching_run(run: dict, run_id: int | None = None) -> int | None:
+    """
+    Итоги запуска в matching_runs (ключи — имена колонок): UPDATE строки run_id,
+    открытой open_matching_run, или новая строка. Возвращает run_id.
+    """
+    columns = list(run)
+    if run_id is not None:
+        sql = f"""
+            UPDATE matching_runs
+            SET {", ".join(f"{c} = %s" for c in columns)}
+            WHERE run_id = %s
+            RETURNING run_id;
+        """
+        params = [run[c] for c in columns] + [run_id]
+    else:
+        sql = f"""
+            INSERT INTO matching_runs ({", ".join(columns)})
+            VALUES ({", ".join(["%s"] * len(columns))})
+            RETURNING run_id;
+        """
+        params = [run[c] for c in columns]
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                run_id = cur.fetchone()[0]
+                conn.commit()
+                return run_id
+    except Exception as e:
+        logger.error(f"record_matching_run: {e}")
+        return None
+
+
+# --- журнал планов мэтчинга (matching_run_pairs) ---
+
+def save_run_plan(run_id: int, entries: list) -> bool:
+    """
+    План запуска в журнал до применения: все записи одной транзакцией, статус planned.
+
+    entries: [{"entry_type": 'interest_pair' | 'group' | 'request_pair', "members": [user_id, ...],
+    "request_ids": [main, partner] | None, "raw": float | None, "score": float | None}].
+    """
+    sql = """
+        INSERT INTO matching_run_pairs
+            (run_id, ord, entry_type, members, request_ids, raw_similarity, score)
+        VALUES %s;
+    """
+    rows = [
+        (
+            run_id,
+            ord_,
+            e["entry_type"],
+            [int(u) for u in e["members"]],
+            [int(r) for r in e["request_ids"]] if e.get("request_ids") else None,
+            e.get("raw"),
+            e.get("score"),
+        )
+        for ord_, e in enumerate(entries)
+    ]
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, sql, rows, page_size=BATCH_WRITE_CHUNK)
+                cur.execute(
+                    "UPDATE matching_runs SET plan_status = 'planned' WHERE run_id = %s;", (run_id,)
+                )
+                conn.commit()
+                return True
+    except Exception as e:
+        logger.error(f"save_run_plan(run_id={run_id}, {len(entries)} entries): {e}")
+        return False
+
+
+def get_resumable_run(uni_id: int, kind: str, max_age_minutes: int) -> int | None:
+    """
+    run_id последнего незавершенного плана (plan_status = 'planned') для (вуз, вид).
+    Планы старше max_age_minutes помечаются abandoned — пул уже успел измениться.
+    """
+    abandon_sql = """
+        UPDATE matching_runs
+        SET plan_status = 'abandoned'
+        WHERE university_id = %s AND kind = %s
+          AND plan_status = 'planned'
+          AND started_at < NOW() - make_interval(mins => %s);
+    """
+    select_sql = """
+        SELECT run_id
+        FROM matching_runs
+        WHERE university_id = %s AND kind = %s
+          AND plan_status = 'planned'
+        ORDER BY started_at DESC
+        LIMIT 1;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(abandon_sql, (uni_id, kind, max_age_minutes))
+                if cur.rowcount:
+                    logger.warning(f"[uni={uni_id}] {kind}: {cur.rowcount} устаревших планов помечены abandoned")
+                cur.execute(select_sql, (uni_id, kind))
+                row = cur.fetchone()
+                conn.commit()
+                return row[0] if row else None
+    except Exception as e:
+        logger.error(f"get_resumable_run: {e}")
+        return None
+
+
+def _apply_plan_chunk(cur, entries: list, uni_id: int) -> dict:
+    """Записи плана -> {ord: result_id или None}: match_id, group_id или main_request_id."""
+    results = {}
+    by_type = {}
+    for e in entries:
+        by_type.setdefault(e["entry_type"], []).append(e)
+
+    pairs = by_type.get("interest_pair", [])
+    if pairs:
+        created = _insert_interest_matches_chunk(
+            cur, [(e["members"][0], e["members"][1], e["raw"]) for e in pairs], uni_id
+        )
+        results.update({e["ord"]: created.get(tuple(e["members"])) for e in pairs})
+
+    groups = by_type.get("group", [])
+    if groups:
+        created = _insert_meeting_groups_chunk(cur, [(e["members"], e["raw"]) for e in groups], uni_id)
+        results.update({e["ord"]: created.get(e["members"][0]) for e in groups})
+
+    requests = by_type.get("request_pair", [])
+    if requests:
+        paired = _pair_requests_chunk(
+            cur, [(e["request_ids"][0], e["members"][1], e["request_ids"][1]) for e in requests], uni_id
+        )
+        results.update({
+            e["ord"]: e["request_ids"][0] if e["request_ids"][0] in paired else None for e in requests
+        })
+    return results
+
+
+def apply_run_plan(run_id: int, uni_id: int) -> list:
+    """
+    Идемпотентное применение плана: берутся только записи в статусе planned,
+    каждая порция BATCH_WRITE_CHUNK — одна транзакция вместе со сменой статуса
+    (applied с result_id или skipped). Упавший посередине запуск доприменяется
+    повторным вызовом. Возвращает записи, обработанные этим вызовом, со статусом.
+    """
+    select_sql = """
+        SELECT ord, entry_type, members, request_ids, raw_similarity, score
+        FROM matching_run_pairs
+        WHERE run_id = %s AND status = 'planned'
+        ORDER BY ord;
+    """
+    lock_sql = """
+        SELECT ord
+        FROM matching_run_pairs
+        WHERE run_id = %s AND ord = ANY(%s::int[]) AND status = 'planned'
+        FOR UPDATE;
+    """
+    status_sql = """
+        UPDATE matching_run_pairs p
+        SET status = CASE WHEN r.result_id IS NULL THEN 'skipped' ELSE 'applied' END,
+            result_id = r.result_id,
+            applied_at = NOW()
+        FROM unnest(%s::int[], %s::bigint[]) AS r(ord, result_id)
+        WHERE p.run_id = %s AND p.ord = r.ord;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(select_sql, (run_id,))
+                entries = [
+                    {
+                        "ord": row["ord"],
+                        "entry_type": row["entry_type"],
+                        "members": list(row["members"]),
+                        "request_ids": list(row["request_ids"]) if row["request_ids"] else None,
+                        "raw": row["raw_similarity"],
+                        "score": row["score"],
+                    }
+                    for row in cur.fetchall()
+                ]
+    except Exception as e:
+        logger.error(f"apply_run_plan(run_id={run_id}): {e}")
+        return []
+
+    applied = []
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                for start in range(0, len(entries), BATCH_WRITE_CHUNK):
+                    chunk = entries[start:start + BATCH_WRITE_CHUNK]
+                    kinds = {e["entry_type"] for e in chunk}
+                    if kinds & {"interest_pair", "group"}:
+                        _lock_matcher_writes(cur, "interest_write", uni_id)
+                    if "request_pair" in kinds:
+                        _lock_matcher_writes(cur, "requests_write", uni_id)
+                    # под lock — только записи, которые еще никто не применил
+                    cur.execute(lock_sql, (run_id, [e["ord"] for e in chunk]))
+                    still_planned = {row[0] for row in cur.fetchall()}
+                    chunk = [e for e in chunk if e["ord"] in still_planned]
+                    results = _apply_plan_chunk(cur, chunk, uni_id) if chunk else {}
+                    cur.execute(status_sql, (list(results), list(results.values()), run_id))
+                    conn.commit()
+                    for e in chunk:
+                        result_id = results.get(e["ord"])
+                        applied.append({
+                            **e,
+                            "status": "applied" if result_id is not None else "skipped",
+                            "result_id": result_id,
+                        })
+                cur.execute("UPDATE matching_runs SET plan_status = 'applied' WHERE run_id = %s;", (run_id,))
+                conn.commit()
+    except Exception as e:
+        # закоммиченные порции уже отмечены в журнале — остаток доприменит следующий запуск
+        logger.error(f"apply_run_plan(run_id={run_id}): {e}")
+    return applied
+
+
+def _open_direct_connection():
+    """Отдельное (не из пула) autocommit-соединение."""
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        port=os.getenv("DB_PORT"),
+    )
+    conn.set_session(autocommit=True)
+    return conn
+
+
+def open_listen_connection(channel: str):
+    """Отдельное (не из пула) autocommit-соединение с LISTEN на channel."""
+    conn = _open_direct_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {channel};")
+    return conn
+
+
+def _matcher_lock_key(job: str, uni_id: int) -> tuple:
+    return MATCHER_LOCK_NAMESPACE + MATCHER_LOCK_CLASSES[job], uni_id
+
+
+def _lock_matcher_writes(cur, job: str, uni_id: int):
+    """Транзакционный advisory lock: пакетные записи одного вида для вуза идут по очереди."""
+    cur.execute("SELECT pg_advisory_xact_lock(%s, %s);", _matcher_lock_key(job, uni_id))
+
+
+class MatcherLock:
+    """
+    Лидерство реплики мэтчера для (job, university_id) — сессионный advisory lock
+    на отдельном соединении. Если реплика падает, соединение рвется и Postgres
+    сам отпускает lock — резервная реплика забирает его на следующей попытке.
+    """
+
+    def __init__(self, job: str, uni_id: int):
+        self.key = _matcher_lock_key(job, uni_id)
+        self.conn = None
+
+    def acquire(self) -> bool:
+        """Неблокирующая попытка стать лидером; True, если lock уже наш."""
+        if self.conn is not None:
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT 1;")
+                return True
+            except Exception:
+                # соединение потеряно — вместе с ним и lock
+                self._close()
+        try:
+            conn = _open_direct_connection()
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s, %s);", self.key)
+                acquired = cur.fetchone()[0]
+        except Exception as e:
+            logger.error(f"MatcherLock.acquire{self.key}: {e}")
+            return False
+        if acquired:
+            self.conn = conn
+        else:
+            conn.close()
+        return acquired
+
+    def release(self):
+        if self.conn is None:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s, %s);", self.key)
+        except Exception as e:
+            logger.warning(f"MatcherLock.release{self.key}: {e}")
+        self._close()
+
+    def _close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+
+@contextmanager
+def matcher_lock(job: str, uni_id: int):
+    """Лидерство на время запуска: yield True — lock наш, False — запуск идет на другой реплике."""
+    lock = MatcherLock(job, uni_id)
+    acquired = lock.acquire()
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            lock.release()
+
+
+def get_db_time() -> datetime | None:
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT NOW();")
+                return cur.fetchone()[0]
+    except Exception as e:
+        logger.error(f"get_db_time: {e}")
+        return None
+
+
+def get_interest_pool_changes(uni_id: int, since: datetime) -> tuple:
+    """
+    Пользователи, у которых matching_updated_at > since (вход/выход из пула,
+    новый эмбеддинг, смена пола или вуза). Возвращает (rows, db_now):
+    rows — (user_id, in_pool, embedding | None, gender). Без фильтра по вузу,
+    чтобы увидеть и тех, кто из него ушел.
+    """
+    sql = """
+    SELECT
+        user_id,
+        (university_id = %s
+         AND is_searching_interest_match = TRUE
+         AND embedding IS NOT NULL) AS in_pool,
+        CASE WHEN university_id = %s THEN embedding END AS embedding,
+        gender
+    FROM users
+    WHERE matching_updated_at > %s;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT NOW();")
+                db_now = cur.fetchone()[0]
+                cur.execute(sql, (uni_id, uni_id, since))
+                return cur.fetchall(), db_now
+    except Exception as e:
+        logger.error(f"get_interest_pool_changes: {e}")
+        return None, None
+
+
+def get_deleted_user_ids(user_ids: list) -> list | None:
+    """
+    user_id из списка, которых больше нет в users. Удаление строки не проставляет
+    matching_updated_at, поэтому дельта get_interest_pool_changes их не видит.
+    """
+    sql = """
+    SELECT t.user_id
+    FROM unnest(%s::bigint[]) AS t(user_id)
+    WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = t.user_id);
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (list(user_ids),))
+                return [row[0] for row in cur.fetchall()]
+    except Exception as e:
+        logger.error(f"get_deleted_user_ids: {e}")
+        return None
+
+
 def get_user_meeting_history(user_id: int, uni_id: int) -> set:
     sql = """
         SELECT DISTINCT
@@ -1094,6 +2034,101 @@ def get_interest_match_history(user_id: int, uni_id: int, cooldown_days: int = 3
         return set()
 
 
+def get_pool_history_pairs(user_ids: list, uni_id: int, interest_cooldown_days: int | None = None) -> np.ndarray:
+    """
+    Граф исключений для всего пула одним запросом.
+
+    Возвращает массив (m, 2) индексов в user_ids (i < j, отсортирован):
+    пары, которые уже встречались (matched coffee_requests), а при заданном
+    interest_cooldown_days — ещё и имели interest_match или общую группу
+    в пределах cooldown.
+    user_ids может содержать повторы — пара попадает во все комбинации индексов.
+    """
+    interest_sql = """
+        UNION ALL
+        SELECT user_1_id, user_2_id
+        FROM interest_matches
+        WHERE university_id = %(uni_id)s
+          AND created_at > NOW() - make_interval(days => %(cooldown_days)s)
+          AND user_1_id = ANY(%(user_ids)s)
+          AND user_2_id = ANY(%(user_ids)s)
+        UNION ALL
+        SELECT a.user_id, b.user_id
+        FROM meeting_groups g
+        JOIN meeting_group_members a ON a.group_id = g.group_id
+        JOIN meeting_group_members b ON b.group_id = g.group_id AND a.user_id < b.user_id
+        WHERE g.university_id = %(uni_id)s
+          AND g.created_at > NOW() - make_interval(days => %(cooldown_days)s)
+          AND a.user_id = ANY(%(user_ids)s)
+          AND b.user_id = ANY(%(user_ids)s)
+    """
+    sql = f"""
+        WITH pool AS (
+            SELECT user_id, (idx - 1)::int AS idx
+            FROM unnest(%(user_ids)s::bigint[]) WITH ORDINALITY AS p(user_id, idx)
+        ),
+        edges AS (
+            SELECT creator_user_id AS a, partner_user_id AS b
+            FROM coffee_requests
+            WHERE status = 'matched'
+              AND university_id = %(uni_id)s
+              AND partner_user_id IS NOT NULL
+              AND creator_user_id = ANY(%(user_ids)s)
+              AND partner_user_id = ANY(%(user_ids)s)
+            {interest_sql if interest_cooldown_days is not None else ""}
+        )
+        SELECT DISTINCT LEAST(pa.idx, pb.idx), GREATEST(pa.idx, pb.idx)
+        FROM edges e
+        JOIN pool pa ON pa.user_id = e.a
+        JOIN pool pb ON pb.user_id = e.b
+        WHERE pa.idx <> pb.idx
+        ORDER BY 1, 2;
+    """
+    params = {
+        "user_ids": list(user_ids),
+        "uni_id": uni_id,
+        "cooldown_days": interest_cooldown_days,
+    }
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall()
+                if not rows:
+                    return np.empty((0, 2), dtype=np.int64)
+                return np.array(rows, dtype=np.int64)
+    except Exception as e:
+        logger.error(f"get_pool_history_pairs: {e}")
+        return np.empty((0, 2), dtype=np.int64)
+
+
+def get_user_scoring_features(user_ids: list, uni_id: int) -> dict | None:
+    """
+    Признаки для правил скоринга, выровненные по user_ids: no_show_count,
+    coffee_streak (int64) и phystech_school (object, None — не указан).
+    None при ошибке.
+    """
+    sql = """
+        SELECT COALESCE(u.no_show_count, 0), COALESCE(u.coffee_streak, 0), u.phystech_school
+        FROM unnest(%s::bigint[]) WITH ORDINALITY AS p(user_id, idx)
+        LEFT JOIN users u ON u.user_id = p.user_id AND u.university_id = %s
+        ORDER BY p.idx;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (list(user_ids), uni_id))
+                rows = cur.fetchall()
+    except Exception as e:
+        logger.error(f"get_user_scoring_features: {e}")
+        return None
+    return {
+        "no_show_count": np.array([r[0] for r in rows], dtype=np.int64),
+        "coffee_streak": np.array([r[1] for r in rows], dtype=np.int64),
+        "school": np.array([r[2] for r in rows], dtype=object),
+    }
+
+
 def get_new_matches_for_notification(uni_id: int):
     """Matched заявки без отправленного уведомления (атомарно помечает sent)."""
     sql = """
@@ -1239,6 +2274,7 @@ def create_interest_match(user_1: int, user_2: int, similarity: float, uni_id: i
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
+                _lock_matcher_writes(cur, "interest_write", uni_id)
                 cur.execute(check_sql, (uni_id, user_1, user_2, user_1, user_2))
                 if cur.fetchone()[0] > 0:
                     logger.info(f"Skipping: user {user_1} or {user_2} already has active interest_match")
@@ -1253,6 +2289,173 @@ def create_interest_match(user_1: int, user_2: int, similarity: float, uni_id: i
         return None
 
 
+def _insert_interest_matches_chunk(cur, chunk: list, uni_id: int) -> dict:
+    """interest_matches одним statement; возвращает {(user_1_id, user_2_id): match_id}."""
+    sql = """
+    WITH batch AS (
+        SELECT *
+        FROM unnest(%(user_1)s::bigint[], %(user_2)s::bigint[], %(similarity)s::real[])
+            WITH ORDINALITY AS b(user_1_id, user_2_id, similarity_score, ord)
+    ),
+    allowed AS (
+        SELECT b.*
+        FROM batch b
+        WHERE NOT EXISTS (
+            SELECT 1 FROM interest_matches im
+            WHERE im.status IN ('proposed', 'negotiating')
+              AND im.university_id = %(uni_id)s
+              AND (im.user_1_id IN (b.user_1_id, b.user_2_id)
+                   OR im.user_2_id IN (b.user_1_id, b.user_2_id))
+        )
+        AND NOT EXISTS (
+            SELECT 1
+            FROM meeting_group_members gm
+            JOIN meeting_groups g ON g.group_id = gm.group_id
+            WHERE g.status = 'active'
+              AND g.university_id = %(uni_id)s
+              AND gm.user_id IN (b.user_1_id, b.user_2_id)
+        )
+    ),
+    inserted AS (
+        INSERT INTO interest_matches (user_1_id, user_2_id, similarity_score, university_id)
+        SELECT user_1_id, user_2_id, similarity_score, %(uni_id)s
+        FROM allowed
+        ORDER BY ord
+        RETURNING match_id, user_1_id, user_2_id
+    ),
+    reset AS (
+        UPDATE users
+        SET is_searching_interest_match = FALSE
+        WHERE university_id = %(uni_id)s
+          AND user_id IN (SELECT user_1_id FROM inserted UNION SELECT user_2_id FROM inserted)
+    )
+    SELECT match_id, user_1_id, user_2_id FROM inserted;
+    """
+    cur.execute(sql, {
+        "user_1": [p[0] for p in chunk],
+        "user_2": [p[1] for p in chunk],
+        "similarity": [float(p[2]) for p in chunk],
+        "uni_id": uni_id,
+    })
+    return {(user_1, user_2): match_id for match_id, user_1, user_2 in cur.fetchall()}
+
+
+def _insert_meeting_groups_chunk(cur, chunk: list, uni_id: int) -> dict:
+    """Групповые встречи одним statement; возвращает {lead_user_id: group_id}."""
+    sql = """
+    WITH members AS (
+        SELECT * FROM unnest(%(member_ord)s::int[], %(member_id)s::bigint[]) AS m(ord, user_id)
+    ),
+    batch AS (
+        SELECT *
+        FROM unnest(%(lead)s::bigint[], %(similarity)s::real[])
+            WITH ORDINALITY AS b(lead_user_id, avg_similarity, ord)
+    ),
+    allowed AS (
+        SELECT b.*
+        FROM batch b
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM members m
+            JOIN interest_matches im
+              ON m.user_id IN (im.user_1_id, im.user_2_id)
+            WHERE m.ord = b.ord
+              AND im.status IN ('proposed', 'negotiating')
+              AND im.university_id = %(uni_id)s
+        )
+        AND NOT EXISTS (
+            SELECT 1
+            FROM members m
+            JOIN meeting_group_members gm ON gm.user_id = m.user_id
+            JOIN meeting_groups g ON g.group_id = gm.group_id
+            WHERE m.ord = b.ord
+              AND g.status = 'active'
+              AND g.university_id = %(uni_id)s
+        )
+    ),
+    inserted AS (
+        INSERT INTO meeting_groups (university_id, lead_user_id, avg_similarity)
+        SELECT %(uni_id)s, lead_user_id, avg_similarity
+        FROM allowed
+        ORDER BY ord
+        RETURNING group_id, lead_user_id
+    ),
+    inserted_members AS (
+        INSERT INTO meeting_group_members (group_id, user_id)
+        SELECT i.group_id, m.user_id
+        FROM inserted i
+        JOIN allowed a ON a.lead_user_id = i.lead_user_id
+        JOIN members m ON m.ord = a.ord
+    ),
+    reset AS (
+        UPDATE users
+        SET is_searching_interest_match = FALSE
+        WHERE university_id = %(uni_id)s
+          AND user_id IN (SELECT m.user_id FROM members m JOIN allowed a ON a.ord = m.ord)
+    )
+    SELECT group_id, lead_user_id FROM inserted;
+    """
+    cur.execute(sql, {
+        "member_ord": [k + 1 for k, (members, _) in enumerate(chunk) for _ in members],
+        "member_id": [int(u) for members, _ in chunk for u in members],
+        "lead": [int(members[0]) for members, _ in chunk],
+        "similarity": [float(sim) for _, sim in chunk],
+        "uni_id": uni_id,
+    })
+    return {lead_user_id: group_id for group_id, lead_user_id in cur.fetchall()}
+
+
+def get_new_meeting_groups_for_notification(uni_id: int) -> list:
+    """
+    Групповые встречи без отправленного уведомления (атомарно помечает sent).
+    Возвращает [{group_id, lead_user_id, avg_similarity, members: [{user_id, first_name, username, bio}]}].
+    """
+    sql = """
+    WITH fresh AS (
+        UPDATE meeting_groups
+        SET is_notification_sent = TRUE
+        WHERE group_id IN (
+            SELECT group_id
+            FROM meeting_groups
+            WHERE is_notification_sent = FALSE
+              AND university_id = %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING group_id, lead_user_id, avg_similarity
+    )
+    SELECT f.group_id, f.lead_user_id, f.avg_similarity, u.user_id, u.first_name, u.username, u.bio
+    FROM fresh f
+    JOIN meeting_group_members gm ON gm.group_id = f.group_id
+    JOIN users u ON u.user_id = gm.user_id
+    ORDER BY f.group_id, u.user_id;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(sql, (uni_id,))
+                rows = cur.fetchall()
+                conn.commit()
+    except Exception as e:
+        logger.error(f"get_new_meeting_groups_for_notification: {e}")
+        return []
+
+    groups = {}
+    for row in rows:
+        group = groups.setdefault(row["group_id"], {
+            "group_id": row["group_id"],
+            "lead_user_id": row["lead_user_id"],
+            "avg_similarity": row["avg_similarity"],
+            "members": [],
+        })
+        group["members"].append({
+            "user_id": row["user_id"],
+            "first_name": row["first_name"],
+            "username": row["username"],
+            "bio": row["bio"],
+        })
+    return list(groups.values())
+
+
 def get_pending_interest_match(user_id: int, uni_id: int) -> dict | None:
     """
     Возвращает активный interest_match для пользователя (proposed или negotiating).
@@ -1485,6 +2688,64 @@ def expire_interest_matches(uni_id: int) -> list:
         return []
 
 
+def expire_meeting_groups(uni_id: int) -> list:
+    """
+    Экспирирует активные групповые встречи с истекшим expires_at.
+    Возвращает [(group_id, [user_id участников])].
+    """
+    sql = """
+    WITH expired AS (
+        UPDATE meeting_groups
+        SET status = 'expired'
+        WHERE group_id IN (
+            SELECT group_id
+            FROM meeting_groups
+            WHERE university_id = %s
+              AND status = 'active'
+              AND expires_at < NOW()
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING group_id
+    )
+    SELECT e.group_id, array_agg(gm.user_id ORDER BY gm.user_id)
+    FROM expired e
+    JOIN meeting_group_members gm ON gm.group_id = e.group_id
+    GROUP BY e.group_id;
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (uni_id,))
+                expired = [(group_id, list(members)) for group_id, members in cur.fetchall()]
+                conn.commit()
+                return expired
+    except Exception as e:
+        logger.error(f"expire_meeting_groups: {e}")
+        return []
+
+
+def has_active_meeting_group(user_id: int, uni_id: int) -> bool:
+    """Состоит ли пользователь в активной групповой встрече."""
+    sql = """
+    SELECT EXISTS (
+        SELECT 1
+        FROM meeting_group_members gm
+        JOIN meeting_groups g ON g.group_id = gm.group_id
+        WHERE gm.user_id = %s
+          AND g.university_id = %s
+          AND g.status = 'active'
+    );
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (user_id, uni_id))
+                return cur.fetchone()[0]
+    except Exception as e:
+        logger.error(f"has_active_meeting_group: {e}")
+        return False
+
+
 def get_stale_interest_proposals(uni_id: int) -> list:
     """
     Находит negotiating interest_matches, где партнер не ответил >6 часов
@@ -0,0 +1,190 @@
+"""
+Компактное представление эмбеддингов для мэтчера, кэшей и снимков пула.
+
+Формат задается per-university в config/*.json, раздел "embedding":
+
+    {"format": "float16", "projection": "data/projections/mipt_pca128_v1.npz"}
+
+format — тип хранения (float32 | float16), projection — необязательная
+PCA-проекция в меньшую размерность (файл из fit_projection, с версией).
+Коды — нормированные строки (после проекции) в типе хранения; similarity
+всегда считается в float32 по decode(codes).
+"""
+
+import os
+import logging
+from functools import lru_cache
+from datetime import datetime, timezone
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_STORAGE_DTYPES = {"float32": np.float32, "float16": np.float16}
+DEFAULT_EMBEDDING_FORMAT = "float32"
+# Сколько строк брать для обучения проекции
+PROJECTION_FIT_SAMPLE = int(os.getenv("PROJECTION_FIT_SAMPLE", "20000"))
+
+
+def normalize_embeddings(embeddings) -> np.ndarray:
+    """
+    Эмбеддинги -> float32 матрица (n, dim) с единичными строками.
+    Нулевые векторы остаются нулевыми (similarity с ними = 0, как в cosine_similarity).
+    """
+    matrix = np.array(embeddings, dtype=np.float32)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(embeddings), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+class PcaProjection:
+    """
+    Линейная проекция (dim, source_dim) на главные компоненты нормированных эмбеддингов.
+    Без центрирования: скалярные произведения сохраняются в той же шкале, что и
+    пороги similarity мэтчеров.
+    """
+
+    def __init__(self, components: np.ndarray, version: int, fitted_at: str = "", explained: float = 0.0):
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.version = int(version)
+        self.fitted_at = fitted_at
+        self.explained = float(explained)
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def source_dim(self) -> int:
+        return self.components.shape[1]
+
+    def project(self, normed: np.ndarray) -> np.ndarray:
+        if normed.shape[1] != self.source_dim:
+            raise ValueError(f"projection expects dim {self.source_dim}, got {normed.shape[1]}")
+        return normed @ self.components.T
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(
+            path,
+            components=self.components,
+            version=np.array(self.version),
+            fitted_at=np.array(self.fitted_at),
+            explained=np.array(self.explained),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "PcaProjection":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["components"],
+                int(data["version"]),
+                str(data["fitted_at"]),
+                float(data["explained"]),
+            )
+
+
+def fit_projection(embeddings, dim: int, version: int, seed: int = 0) -> PcaProjection:
+    """PCA-проекция в dim измерений по (не более PROJECTION_FIT_SAMPLE) строкам пула."""
+    normed = normalize_embeddings(embeddings)
+    if not 0 < dim < normed.shape[1]:
+        raise ValueError(f"projection dim must be in 1..{normed.shape[1] - 1}, got {dim}")
+    if len(normed) > PROJECTION_FIT_SAMPLE:
+        rng = np.random.default_rng(seed)
+        normed = normed[rng.choice(len(normed), size=PROJECTION_FIT_SAMPLE, replace=False)]
+    _, singular, vt = np.linalg.svd(normed.astype(np.float64), full_matrices=False)
+    energy = singular ** 2
+    return PcaProjection(
+        vt[:dim],
+        version,
+        fitted_at=datetime.now(timezone.utc).isoformat(),
+        explained=float(energy[:dim].sum() / energy.sum()) if energy.sum() else 0.0,
+    )
+
+
+class EmbeddingCodec:
+    """Эмбеддинги <-> компактные коды: [проекция] -> нормировка -> тип хранения."""
+
+    def __init__(self, storage: str = DEFAULT_EMBEDDING_FORMAT, projection: PcaProjection | None = None):
+        if storage not in EMBEDDING_STORAGE_DTYPES:
+            raise ValueError(f"unknown embedding format '{storage}'")
+        self.storage = storage
+        self.dtype = EMBEDDING_STORAGE_DTYPES[storage]
+        self.projection = projection
+
+    @property
+    def is_identity(self) -> bool:
+        return self.storage == "float32" and self.projection is None
+
+    def describe(self) -> str:
+        """Версия формата: коды с разным describe() несовместимы."""
+        if self.projection is None:
+            return self.storage
+        return f"{self.storage}+pca{self.projection.dim}v{self.projection.version}"
+
+    def encode(self, embeddings) -> np.ndarray:
+        normed = normalize_embeddings(embeddings)
+        if self.projection is not None and len(normed):
+            normed = normalize_embeddings(self.projection.project(normed))
+        return normed.astype(self.dtype, copy=False)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Коды -> float32 матрица для matmul (для float32 — без копии)."""
+        return codes.astype(np.float32, copy=False)
+
+    def prepare(self, embeddings) -> np.ndarray:
+        """То, что видит мэтчер: decode(encode(embeddings))."""
+        return self.decode(self.encode(embeddings))
+
+    def bytes_per_vector(self, source_dim: int) -> int:
+        dim = self.projection.dim if self.projection is not None else source_dim
+        return dim * np.dtype(self.dtype).itemsize
+
+
+@lru_cache(maxsize=None)
+def _load_projection(path: str) -> PcaProjection:
+    return PcaProjection.load(path)
+
+
+def codec_from_config(config: dict | None) -> EmbeddingCodec:
+    """Кодек из раздела "embedding" конфига вуза (нет раздела — float32 без проекции)."""
+    config = config or {}
+    projection = _load_projection(config["projection"]) if config.get("projection") else None
+    return EmbeddingCodec(config.get("format", DEFAULT_EMBEDDING_FORMAT), projection)
+
+
+def rank_quality(embeddings, codec: EmbeddingCodec, k: int = 10, queries: int = 1000, seed: int = 0) -> dict:
+    """
+    Потери кодека против полной точности на выборке запросов: recall@k соседей
+    по cosine и ошибка самой similarity.
+    """
+    full = normalize_embeddings(embeddings)
+    n = len(full)
+    k = min(k, n - 1)
+    if k < 1:
+        return {"queries": 0}
+    compact = codec.prepare(full)
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(n, size=min(queries, n), replace=False)
+    exact = full[rows] @ full.T
+    approx = compact[rows] @ compact.T
+    error = np.abs(exact - approx)
+    exact[np.arange(len(rows)), rows] = -np.inf
+    approx[np.arange(len(rows)), rows] = -np.inf
+
+    exact_top = np.argpartition(-exact, k - 1, axis=1)[:, :k]
+    approx_top = np.argpartition(-approx, k - 1, axis=1)[:, :k]
+    hits = sum(len(np.intersect1d(e, a, assume_unique=True)) for e, a in zip(exact_top, approx_top))
+
+    return {
+        "codec": codec.describe(),
+        "queries": int(len(rows)),
+        "k": int(k),
+        "recall_at_k": round(hits / (len(rows) * k), 4),
+        "mean_abs_error": round(float(error.mean()), 5),
+        "max_abs_error": round(float(error.max()), 5),
+        "bytes_per_vector": codec.bytes_per_vector(full.shape[1]),
+        "full_bytes_per_vector": full.shape[1] * 4,
+    }
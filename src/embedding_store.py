@@ -0,0 +1,254 @@
+"""
+Общее memory-mapped хранилище эмбеддингов на хосте (per-university).
+
+worker дописывает сюда каждый посчитанный эмбеддинг, matcher и online_matcher
+мапят файлы только на чтение и берут векторы без выгрузки из Postgres —
+в память подтягиваются лишь те страницы, которых касается запрос.
+
+Каталог EMBEDDING_STORE_DIR/uni_<id>/:
+    meta.json              — dim, rows, generation, updated_at (пишется атомарно, последним)
+    vectors.<gen>.f32      — float32 матрица (rows, dim), только дописывается
+    ids.<gen>.i64          — user_id строки
+    tombstones.<gen>.bits  — битовая карта удаленных/замененных строк
+
+Писатель один (worker). Новая версия эмбеддинга дописывается строкой в конец,
+старая строка помечается в tombstones после публикации meta; если на миг видны
+обе, читатель берет последнюю. Когда удаленных строк больше STORE_COMPACT_RATIO,
+worker переписывает живые строки в файлы нового поколения — открытые читателями
+старые файлы остаются валидными до их переоткрытия.
+"""
+
+import os
+import json
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "/tmp/embedding_store")
+# Доля удаленных строк, после которой worker компактирует файлы
+STORE_COMPACT_RATIO = float(os.getenv("STORE_COMPACT_RATIO", "0.3"))
+STORE_COMPACT_MIN_ROWS = 1000
+STORE_FORMAT_VERSION = 1
+STORE_FILE_SUFFIXES = {"vectors": "f32", "ids": "i64", "tombstones": "bits"}
+
+
+class EmbeddingStore:
+    """Читатель: zero-copy отображение файлов хранилища вуза."""
+
+    def __init__(self, uni_id: int, root: str = EMBEDDING_STORE_DIR):
+        self.uni_id = uni_id
+        self.path = os.path.join(root, f"uni_{uni_id}")
+        self.meta = None
+        self.vectors = None
+        self.ids = None
+        self._tombstones = None
+        self._mapped = None
+        self._index_ids = np.empty(0, dtype=np.int64)
+        self._index_rows = np.empty(0, dtype=np.int64)
+
+    @property
+    def rows(self) -> int:
+        return self.meta["rows"] if self.meta else 0
+
+    @property
+    def dim(self) -> int:
+        return self.meta["dim"] if self.meta else 0
+
+    def _file(self, name: str, generation: int | None = None) -> str:
+        gen = self.meta["generation"] if generation is None else generation
+        return os.path.join(self.path, f"{name}.{gen}.{STORE_FILE_SUFFIXES[name]}")
+
+    def _read_meta(self) -> dict | None:
+        try:
+            with open(os.path.join(self.path, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return meta if meta.get("version") == STORE_FORMAT_VERSION else None
+
+    def _map(self):
+        rows, dim = self.rows, self.dim
+        self._mapped = None
+        if rows == 0:
+            self.vectors = np.empty((0, dim), dtype=np.float32)
+            self.ids = np.empty(0, dtype=np.int64)
+            self._tombstones = np.zeros(0, dtype=np.uint8)
+            self._mapped = (rows, self.meta["generation"])
+            return
+        self.vectors = np.memmap(self._file("vectors"), dtype="<f4", mode="r", shape=(rows, dim))
+        self.ids = np.memmap(self._file("ids"), dtype="<i8", mode="r", shape=(rows,))
+        self._tombstones = np.memmap(self._file("tombstones"), dtype=np.uint8, mode="r")
+        self._mapped = (rows, self.meta["generation"])
+
+    def refresh(self) -> bool:
+        """Перечитывает meta и перемапливает файлы. False — хранилища нет."""
+        meta = self._read_meta()
+        if meta is None:
+            self.meta = None
+            return False
+        self.meta = meta
+        if self._mapped != (meta["rows"], meta["generation"]):
+            try:
+                self._map()
+            except (FileNotFoundError, ValueError) as e:
+                # компактация между чтением meta и открытием файлов — подхватим в следующий раз
+                logger.warning(f"[uni={self.uni_id}] Хранилище эмбеддингов недоступно: {e}")
+                self.meta = None
+                return False
+        self._build_index()
+        return True
+
+    def live_mask(self) -> np.ndarray:
+        bits = np.unpackbits(np.asarray(self._tombstones), count=self.rows, bitorder="little")
+        return bits == 0
+
+    def _build_index(self):
+        """Отсортированные (user_id, строка) живых строк; для дубликатов — последняя строка."""
+        rows = np.nonzero(self.live_mask())[0][::-1]
+        ids = np.asarray(self.ids[rows])
+        ids, first = np.unique(ids, return_index=True)
+        self._index_ids, self._index_rows = ids, rows[first]
+
+    def age_seconds(self) -> float:
+        return time.time() - self.meta["updated_at"] if self.meta else float("inf")
+
+    def __len__(self):
+        return len(self._index_ids)
+
+    def lookup(self, user_ids) -> np.ndarray:
+        """Строки хранилища для user_ids (-1 — нет в хранилище)."""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        if not len(self._index_ids):
+            return np.full(len(user_ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._index_ids, user_ids), len(self._index_ids) - 1)
+        return np.where(self._index_ids[pos] == user_ids, self._index_rows[pos], -1)
+
+    def get(self, user_ids) -> tuple:
+        """(found bool (n,), float32 (n, dim)); строки ненайденных — нули."""
+        rows = self.lookup(user_ids)
+        found = rows >= 0
+        out = np.zeros((len(rows), self.dim), dtype=np.float32)
+        out[found] = self.vectors[rows[found]]
+        return found, out
+
+    @classmethod
+    def open(cls, uni_id: int, root: str = EMBEDDING_STORE_DIR) -> "EmbeddingStore | None":
+        store = cls(uni_id, root)
+        return store if store.refresh() else None
+
+
+class EmbeddingStoreWriter(EmbeddingStore):
+    """Писатель (worker): дописывает строки, ставит tombstones, компактирует."""
+
+    def __init__(self, uni_id: int, dim: int, root: str = EMBEDDING_STORE_DIR):
+        super().__init__(uni_id, root)
+        os.makedirs(self.path, exist_ok=True)
+        meta = self._read_meta()
+        if meta is None or meta["dim"] != dim:
+            meta = {"version": STORE_FORMAT_VERSION, "dim": dim, "rows": 0,
+                    "generation": (meta or {}).get("generation", 0) + 1, "updated_at": time.time()}
+        self.meta = meta
+        self._recover()
+        self._publish()
+        self.refresh()
+
+    def _recover(self):
+        """Обрезает хвосты, записанные после последней публикации meta (падение посреди записи)."""
+        rows, dim = self.rows, self.dim
+        for name, size in (("vectors", rows * dim * 4), ("ids", rows * 8), ("tombstones", (rows + 7) // 8)):
+            with open(self._file(name), "ab") as f:
+                f.truncate(size)
+
+    def _publish(self):
+        self.meta["updated_at"] = time.time()
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    def _set_tombstones(self, rows: np.ndarray):
+        if not len(rows):
+            return
+        with open(self._file("tombstones"), "r+b") as f:
+            for row in np.unique(rows).tolist():
+                f.seek(row >> 3)
+                byte = f.read(1)[0]
+                f.seek(row >> 3)
+                f.write(bytes([byte | (1 << (row & 7))]))
+
+    def touch(self):
+        """Heartbeat: читатели доверяют хранилищу, пока worker его обновляет."""
+        self._publish()
+
+    def upsert(self, user_ids, embeddings):
+        """Новые версии эмбеддингов: строки в конец, старые версии — в tombstones."""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        if not len(user_ids):
+            return
+        vectors = np.asarray(embeddings, dtype="<f4").reshape(len(user_ids), self.dim)
+        stale = self.lookup(user_ids)
+
+        start = self.rows
+        with open(self._file("vectors"), "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self._file("ids"), "ab") as f:
+            f.write(user_ids.astype("<i8").tobytes())
+        with open(self._file("tombstones"), "ab") as f:
+            f.write(bytes((start + len(user_ids) + 7) // 8 - (start + 7) // 8))
+
+        self.meta["rows"] = start + len(user_ids)
+        self._publish()
+        self._set_tombstones(stale[stale >= 0])
+        self.refresh()
+
+    def remove(self, user_ids):
+        rows = self.lookup(user_ids)
+        if (rows >= 0).any():
+            self._set_tombstones(rows[rows >= 0])
+            self._publish()
+            self.refresh()
+
+    def reconcile(self, user_ids, embeddings) -> tuple:
+        """
+        Сверка с полным набором из БД: ушедших — в tombstones, новых и изменившихся —
+        дописать. Возвращает (дописано, удалено).
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(user_ids), self.dim)
+
+        removed = np.setdiff1d(self._index_ids, user_ids)
+        self.remove(removed)
+
+        found, current = self.get(user_ids)
+        changed = ~found | (current != embeddings).any(axis=1)
+        self.upsert(user_ids[changed], embeddings[changed])
+        self.maybe_compact()
+        return int(changed.sum()), len(removed)
+
+    def maybe_compact(self) -> bool:
+        dead = self.rows - len(self)
+        if self.rows < STORE_COMPACT_MIN_ROWS or dead <= STORE_COMPACT_RATIO * self.rows:
+            return False
+
+        rows = np.sort(self._index_rows)
+        old_generation = self.meta["generation"]
+        new_generation = old_generation + 1
+        with open(self._file("vectors", new_generation), "wb") as f:
+            f.write(np.ascontiguousarray(self.vectors[rows]).tobytes())
+        with open(self._file("ids", new_generation), "wb") as f:
+            f.write(np.asarray(self.ids[rows]).astype("<i8").tobytes())
+        with open(self._file("tombstones", new_generation), "wb") as f:
+            f.write(bytes((len(rows) + 7) // 8))
+
+        self.meta.update(rows=len(rows), generation=new_generation)
+        self._publish()
+        for name in ("vectors", "ids", "tombstones"):
+            try:
+                os.remove(self._file(name, old_generation))
+            except FileNotFoundError:
+                pass
+        self.refresh()
+        logger.info(f"[uni={self.uni_id}] Хранилище эмбеддингов компактировано: {dead} удаленных строк, живых {len(rows)}")
+        return True
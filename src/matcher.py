@@ -1,13 +1,32 @@
+import os
 import numpy as np
 import logging
+import heapq
+import time
+import threading
+import contextvars
+import multiprocessing
+import networkx as nx
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import NamedTuple
+from src.ann_index import ASSIGN_CHUNK_ROWS, ann_neighbors, assign_clusters, minibatch_kmeans
+from src.embedding_codec import EmbeddingCodec, codec_from_config, normalize_embeddings
+from src.embedding_store import EmbeddingStore
+from src.run_metrics import matching_run, phase, count, current_run
+from src.scoring import active_weights, build_scorer, encode_schools, required_features
 from datetime import datetime, timezone, timedelta
 from src.db import (
     get_pending_requests_for_matching,
-    get_user_meeting_history,
-    get_interest_match_history,
-    pair_user_for_request,
+    get_pool_history_pairs,
     get_interest_search_users,
-    create_interest_match,
+    fetch_interest_pool_arrays,
+    fetch_request_pool_arrays,
+    get_user_scoring_features,
+    matcher_lock,
+    save_run_plan,
+    apply_run_plan,
+    get_resumable_run,
 )
 
 logger = logging.getLogger(__name__)
@@ -18,6 +37,70 @@ VALENTINE_END = datetime(2026, 2, 16, tzinfo=MOSCOW_TZ)
 VALENTINE_CROSS_GENDER_BOOST = 0.25
 
 INTEREST_SIMILARITY_THRESHOLD = 0.15
+INTEREST_HISTORY_COOLDOWN_DAYS = 30
+
+# greedy | max_weight | max_cardinality (сначала максимум пар, потом максимум веса)
+MATCHING_ENGINE = os.getenv("MATCHING_ENGINE", "greedy")
+MAX_WEIGHT_TIME_BUDGET_SECONDS = float(os.getenv("MAX_WEIGHT_TIME_BUDGET_SECONDS", "60"))
+# networkx blossom растет как вершины × рёбра: замер ~2 мкс на (вершина, ребро) —
+# 500 вершин / 5k рёбер ≈ 5s, 1500 / 10k ≈ 32s, 1500 / 20k ≈ 61s. Графы, которые по
+# оценке не уложатся в бюджет, сразу идут в greedy, не сжигая бюджет на попытку
+MAX_WEIGHT_SECONDS_PER_NODE_EDGE = float(os.getenv("MAX_WEIGHT_SECONDS_PER_NODE_EDGE", "2e-6"))
+MAX_WEIGHT_MAX_EDGES = int(os.getenv("MAX_WEIGHT_MAX_EDGES", "20000"))
+# Бюджет MAX_WEIGHT_TIME_BUDGET_SECONDS — один на запуск (все корзины/кластеры вместе),
+# blossom считается по одному графу за раз
+MAX_WEIGHT_DEADLINE = contextvars.ContextVar("max_weight_deadline", default=None)
+_BLOSSOM_SLOT = threading.Lock()
+
+# С какого размера пула кандидаты берутся из ANN-индекса вместо всех n^2 пар
+ANN_MIN_POOL = int(os.getenv("ANN_MIN_POOL", "3000"))
+ANN_TOP_K = int(os.getenv("ANN_TOP_K", "50"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_TARGET_RECALL = float(os.getenv("ANN_TARGET_RECALL", "0.95"))
+ANN_RECALL_SAMPLE = int(os.getenv("ANN_RECALL_SAMPLE", "200"))
+
+# Векторы берутся из общего хранилища worker'а (src.embedding_store), пока оно не старше этого
+EMBEDDING_STORE_MAX_AGE_SECONDS = float(os.getenv("EMBEDDING_STORE_MAX_AGE_SECONDS", "300"))
+EMBEDDING_STORES = {}
+
+# План упавшего запуска моложе этого возраста доприменяется вместо пересчета
+MATCHER_RESUME_MAX_AGE_MINUTES = int(os.getenv("MATCHER_RESUME_MAX_AGE_MINUTES", "60"))
+
+# Кластерный (приближённый) мэтчинг по интересам для самых больших пулов: пул режется
+# mini-batch k-means на кластеры ~INTEREST_CLUSTER_SIZE, движок работает внутри кластеров
+# параллельно, оставшиеся без пары — перекрестным проходом. 0 — выключен
+INTEREST_CLUSTER_MIN_POOL = int(os.getenv("INTEREST_CLUSTER_MIN_POOL", "0"))
+INTEREST_CLUSTER_SIZE = int(os.getenv("INTEREST_CLUSTER_SIZE", "2000"))
+INTEREST_CLUSTER_WORKERS = int(os.getenv("INTEREST_CLUSTER_WORKERS", "4"))
+
+# Групповые встречи по интересам: 2 — только пары; 3 — оставшиеся без пары добавляются
+# в пары третьими; 4 — пары ещё и сливаются в четверки
+INTEREST_GROUP_SIZE = int(os.getenv("INTEREST_GROUP_SIZE", "2"))
+# Сколько лучших групп рассматриваем для каждого оставшегося без пары
+GROUP_ATTACH_TOP = 8
+
+# auto — ANN от ANN_MIN_POOL, иначе exact; exact — плотная матрица, а если она не
+# влезает в MATCHER_MEMORY_LIMIT_MB — обход блоками (tiled); ann/tiled — принудительно
+SIMILARITY_MODE = os.getenv("SIMILARITY_MODE", "auto")
+MATCHER_MEMORY_LIMIT_MB = float(os.getenv("MATCHER_MEMORY_LIMIT_MB", "512"))
+TILED_TOP_K = int(os.getenv("TILED_TOP_K", "32"))
+# Байт на элемент плотного пути: raw + score (float32) + булевы маски
+DENSE_BYTES_PER_PAIR = 10
+# Байт на элемент блока в tiled-пути: raw + score (float32) + маски + временные
+TILE_BYTES_PER_PAIR = 24
+
+# Совместимость заявок на кофе: разница во времени встречи и кофейня
+MATCH_TIME_WINDOW_MINUTES = int(os.getenv("MATCH_TIME_WINDOW_MINUTES", "60"))
+MATCH_SAME_SHOP_ONLY = os.getenv("MATCH_SAME_SHOP_ONLY", "true").lower() in ("1", "true", "yes")
+MATCH_BUCKET_WORKERS = int(os.getenv("MATCH_BUCKET_WORKERS", "4"))
+
+
+class CandidatePairs(NamedTuple):
+    """Кандидаты в пары (индексы i < j), отсортированные по убыванию score."""
+    rows: np.ndarray
+    cols: np.ndarray
+    score: np.ndarray  # с бустами — по нему выбираем пары
+    raw: np.ndarray  # чистый cosine similarity — для аналитики
 
 
 def is_valentine_period() -> bool:
@@ -44,194 +127,1222 @@ def cosine_similarity(vec1, vec2):
 
 
 def parse_pgvector_string(vec_str):
-    """Строка pgvector -> numpy array."""
+    """Строка pgvector -> float32 numpy array (pgvector хранит float4)."""
     if isinstance(vec_str, (list, np.ndarray)):
-        return np.array(vec_str)
+        return np.array(vec_str, dtype=np.float32)
 
-    vec_str = vec_str.strip('[]')
-    values = [float(x.strip()) for x in vec_str.split(',')]
-    return np.array(values)
+    return np.array(vec_str.strip('[]').split(','), dtype=np.float32)
 
 
-def greedy_matching(requests, uni_id: int):
-    if len(requests) < 2:
-        logger.info(f"Недостаточно заявок для мэтчинга ({len(requests)})")
-        return []
+def _apply_scorer(raw, rows, cols, scorer):
+    """
+    Правила скоринга (src.scoring) поверх raw similarity. rows/cols — индексы пула
+    любой совместимой формы: (n, 1) и (1, n) для матрицы, (m,) и (m,) для списка рёбер.
+    """
+    if scorer is None:
+        return raw
+    return scorer(raw, rows, cols)
 
-    n = len(requests)
-    logger.info(f"Мэтчинг для {n} заявок")
 
-    request_ids = [r[0] for r in requests]
-    creator_ids = [r[1] for r in requests]
-    embeddings = [parse_pgvector_string(r[2]) for r in requests]
+def _compatible_mask(rows, cols, compatible):
+    """Маска совместимых пар (None — совместимы все); формы rows/cols — как у _apply_scorer."""
+    if compatible is None:
+        return True
+    return compatible(rows, cols)
 
-    meeting_histories = {}
-    for user_id in creator_ids:
-        meeting_histories[user_id] = get_user_meeting_history(user_id, uni_id)
 
-    similarity_matrix = np.zeros((n, n))
-    for i in range(n):
-        # верхний треугольник — матрица симметрична
-        for j in range(i + 1, n):
-            sim = cosine_similarity(embeddings[i], embeddings[j])
-            similarity_matrix[i][j] = sim
-            similarity_matrix[j][i] = sim
+def _pair_keys(pairs: np.ndarray, n: int) -> np.ndarray:
+    """Пары индексов -> уникальные ключи i * n + j (i < j), по возрастанию."""
+    i = np.minimum(pairs[:, 0], pairs[:, 1])
+    j = np.maximum(pairs[:, 0], pairs[:, 1])
+    distinct = i != j
+    return np.unique(i[distinct].astype(np.int64) * n + j[distinct])
 
-    matched_pairs = []
-    used_indices = set()
 
-    candidate_pairs = []
-    for i in range(n):
-        for j in range(i + 1, n):
-            user_i = creator_ids[i]
-            user_j = creator_ids[j]
+def _sorted_candidates(rows, cols, score, raw) -> CandidatePairs:
+    # stable — при равных score порядок как у прежнего перебора (i, j)
+    with phase("sort"):
+        order = np.argsort(-score, kind="stable")
+        return CandidatePairs(rows=rows[order], cols=cols[order], score=score[order], raw=raw[order])
+
+
+def build_candidate_pairs(
+    normed: np.ndarray,
+    scorer=None,
+    threshold: float | None = None,
+    excluded_pairs: np.ndarray | None = None,
+    compatible=None,
+):
+    """
+    Все пары пула одной матрицей: similarity = normed @ normed.T,
+    буст/порог/история — булевы маски. compatible(rows, cols) — маска допустимых
+    пар (например, окно времени заявок). Возвращает (CandidatePairs, stats).
+    """
+    n = normed.shape[0]
+    raw = normed @ normed.T
+    index = np.arange(n)
+    score = _apply_scorer(raw, index[:, None], index[None, :], scorer)
+
+    keep = np.triu(np.ones((n, n), dtype=bool), k=1)
+    keep &= _compatible_mask(index[:, None], index[None, :], compatible)
+    stats = {"total": n * (n - 1) // 2, "threshold": 0, "history": 0}
+
+    if threshold is not None:
+        keep &= score >= threshold
+        stats["threshold"] = stats["total"] - int(np.count_nonzero(keep))
+
+    if excluded_pairs is not None and len(excluded_pairs):
+        i, j = np.divmod(_pair_keys(excluded_pairs, n), n)
+        stats["history"] = int(np.count_nonzero(keep[i, j]))
+        keep[i, j] = False
+
+    rows, cols = np.nonzero(keep)
+    return _sorted_candidates(rows, cols, score[rows, cols], raw[rows, cols]), stats
+
+
+def build_candidate_pairs_from_edges(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    raw: np.ndarray,
+    n: int,
+    scorer=None,
+    threshold: float | None = None,
+    excluded_pairs: np.ndarray | None = None,
+    compatible=None,
+):
+    """
+    То же, что build_candidate_pairs, но для разреженного набора рёбер
+    (например, top-k соседей из ANN). Дубли (i, j)/(j, i) схлопываются.
+    """
+    keys, first = np.unique(
+        np.minimum(rows, cols).astype(np.int64) * n + np.maximum(rows, cols), return_index=True
+    )
+    raw = raw[first]
+    distinct = (keys // n) != (keys % n)
+    keys, raw = keys[distinct], raw[distinct]
+    rows, cols = np.divmod(keys, n)
+
+    score = _apply_scorer(raw, rows, cols, scorer)
+    keep = np.ones(len(keys), dtype=bool)
+    keep &= _compatible_mask(rows, cols, compatible)
+    stats = {"total": len(keys), "threshold": 0, "history": 0}
+
+    if threshold is not None:
+        keep &= score >= threshold
+        stats["threshold"] = stats["total"] - int(np.count_nonzero(keep))
+
+    if excluded_pairs is not None and len(excluded_pairs):
+        excluded = np.isin(keys, _pair_keys(excluded_pairs, n)) & keep
+        stats["history"] = int(np.count_nonzero(excluded))
+        keep &= ~excluded
+
+    return _sorted_candidates(rows[keep], cols[keep], score[keep], raw[keep]), stats
+
+
+def ann_candidate_pairs(normed: np.ndarray, **scoring):
+    """Кандидаты — только top-k соседи каждого пользователя из IVF-индекса."""
+    n = normed.shape[0]
+    neighbors, scores, _ = ann_neighbors(
+        normed,
+        k=ANN_TOP_K,
+        nprobe=ANN_NPROBE,
+        target_recall=ANN_TARGET_RECALL,
+        recall_sample=ANN_RECALL_SAMPLE,
+    )
+    rows = np.repeat(np.arange(n), neighbors.shape[1])
+    cols = neighbors.ravel()
+    found = cols >= 0
+    return build_candidate_pairs_from_edges(
+        rows[found], cols[found], scores.ravel()[found], n, **scoring
+    )
+
+
+def _memory_limit_bytes() -> float:
+    return MATCHER_MEMORY_LIMIT_MB * 1024 * 1024
+
+
+def _directed_exclusions(excluded_pairs: np.ndarray | None, n: int):
+    """Исключенные пары в обе стороны, отсортированные по строке: (rows, cols)."""
+    if excluded_pairs is None or not len(excluded_pairs):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    i, j = np.divmod(_pair_keys(excluded_pairs, n), n)
+    rows, cols = np.concatenate([i, j]), np.concatenate([j, i])
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order]
+
+
+def _score_block(normed, start, stop, cols, scorer, threshold, exclusions, compatible=None, stats=None):
+    """
+    Блок similarity для строк [start, stop) против столбцов cols (отсортированы).
+    Недопустимые пары (сама с собой, несовместимые, ниже порога, история) получают score = -inf.
+    Если передан stats — туда добавляются счетчики по верхнему треугольнику.
+    """
+    rows = np.arange(start, stop)
+    raw = normed[start:stop] @ normed[cols].T
+    score = np.array(_apply_scorer(raw, rows[:, None], cols[None, :], scorer), copy=True)
+    score[rows[:, None] == cols[None, :]] = -np.inf
+    if compatible is not None:
+        score[~compatible(rows[:, None], cols[None, :])] = -np.inf
+
+    # stats считаем только для полного блока (cols = все строки пула)
+    if stats is not None:
+        stats["total"] += (stop - start) * (len(cols) - 1) - (start + stop - 1) * (stop - start) // 2
+
+    if threshold is not None:
+        below = score < threshold
+        if stats is not None:
+            stats["threshold"] += int(np.count_nonzero(np.triu(below, start + 1)))
+        score[below] = -np.inf
+
+    ex_rows, ex_cols = exclusions
+    lo, hi = np.searchsorted(ex_rows, [start, stop])
+    if hi > lo:
+        r, c = ex_rows[lo:hi], ex_cols[lo:hi]
+        pos = np.minimum(np.searchsorted(cols, c), len(cols) - 1)
+        present = cols[pos] == c
+        r, pos = r[present] - start, pos[present]
+        if stats is not None:
+            upper = cols[pos] > r + start
+            stats["history"] += int(np.count_nonzero(np.isfinite(score[r[upper], pos[upper]])))
+        score[r, pos] = -np.inf
+
+    return raw, score
+
+
+def _top_k_lists(raw, score, cols, k):
+    """
+    Top-k допустимых столбцов для каждой строки блока (с равными k-му — все).
+    Каждый список отсортирован по (-score, col) — тот же порядок, что у плотного пути.
+    Возвращает (списки (cols, score, raw), флаги «в списке все допустимые столбцы»).
+    """
+    b, m = score.shape
+    k = max(1, min(k, m))
+    kth = np.partition(score, m - k, axis=1)[:, m - k]
+    finite = np.isfinite(score)
+    keep = finite & (score >= kth[:, None])
+
+    rr, cc = np.nonzero(keep)
+    s, r = score[rr, cc], raw[rr, cc]
+    order = np.lexsort((cc, -s, rr))
+    rr, cc, s, r = rr[order], cc[order], s[order], r[order]
+
+    bounds = np.searchsorted(rr, np.arange(b + 1))
+    lists = [
+        (cols[cc[bounds[a]:bounds[a + 1]]], s[bounds[a]:bounds[a + 1]], r[bounds[a]:bounds[a + 1]])
+        for a in range(b)
+    ]
+    complete = keep.sum(axis=1) == finite.sum(axis=1)
+    return lists, complete
+
+
+def _tiled_top_k(normed, scoring, exclusions, k):
+    """Потоковый top-k по строкам: матрица similarity обходится блоками строк."""
+    n = normed.shape[0]
+    tile_rows = max(1, int(_memory_limit_bytes() // (n * TILE_BYTES_PER_PAIR)))
+    all_cols = np.arange(n)
+    stats = {"total": 0, "threshold": 0, "history": 0}
+
+    lists, complete = [], np.zeros(n, dtype=bool)
+    for start in range(0, n, tile_rows):
+        stop = min(start + tile_rows, n)
+        raw, score = _score_block(normed, start, stop, all_cols, exclusions=exclusions, stats=stats, **scoring)
+        tile_lists, tile_complete = _top_k_lists(raw, score, all_cols, k)
+        lists.extend(tile_lists)
+        complete[start:stop] = tile_complete
+
+    logger.info(f"Tiled similarity: {n} строк, блоки по {tile_rows}, top-{k} на строку")
+    return lists, complete, stats
+
+
+def tiled_greedy_pairs(normed: np.ndarray, lists, complete, scoring, exclusions, k) -> CandidatePairs:
+    """
+    Жадное паросочетание без полной матрицы. Куча хранит лучшего известного
+    свободного соседа каждой строки с ключом (-score, i, j), т.е. пары выходят
+    в том же порядке, что и в отсортированном плотном списке. Когда top-k строки
+    исчерпан, он пересчитывается против еще не занятых строк.
+    """
+    n = normed.shape[0]
+    matched = np.zeros(n, dtype=bool)
+    pointer = np.zeros(n, dtype=np.int64)
+    heap = []
+
+    def push_next(row):
+        while True:
+            cols, score, _ = lists[row]
+            p = pointer[row]
+            while p < len(cols) and matched[cols[p]]:
+                p += 1
+            pointer[row] = p
+            if p < len(cols):
+                col = int(cols[p])
+                heapq.heappush(heap, (-float(score[p]), min(row, col), max(row, col), row))
+                return
+            if complete[row]:
+                return
+            free = np.nonzero(~matched)[0]
+            raw, score = _score_block(normed, row, row + 1, free, exclusions=exclusions, **scoring)
+            (lists[row],), (complete[row],) = _top_k_lists(raw, score, free, k)
+            pointer[row] = 0
+
+    for row in range(n):
+        push_next(row)
+
+    picked = []
+    while heap and len(picked) < n // 2:
+        _, i, j, row = heapq.heappop(heap)
+        if matched[row]:
+            continue
+        if matched[i + j - row]:
+            push_next(row)
+            continue
+        matched[i] = matched[j] = True
+        p = pointer[row]
+        picked.append((i, j, lists[row][1][p], lists[row][2][p]))
+
+    if not picked:
+        empty = np.empty(0, dtype=np.int64)
+        return CandidatePairs(empty, empty, np.empty(0, np.float32), np.empty(0, np.float32))
+    rows, cols, score, raw = (np.array(column) for column in zip(*picked))
+    return CandidatePairs(rows=rows, cols=cols, score=score, raw=raw)
+
+
+def tiled_candidate_pairs(
+    normed: np.ndarray,
+    scorer=None,
+    threshold: float | None = None,
+    excluded_pairs: np.ndarray | None = None,
+    compatible=None,
+):
+    """
+    Точный путь с памятью O(n * k): для greedy — сразу итоговые пары (тот же
+    результат, что у плотного пути), для остальных движков — точные top-k рёбра.
+    """
+    n = normed.shape[0]
+    scoring = {"scorer": scorer, "threshold": threshold, "compatible": compatible}
+    exclusions = _directed_exclusions(excluded_pairs, n)
+    k = min(TILED_TOP_K, max(1, n - 1))
+
+    lists, complete, stats = _tiled_top_k(normed, scoring, exclusions, k)
+
+    if MATCHING_ENGINE == "greedy":
+        return tiled_greedy_pairs(normed, lists, complete, scoring, exclusions, k), stats
+
+    rows = np.repeat(np.arange(n), [len(cols) for cols, _, _ in lists])
+    cols = np.concatenate([cols for cols, _, _ in lists]) if n else np.empty(0, dtype=np.int64)
+    raw = np.concatenate([r for _, _, r in lists]) if n else np.empty(0, dtype=np.float32)
+    candidates, _ = build_candidate_pairs_from_edges(rows, cols, raw, n, **scoring)
+    return candidates, stats
 
-            if user_j in meeting_histories.get(user_i, set()):
-                continue
 
-            candidate_pairs.append((i, j, similarity_matrix[i][j]))
+def generate_candidates(normed: np.ndarray, **scoring):
+    """
+    Точный перебор для небольших пулов (плотной матрицей или блоками, если она
+    не влезает в MATCHER_MEMORY_LIMIT_MB), ANN top-k — для больших.
+    """
+    n = normed.shape[0]
+    mode = SIMILARITY_MODE
+    if mode == "auto":
+        mode = "ann" if n >= ANN_MIN_POOL else "exact"
+    if mode == "exact":
+        mode = "dense" if n * n * DENSE_BYTES_PER_PAIR <= _memory_limit_bytes() else "tiled"
 
-    candidate_pairs.sort(key=lambda x: x[2], reverse=True)
+    if mode == "ann":
+        return ann_candidate_pairs(normed, **scoring)
+    if mode == "tiled":
+        return tiled_candidate_pairs(normed, **scoring)
+    return build_candidate_pairs(normed, **scoring)
 
-    for i, j, sim_score in candidate_pairs:
-        if i in used_indices or j in used_indices:
+
+def greedy_select(candidates: CandidatePairs, n: int) -> list:
+    """Жадный выбор: позиции в candidates, образующие паросочетание."""
+    used = bytearray(n)
+    picked = []
+    max_pairs = n // 2
+
+    for k, (i, j) in enumerate(zip(candidates.rows.tolist(), candidates.cols.tolist())):
+        if used[i] or used[j]:
             continue
+        used[i] = used[j] = 1
+        picked.append(k)
+        if len(picked) == max_pairs:
+            break
+
+    return picked
+
+
+@contextmanager
+def max_weight_budget():
+    """
+    Общий дедлайн blossom на запуск: потоки корзин и кластеров получают его через
+    contextvars.copy_context(). Вложенный вызов использует уже открытый дедлайн.
+    """
+    if MAX_WEIGHT_DEADLINE.get() is not None:
+        yield
+        return
+    token = MAX_WEIGHT_DEADLINE.set(time.monotonic() + MAX_WEIGHT_TIME_BUDGET_SECONDS)
+    try:
+        yield
+    finally:
+        MAX_WEIGHT_DEADLINE.reset(token)
+
+
+def _remaining_budget() -> float:
+    deadline = MAX_WEIGHT_DEADLINE.get()
+    if deadline is None:
+        return MAX_WEIGHT_TIME_BUDGET_SECONDS
+    return deadline - time.monotonic()
+
+
+def _blossom_context():
+    """
+    forkserver, а не fork: blossom вызывается из потоков корзин, а fork процесса
+    с потоками может унаследовать чужие захваченные блокировки.
+    """
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["src.matcher"])
+    return context
+
+
+def _solve_max_weight(rows, cols, weights, maxcardinality: bool) -> list:
+    graph = nx.Graph()
+    graph.add_weighted_edges_from(zip(rows, cols, weights))
+    matching = nx.max_weight_matching(graph, maxcardinality=maxcardinality)
+    return [(min(i, j), max(i, j)) for i, j in matching]
+
+
+def max_weight_select(
+    candidates: CandidatePairs,
+    n: int,
+    maxcardinality: bool = False,
+    time_budget: float | None = None,
+) -> list | None:
+    """
+    Точное паросочетание максимального веса (blossom) на графе кандидатов.
+    Считается в отдельном процессе в пределах остатка бюджета запуска
+    (max_weight_budget); None — не уложились или граф слишком большой,
+    вызывающий откатывается на greedy.
+    """
+    edge_count = len(candidates.rows)
+    if edge_count > MAX_WEIGHT_MAX_EDGES:
+        logger.info(f"max_weight: {edge_count} рёбер > {MAX_WEIGHT_MAX_EDGES}, пропускаем")
+        return None
+    if edge_count == 0:
+        return []
+
+    nodes = len(np.unique(np.concatenate([candidates.rows, candidates.cols])))
+    estimate = MAX_WEIGHT_SECONDS_PER_NODE_EDGE * nodes * edge_count
+    rows = candidates.rows.tolist()
+    cols = candidates.cols.tolist()
+    args = (rows, cols, candidates.score.tolist(), maxcardinality)
+
+    with _BLOSSOM_SLOT:
+        # остаток считаем после ожидания слота — время в очереди тоже из бюджета
+        if time_budget is None:
+            time_budget = _remaining_budget()
+        if estimate > time_budget:
+            logger.info(
+                f"max_weight: {nodes} вершин, {edge_count} рёбер — оценка {estimate:.1f}s "
+                f"больше остатка бюджета {max(time_budget, 0.0):.1f}s, пропускаем"
+            )
+            return None
+
+        # отдельный процесс + terminate: сам networkx не умеет прерываться по таймауту
+        with _blossom_context().Pool(1) as pool:
+            result = pool.apply_async(_solve_max_weight, args)
+            try:
+                pairs = result.get(timeout=time_budget)
+            except multiprocessing.TimeoutError:
+                logger.warning(f"max_weight: не уложились в {time_budget:.1f}s ({n} вершин, {edge_count} рёбер)")
+                return None
+
+    position = {(i, j): k for k, (i, j) in enumerate(zip(rows, cols))}
+    return sorted(position[pair] for pair in pairs)
+
+
+MATCHING_ENGINES = {
+    "greedy": greedy_select,
+    "max_weight": lambda candidates, n: max_weight_select(candidates, n),
+    "max_cardinality": lambda candidates, n: max_weight_select(candidates, n, maxcardinality=True),
+}
+
+
+def select_pairs(candidates: CandidatePairs, n: int, engine: str | None = None) -> list:
+    """
+    Выбор пар выбранным движком. Для не-greedy движков в лог пишется
+    прирост числа пар и суммарного score относительно greedy.
+    """
+    engine = engine or MATCHING_ENGINE
+    greedy = greedy_select(candidates, n)
+    if engine == "greedy":
+        return greedy
+
+    if engine not in MATCHING_ENGINES:
+        logger.error(f"Неизвестный движок мэтчинга '{engine}', используем greedy")
+        return greedy
+
+    picked = MATCHING_ENGINES[engine](candidates, n)
+    if picked is None:
+        logger.info(f"{engine}: fallback на greedy")
+        return greedy
+
+    greedy_total = float(candidates.score[greedy].sum()) if greedy else 0.0
+    picked_total = float(candidates.score[picked].sum()) if picked else 0.0
+    logger.info(
+        f"{engine}: {len(picked)} пар ({len(picked) - len(greedy):+d} к greedy), "
+        f"суммарный score {picked_total:.3f} ({picked_total - greedy_total:+.3f} к greedy)"
+    )
+    return picked
+
+
+def request_pool_from_rows(requests) -> dict:
+    """Строки get_pending_requests_for_matching -> пул в формате fetch_request_pool_arrays."""
+    return {
+        "request_ids": np.array([r[0] for r in requests], dtype=np.int64),
+        "creator_ids": np.array([r[1] for r in requests], dtype=np.int64),
+        "embeddings": [parse_pgvector_string(r[2]) for r in requests],
+        "meet_times": np.array(
+            [r[3].astimezone(timezone.utc).replace(tzinfo=None) for r in requests],
+            dtype="datetime64[us]",
+        ),
+        "shop_ids": np.array([r[4] for r in requests], dtype=np.int64),
+    }
+
+
+def embedding_store(uni_id: int) -> EmbeddingStore | None:
+    """Хранилище эмбеддингов вуза на этом хосте или None (нет, устарело — worker не обновляет)."""
+    store = EMBEDDING_STORES.setdefault(uni_id, EmbeddingStore(uni_id))
+    if not store.refresh() or store.age_seconds() > EMBEDDING_STORE_MAX_AGE_SECONDS:
+        return None
+    return store
+
+
+def _embeddings_from_store(pool: dict, user_ids: np.ndarray, uni_id: int) -> dict | None:
+    """Дополняет пул векторами из хранилища; None — хранилища нет или в нем не все user_ids."""
+    store = embedding_store(uni_id)
+    if pool is None or store is None:
+        return None
+    found, vectors = store.get(user_ids)
+    if not found.all():
+        logger.info(f"[uni={uni_id}] В хранилище эмбеддингов нет {int((~found).sum())} из {len(found)}, читаем из БД")
+        return None
+    pool["embeddings"] = vectors
+    return pool
+
+
+def load_request_pool(uni_id: int, request_ids: list | None = None) -> dict | None:
+    """
+    Pending заявки с эмбеддингами: векторы из хранилища worker'а, иначе бинарная
+    выгрузка из БД, при ее ошибке — текстовый путь (только для всего пула).
+    """
+    if embedding_store(uni_id) is not None:
+        pool = fetch_request_pool_arrays(uni_id, request_ids, with_embeddings=False)
+        pool = _embeddings_from_store(pool, pool["creator_ids"] if pool else None, uni_id)
+        if pool is not None:
+            return pool
+
+    pool = fetch_request_pool_arrays(uni_id, request_ids)
+    if pool is None and request_ids is None:
+        logger.warning("Бинарная выгрузка заявок не удалась, читаем pgvector как текст")
+        pool = request_pool_from_rows(get_pending_requests_for_matching(uni_id))
+    return pool
+
+
+def load_interest_pool(uni_id: int) -> dict:
+    """Пул поиска по интересам: user_ids, embeddings, genders."""
+    if embedding_store(uni_id) is not None:
+        pool = fetch_interest_pool_arrays(uni_id, with_embeddings=False)
+        pool = _embeddings_from_store(pool, pool["user_ids"] if pool else None, uni_id)
+        if pool is not None:
+            return pool
+
+    pool = fetch_interest_pool_arrays(uni_id)
+    if pool is None:
+        logger.warning("Бинарная выгрузка пула не удалась, читаем pgvector как текст")
+        users = get_interest_search_users(uni_id)
+        pool = {
+            "user_ids": np.array([u[0] for u in users], dtype=np.int64),
+            "embeddings": [parse_pgvector_string(u[1]) for u in users],
+            "genders": np.array([u[2] for u in users], dtype=object),
+        }
+    return pool
+
+
+USER_FEATURES = ("no_show_count", "coffee_streak", "school")
+
+
+def load_user_features(user_ids: list, uni_id: int, scoring_weights: dict | None) -> dict:
+    """Признаки пользователей для правил скоринга — только те, что нужны активным весам."""
+    if not required_features(scoring_weights) & set(USER_FEATURES):
+        return {}
+    features = get_user_scoring_features(user_ids, uni_id)
+    if features is None:
+        return {}
+    features["school"] = encode_schools(features["school"])
+    return features
+
+
+def request_scorer(pool: dict, uni_id: int, scoring_weights: dict | None, user_features: dict | None = None):
+    """Scorer пула заявок (или None — score = raw similarity)."""
+    if not active_weights(scoring_weights):
+        return None
+    if user_features is None:
+        user_features = load_user_features(pool["creator_ids"].tolist(), uni_id, scoring_weights)
+    features = {
+        "meet_times": pool["meet_times"],
+        "time_window": np.timedelta64(MATCH_TIME_WINDOW_MINUTES, "m"),
+        **user_features,
+    }
+    return build_scorer(scoring_weights, features, len(pool["request_ids"]))
+
+
+def interest_scoring_weights(scoring_weights: dict | None, valentine_mode: bool) -> dict:
+    """Веса из конфига + Valentine's буст как правило cross_gender."""
+    # у поиска по интересам нет времени встречи
+    weights = {name: w for name, w in (scoring_weights or {}).items() if name != "time_proximity"}
+    if valentine_mode:
+        weights["cross_gender"] = weights.get("cross_gender", 0.0) + VALENTINE_CROSS_GENDER_BOOST
+    return weights
+
+
+def interest_scorer(user_ids: list, genders, uni_id: int, scoring_weights: dict | None,
+                    user_features: dict | None = None):
+    """Scorer пула поиска по интересам (или None — score = raw similarity)."""
+    if not active_weights(scoring_weights):
+        return None
+    if user_features is None:
+        user_features = load_user_features(user_ids, uni_id, scoring_weights)
+    return build_scorer(scoring_weights, {"genders": genders, **user_features}, len(user_ids))
+
+
+def request_buckets(meet_times: np.ndarray, shop_ids: np.ndarray, window: np.timedelta64,
+                    same_shop: bool) -> list:
+    """
+    Разбиение заявок на независимые корзины (массивы индексов пула).
+
+    Каждая заявка — интервал [meet_time, meet_time + window]; внутри кофейни
+    (или по всему пулу, если кофейни не учитываем) интервалы сортируются и
+    пересекающиеся сливаются. Заявки из разных корзин совместимыми быть не могут.
+    """
+    n = len(meet_times)
+    group_keys = shop_ids if same_shop else np.zeros(n, dtype=np.int64)
+    # сортировка по (группа, время)
+    order = np.lexsort((meet_times, group_keys))
+    t = meet_times[order]
+    g = group_keys[order]
+
+    new_bucket = np.ones(n, dtype=bool)
+    new_bucket[1:] = (g[1:] != g[:-1]) | (t[1:] - t[:-1] > window)
+    starts = np.nonzero(new_bucket)[0]
+    return [np.sort(b) for b in np.split(order, starts[1:]) if len(b) >= 2]
+
+
+def _bucket_history(history: np.ndarray, bucket: np.ndarray, n: int) -> np.ndarray:
+    """История пула (индексы пула) -> пары в локальных индексах корзины."""
+    local = np.full(n, -1, dtype=np.int64)
+    local[bucket] = np.arange(len(bucket))
+    if not len(history):
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = local[history]
+    return pairs[(pairs >= 0).all(axis=1)]
+
 
+def request_compatibility(meet_times: np.ndarray, creator_ids: np.ndarray, window: np.timedelta64):
+    """
+    Маска совместимости заявок для генерации кандидатов: корзина — цепочка
+    пересечений, так что время проверяется попарно; две заявки одного
+    пользователя друг с другом не мэтчим.
+    """
+    def compatible(rows, cols):
+        return (np.abs(meet_times[rows] - meet_times[cols]) <= window) & (creator_ids[rows] != creator_ids[cols])
+    return compatible
+
+
+def _request_engine() -> str:
+    """
+    max_weight для заявок работает как max_cardinality: чистый максимум веса на пуле
+    заявок теряет пары (n=1000: 422 против 461 у greedy) — несколько сильных пар
+    перевешивают больше слабых, и часть заявок остается без встречи до истечения.
+    Заявка без пары хуже пары с меньшей similarity, поэтому сначала максимум пар,
+    среди них — максимум суммарного score.
+    """
+    return "max_cardinality" if MATCHING_ENGINE == "max_weight" else MATCHING_ENGINE
+
+
+def _match_bucket(pool: dict, bucket: np.ndarray, normed: np.ndarray, history: np.ndarray,
+                  window: np.timedelta64, scorer=None) -> list:
+    """Пары (i, j, score) в индексах пула для одной корзины."""
+    n = len(pool["request_ids"])
+    with phase("similarity"):
+        candidates, _ = generate_candidates(
+            normed[bucket],
+            scorer=scorer.take(bucket) if scorer is not None else None,
+            excluded_pairs=_bucket_history(history, bucket, n),
+            compatible=request_compatibility(pool["meet_times"][bucket], pool["creator_ids"][bucket], window),
+        )
+    count("candidate_edges", len(candidates.rows))
+
+    with phase("select"):
+        picked = select_pairs(candidates, len(bucket), _request_engine())
+    return [
+        (int(bucket[candidates.rows[k]]), int(bucket[candidates.cols[k]]), float(candidates.score[k]))
+        for k in picked
+    ]
+
+
+def plan_request_matching(pool: dict, uni_id: int, history: np.ndarray | None = None, scorer=None,
+                          codec: EmbeddingCodec | None = None) -> list:
+    """
+    Пары заявок без записи в БД: [(i, j, score)] в индексах пула.
+    history — граф прошлых встреч (индексы пула); если не передан, берется из БД.
+    scorer — правила скоринга пула (request_scorer).
+    codec — формат эмбеддингов вуза (src.embedding_codec); по умолчанию float32.
+    """
+    n = len(pool["request_ids"])
+    if n < 2:
+        logger.info(f"Недостаточно заявок для мэтчинга ({n})")
+        return []
+
+    window = np.timedelta64(MATCH_TIME_WINDOW_MINUTES, "m")
+
+    buckets = request_buckets(pool["meet_times"], pool["shop_ids"], window, MATCH_SAME_SHOP_ONLY)
+    logger.info(
+        f"Мэтчинг для {n} заявок: {len(buckets)} корзин по времени/кофейне "
+        f"(окно {MATCH_TIME_WINDOW_MINUTES} мин, крупнейшая — {max(map(len, buckets), default=0)})"
+    )
+    if not buckets:
+        return []
+
+    with phase("similarity"):
+        normed = (codec or EmbeddingCodec()).prepare(pool["embeddings"])
+    if history is None:
+        with phase("history"):
+            history = get_pool_history_pairs(pool["creator_ids"].tolist(), uni_id)
+
+    # у каждой корзины своя копия контекста — фазы попадают в текущий запуск
+    # (время корзин суммируется по потокам), бюджет max_weight — общий
+    with max_weight_budget(), ThreadPoolExecutor(max_workers=max(1, MATCH_BUCKET_WORKERS)) as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run, _match_bucket, pool, bucket, normed, history, window, scorer
+            )
+            for bucket in buckets
+        ]
+        return [pair for future in futures for pair in future.result()]
+
+
+def match_request_pool(pool: dict, uni_id: int, history: np.ndarray | None = None,
+                       scoring_weights: dict | None = None, codec: EmbeddingCodec | None = None) -> list:
+    """Пары (request_id, request_id) для пула заявок."""
+    request_ids = pool["request_ids"].tolist()
+    creator_ids = pool["creator_ids"].tolist()
+    scorer = request_scorer(pool, uni_id, scoring_weights) if len(request_ids) >= 2 else None
+
+    matched_pairs = []
+    for i, j, score in plan_request_matching(pool, uni_id, history, scorer, codec):
         request_id_i = request_ids[i]
         request_id_j = request_ids[j]
 
         logger.info(
             f"Match: Request {request_id_i} (User {creator_ids[i]}) <-> "
-            f"Request {request_id_j} (User {creator_ids[j]}), sim={sim_score:.3f}"
+            f"Request {request_id_j} (User {creator_ids[j]}), sim={score:.3f}"
         )
 
         matched_pairs.append((request_id_i, request_id_j))
-        used_indices.add(i)
-        used_indices.add(j)
 
-    logger.info(f"Сформировано {len(matched_pairs)} пар из {n} заявок")
+    logger.info(f"Сформировано {len(matched_pairs)} пар из {len(request_ids)} заявок")
     return matched_pairs
 
 
-def execute_matching(uni_id: int):
+def request_pairs_batch(pool: dict, matched_pairs: list) -> list:
+    """(request_id, request_id) -> строки для pair_requests_batch: (main, partner_user, partner_request)."""
+    creator_by_request = dict(zip(pool["request_ids"].tolist(), pool["creator_ids"].tolist()))
+    batch = []
+    for req_id_1, req_id_2 in matched_pairs:
+        # заявка с меньшим ID — "основная"
+        main_request = min(req_id_1, req_id_2)
+        partner_request = max(req_id_1, req_id_2)
+        batch.append((main_request, creator_by_request[partner_request], partner_request))
+    return batch
+
+
+def greedy_matching(requests, uni_id: int, scoring_weights: dict | None = None):
+    return match_request_pool(request_pool_from_rows(requests), uni_id, scoring_weights=scoring_weights)
+
+
+def execute_matching(uni_id: int, scoring_weights: dict | None = None, embedding_config: dict | None = None):
+    """
+    scoring_weights — раздел "scoring" конфига вуза (веса правил src.scoring).
+    embedding_config — раздел "embedding" (формат эмбеддингов, src.embedding_codec).
+    Запуск идет только на реплике, взявшей advisory lock (requests, uni_id).
+    """
+    with matcher_lock("requests", uni_id) as leader:
+        if not leader:
+            logger.info(f"[uni={uni_id}] Мэтчинг заявок уже идет на другой реплике, пропускаем")
+            return 0
+        with matching_run(uni_id, "requests", MATCHING_ENGINE):
+            return _execute_matching(uni_id, scoring_weights, codec_from_config(embedding_config))
+
+
+def apply_planned(uni_id: int, entries: list) -> list:
+    """План — в журнал текущего запуска (matching_run_pairs), затем идемпотентное применение."""
+    run = current_run()
+    if run is None or run.run_id is None:
+        logger.error(f"[uni={uni_id}] Запуск не открыт в matching_runs — план не применяем")
+        return []
+    with phase("write"):
+        if not save_run_plan(run.run_id, entries):
+            return []
+        return apply_run_plan(run.run_id, uni_id)
+
+
+def resume_unfinished_plan(uni_id: int, kind: str) -> list | None:
+    """
+    Доприменяет план упавшего запуска (вуз, вид), если он моложе MATCHER_RESUME_MAX_AGE_MINUTES.
+    Возвращает обработанные записи плана или None, если доприменять нечего.
+    """
+    run_id = get_resumable_run(uni_id, kind, MATCHER_RESUME_MAX_AGE_MINUTES)
+    if run_id is None:
+        return None
+    logger.warning(f"[uni={uni_id}] Незавершенный план запуска #{run_id} ({kind}) — доприменяем вместо пересчета")
+    run = current_run()
+    if run is not None:
+        run.resumed_from_run_id = run_id
+    with phase("write"):
+        results = apply_run_plan(run_id, uni_id)
+    count("pairs", len(results))
+    return results or None
+
+
+def _report_request_results(results: list) -> int:
+    success_count = 0
+    for entry in results:
+        main_request = entry["request_ids"][0]
+        partner_user_id = entry["members"][1]
+        if entry["status"] == "applied":
+            success_count += 1
+            logger.info(f"Matched: Request {main_request} + Partner {partner_user_id}")
+        else:
+            logger.warning(f"Не удалось замэтчить request {main_request} с partner {partner_user_id}")
+
+    count("written", success_count)
+    logger.info(f"Мэтчинг завершен: {success_count}/{len(results)} пар записано в БД")
+    return success_count
+
+
+def _execute_matching(uni_id: int, scoring_weights: dict | None = None, codec: EmbeddingCodec | None = None):
     logger.info(f"Запуск мэтчинга для university_id={uni_id}")
 
-    requests = get_pending_requests_for_matching(uni_id)
+    resumed = resume_unfinished_plan(uni_id, "requests")
+    if resumed is not None:
+        return _report_request_results(resumed)
 
-    if len(requests) < 2:
+    with phase("fetch"):
+        pool = load_request_pool(uni_id)
+    count("pool_size", len(pool["request_ids"]))
+
+    if len(pool["request_ids"]) < 2:
         logger.info("Недостаточно pending заявок с эмбеддингами")
         return 0
 
-    matched_pairs = greedy_matching(requests, uni_id)
+    matched_pairs = match_request_pool(pool, uni_id, scoring_weights=scoring_weights, codec=codec)
+    count("pairs", len(matched_pairs))
 
     if not matched_pairs:
         logger.info("Не удалось сформировать пары")
         return 0
 
-    success_count = 0
-    for req_id_1, req_id_2 in matched_pairs:
-        # заявка с меньшим ID — "основная"
-        main_request = min(req_id_1, req_id_2)
-        partner_request = max(req_id_1, req_id_2)
+    creator_by_request = dict(zip(pool["request_ids"].tolist(), pool["creator_ids"].tolist()))
+    entries = [
+        {
+            "entry_type": "request_pair",
+            "members": [creator_by_request[main_request], partner_user_id],
+            "request_ids": [main_request, partner_request],
+        }
+        for main_request, partner_user_id, partner_request in request_pairs_batch(pool, matched_pairs)
+    ]
+    return _report_request_results(apply_planned(uni_id, entries))
 
-        partner_user_id = None
-        for req in requests:
-            if req[0] == partner_request:
-                partner_user_id = req[1]
-                break
 
-        if not partner_user_id:
-            logger.error(f"Не найден user_id для request {partner_request}")
-            continue
+def cluster_partition(normed: np.ndarray, cluster_size: int, seed: int = 0) -> list:
+    """Кластеры пула (массивы индексов) по mini-batch k-means; число кластеров — n / cluster_size."""
+    n = normed.shape[0]
+    k = max(1, -(-n // max(1, cluster_size)))
+    if k == 1:
+        return [np.arange(n)]
+    labels = assign_clusters(normed, minibatch_kmeans(normed, k, seed=seed))
+    order = np.argsort(labels, kind="stable")
+    starts = np.searchsorted(labels[order], np.arange(1, k))
+    return [part for part in np.split(order, starts) if len(part)]
 
-        if pair_user_for_request(main_request, partner_user_id, uni_id):
-            success_count += 1
-            logger.info(f"Matched: Request {main_request} + Partner {partner_user_id}")
+
+def _match_subset(normed: np.ndarray, subset: np.ndarray, excluded_pairs: np.ndarray, scorer=None):
+    """Кандидаты и пары движка внутри подмножества пула; пары — (i, j, raw, score) в индексах пула."""
+    n = normed.shape[0]
+    with phase("similarity"):
+        candidates, stats = generate_candidates(
+            normed[subset],
+            scorer=scorer.take(subset) if scorer is not None else None,
+            threshold=INTEREST_SIMILARITY_THRESHOLD,
+            excluded_pairs=_bucket_history(excluded_pairs, subset, n),
+        )
+    count("candidate_edges", len(candidates.rows))
+    if not len(candidates.rows):
+        return [], stats
+    with phase("select"):
+        picked = select_pairs(candidates, len(subset))
+    return [
+        (int(subset[candidates.rows[k]]), int(subset[candidates.cols[k]]),
+         float(candidates.raw[k]), float(candidates.score[k]))
+        for k in picked
+    ], stats
+
+
+def plan_clustered_matching(normed: np.ndarray, excluded_pairs: np.ndarray, scorer=None,
+                            cluster_size: int | None = None):
+    """
+    Приближённый мэтчинг: движок внутри кластеров k-means (параллельно), затем
+    перекрестный проход по оставшимся без пары. Пары, которые точный прогон
+    собрал бы через границу кластеров, теряются, если оба их участника
+    нашли пару у себя в кластере.
+    Возвращает ([(i, j, raw, score)] в индексах пула, stats).
+    """
+    n = normed.shape[0]
+    with phase("similarity"):
+        clusters = cluster_partition(normed, cluster_size or INTEREST_CLUSTER_SIZE)
+
+    with max_weight_budget():
+        with ThreadPoolExecutor(max_workers=max(1, INTEREST_CLUSTER_WORKERS)) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, _match_subset, normed, cluster, excluded_pairs, scorer)
+                for cluster in clusters
+                if len(cluster) >= 2
+            ]
+            results = [future.result() for future in futures]
+
+        planned = [pair for pairs, _ in results for pair in pairs]
+        stats = {key: sum(s[key] for _, s in results) for key in ("total", "threshold", "history")}
+
+        matched = np.zeros(n, dtype=bool)
+        matched[[i for i, _, _, _ in planned]] = True
+        matched[[j for _, j, _, _ in planned]] = True
+        leftover = np.nonzero(~matched)[0]
+        cross = []
+        if len(leftover) >= 2:
+            cross, cross_stats = _match_subset(normed, leftover, excluded_pairs, scorer)
+            for key in stats:
+                stats[key] += cross_stats[key]
+
+    stats.update(clusters=len(clusters), largest_cluster=max(map(len, clusters)), cross_pairs=len(cross))
+    logger.info(
+        f"Кластерный мэтчинг: {n} пользователей, {len(clusters)} кластеров (крупнейший — "
+        f"{stats['largest_cluster']}), пар в кластерах {len(planned)}, "
+        f"в перекрестном проходе по {len(leftover)} оставшимся — {len(cross)}"
+    )
+    return planned + cross, stats
+
+
+def plan_interest_matching(
+    user_ids: list,
+    normed: np.ndarray,
+    excluded_pairs: np.ndarray,
+    scorer=None,
+    neighbor_edges=None,
+    clustered: bool | None = None,
+):
+    """
+    Пары по интересам без записи в БД.
+    scorer — правила скоринга пула (interest_scorer).
+    clustered — кластерный режим (plan_clustered_matching); None — по INTEREST_CLUSTER_MIN_POOL.
+    Возвращает ([(user_i, user_j, raw_sim, effective_sim)], stats фильтров).
+    """
+    n = len(user_ids)
+    if clustered is None:
+        clustered = 0 < INTEREST_CLUSTER_MIN_POOL <= n
+    if clustered:
+        planned, stats = plan_clustered_matching(normed, excluded_pairs, scorer)
+        return [(user_ids[i], user_ids[j], raw, score) for i, j, raw, score in planned], stats
+
+    scoring = dict(
+        scorer=scorer,
+        threshold=INTEREST_SIMILARITY_THRESHOLD,
+        excluded_pairs=excluded_pairs,
+    )
+    with phase("similarity"):
+        if neighbor_edges is not None:
+            candidates, stats = build_candidate_pairs_from_edges(*neighbor_edges, n, **scoring)
         else:
-            logger.warning(f"Не удалось замэтчить request {main_request} с partner {partner_user_id}")
+            candidates, stats = generate_candidates(normed, **scoring)
+    count("candidate_edges", len(candidates.rows))
 
-    logger.info(f"Мэтчинг завершен: {success_count}/{len(matched_pairs)} пар записано в БД")
-    return success_count
+    if not len(candidates.rows):
+        return [], stats
 
+    with phase("select"):
+        picked = select_pairs(candidates, n)
+    # raw similarity без правил скоринга — для аналитики
+    planned = [
+        (user_ids[candidates.rows[k]], user_ids[candidates.cols[k]],
+         float(candidates.raw[k]), float(candidates.score[k]))
+        for k in picked
+    ]
+    return planned, stats
 
-def execute_interest_matching(uni_id: int) -> int:
-    logger.info(f"Запуск мэтчинга по интересам для university_id={uni_id}")
 
-    users = get_interest_search_users(uni_id)
+def merge_pairs(normed: np.ndarray, pairs: np.ndarray, excluded_pairs: np.ndarray, threshold: float) -> list:
+    """
+    Слияние пар в четверки: [(p, q)] индексов в pairs.
 
-    if len(users) < 2:
-        logger.info(f"Недостаточно пользователей в пуле ({len(users)})")
-        return 0
+    Кандидаты ищутся по центроидам пар обычным движком (cos центроидов не меньше
+    средней перекрестной similarity, так что порог по ним — безопасный префильтр),
+    затем переоцениваются средней similarity четырех перекрестных связей.
+    """
+    m = len(pairs)
+    if m < 2:
+        return []
+    a, b = normed[pairs[:, 0]], normed[pairs[:, 1]]
+    centroids = normalize_embeddings(a + b)
 
-    n = len(users)
-    logger.info(f"Пользователей в пуле: {n}")
+    # история между любыми участниками двух пар запрещает их слияние
+    pair_of = np.full(normed.shape[0], -1, dtype=np.int64)
+    pair_of[pairs[:, 0]] = np.arange(m)
+    pair_of[pairs[:, 1]] = np.arange(m)
+    excluded = pair_of[excluded_pairs] if len(excluded_pairs) else np.empty((0, 2), dtype=np.int64)
+    excluded = excluded[(excluded >= 0).all(axis=1) & (excluded[:, 0] != excluded[:, 1])]
 
-    user_ids = [u[0] for u in users]
-    embeddings = [parse_pgvector_string(u[1]) for u in users]
-    genders = [u[2] for u in users]
+    prefilter, _ = generate_candidates(centroids, threshold=threshold, excluded_pairs=excluded)
+    p, q = prefilter.rows, prefilter.cols
+    cross = (
+        np.einsum("ij,ij->i", a[p], a[q]) + np.einsum("ij,ij->i", a[p], b[q])
+        + np.einsum("ij,ij->i", b[p], a[q]) + np.einsum("ij,ij->i", b[p], b[q])
+    ) / 4
+    candidates, _ = build_candidate_pairs_from_edges(p, q, cross.astype(np.float32), m, threshold=threshold)
+    return [(int(candidates.rows[k]), int(candidates.cols[k])) for k in select_pairs(candidates, m)]
 
-    valentine_mode = is_valentine_period()
-    if valentine_mode:
-        logger.info("Valentine's Day режим активен, кросс-гендерный буст +%.2f", VALENTINE_CROSS_GENDER_BOOST)
 
-    meeting_histories = {}
-    for uid in user_ids:
-        coffee_history = get_user_meeting_history(uid, uni_id)
-        interest_history = get_interest_match_history(uid, uni_id, cooldown_days=30)
-        meeting_histories[uid] = coffee_history | interest_history
+def attach_stranded(normed: np.ndarray, groups: list, stranded: np.ndarray, excluded_pairs: np.ndarray,
+                    max_size: int, threshold: float) -> list:
+    """
+    Оставшиеся без пары добавляются в группы, где ещё есть место: по средней similarity
+    с участниками группы (не ниже threshold, без истории встреч с кем-либо из них),
+    лучшие сочетания — первыми. Возвращает новый список групп.
+    """
+    groups = [list(g) for g in groups]
+    if not len(stranded) or not groups:
+        return groups
 
-    candidate_pairs = []
-    skipped_by_threshold = 0
-    skipped_by_history = 0
-    for i in range(n):
-        for j in range(i + 1, n):
-            sim = cosine_similarity(embeddings[i], embeddings[j])
+    n = normed.shape[0]
+    sums = np.stack([normed[members].sum(axis=0) for members in groups])
+    sizes = np.array([len(members) for members in groups], dtype=np.float32)
+    history = set(_pair_keys(excluded_pairs, n).tolist()) if len(excluded_pairs) else set()
 
-            effective_sim = sim
-            if valentine_mode and _is_cross_gender(genders[i], genders[j]):
-                effective_sim = min(sim + VALENTINE_CROSS_GENDER_BOOST, 1.0)
+    top = min(GROUP_ATTACH_TOP, len(groups))
+    entries = []
+    for start in range(0, len(stranded), ASSIGN_CHUNK_ROWS):
+        chunk = stranded[start:start + ASSIGN_CHUNK_ROWS]
+        affinity = (normed[chunk] @ sums.T) / sizes
+        best = np.argpartition(-affinity, top - 1, axis=1)[:, :top]
+        for row, g in zip(*np.nonzero(np.take_along_axis(affinity, best, axis=1) >= threshold)):
+            entries.append((float(affinity[row, best[row, g]]), start + row, int(best[row, g])))
 
-            if effective_sim < INTEREST_SIMILARITY_THRESHOLD:
-                skipped_by_threshold += 1
-                continue
+    placed = np.zeros(len(stranded), dtype=bool)
+    for _, single, g in sorted(entries, key=lambda e: (-e[0], e[1], e[2])):
+        if placed[single] or len(groups[g]) >= max_size:
+            continue
+        user = int(stranded[single])
+        # история — и с исходными участниками, и с уже добавленными
+        if any(min(user, v) * n + max(user, v) in history for v in groups[g]):
+            continue
+        groups[g].append(user)
+        placed[single] = True
+    return groups
 
-            if user_ids[j] in meeting_histories.get(user_ids[i], set()):
-                skipped_by_history += 1
-                continue
 
-            candidate_pairs.append((i, j, effective_sim, sim))
+def plan_groups(normed: np.ndarray, pairs: list, excluded_pairs: np.ndarray, max_size: int,
+                threshold: float = INTEREST_SIMILARITY_THRESHOLD) -> list:
+    """
+    Группы по 2–max_size из пар мэтчинга: сначала оставшиеся без пары добавляются
+    к парам (им встреча важнее всего), затем нетронутые пары сливаются в четверки
+    (max_size >= 4). pairs — [(i, j)] индексов пула. Возвращает [[индексы участников]].
+    """
+    n = normed.shape[0]
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
 
-    if not candidate_pairs:
-        logger.info(
-            f"Нет подходящих пар. Всего: {n*(n-1)//2}, "
-            f"порог: {skipped_by_threshold}, история: {skipped_by_history}"
+    matched = np.zeros(n, dtype=bool)
+    matched[pairs.ravel()] = True
+    groups = attach_stranded(
+        normed, pairs.tolist(), np.nonzero(~matched)[0], excluded_pairs, max_size, threshold
+    )
+
+    if max_size >= 4:
+        plain = [k for k, g in enumerate(groups) if len(g) == 2]
+        merged = merge_pairs(normed, pairs[plain], excluded_pairs, threshold)
+        used = {plain[p] for pq in merged for p in pq}
+        groups = (
+            [groups[plain[p]] + groups[plain[q]] for p, q in merged]
+            + [g for k, g in enumerate(groups) if k not in used]
         )
-        return 0
+    return groups
 
-    candidate_pairs.sort(key=lambda x: x[2], reverse=True)
 
-    used_indices = set()
-    success_count = 0
+def group_similarity(normed: np.ndarray, members: list) -> float:
+    """Средняя попарная similarity участников группы."""
+    sub = normed[members]
+    sims = sub @ sub.T
+    return float(sims[np.triu_indices(len(members), k=1)].mean())
 
-    for i, j, effective_sim, raw_sim in candidate_pairs:
-        if i in used_indices or j in used_indices:
-            continue
 
-        user_i = user_ids[i]
-        user_j = user_ids[j]
+def plan_interest_groups(user_ids: list, normed: np.ndarray, planned: list, excluded_pairs: np.ndarray,
+                         max_size: int):
+    """
+    Групповой режим поверх пар plan_interest_matching.
+    Возвращает (оставшиеся пары в формате planned, [(user_ids участников, средняя similarity)]).
+    """
+    position = {user_id: i for i, user_id in enumerate(user_ids)}
+    by_pair = {(position[pair[0]], position[pair[1]]): pair for pair in planned}
+    with phase("select"):
+        groups = plan_groups(normed, list(by_pair), excluded_pairs, max_size)
+
+    pairs, meeting_groups = [], []
+    for members in groups:
+        if len(members) == 2:
+            pairs.append(by_pair[tuple(members)])
+        else:
+            meeting_groups.append(
+                (tuple(user_ids[i] for i in members), group_similarity(normed, members))
+            )
+    logger.info(
+        f"Групповой режим (до {max_size}): групп {len(meeting_groups)} "
+        f"({sum(len(m) for m, _ in meeting_groups)} участников), пар {len(pairs)}"
+    )
+    return pairs, meeting_groups
+
+
+def execute_interest_matching(uni_id: int, state=None, scoring_weights: dict | None = None,
+                              embedding_config: dict | None = None) -> int:
+    """
+    state — SimilarityState из similarity_state: если передан, пул берется из него
+    (применяются только изменения с прошлого запуска), а для больших пулов
+    кандидаты — из кэшированных top-k соседей.
+    scoring_weights — раздел "scoring" конфига вуза (веса правил src.scoring).
+    embedding_config — раздел "embedding" (формат эмбеддингов, src.embedding_codec).
+    Запуск идет только на реплике, взявшей advisory lock (interest, uni_id).
+    """
+    with matcher_lock("interest", uni_id) as leader:
+        if not leader:
+            logger.info(f"[uni={uni_id}] Мэтчинг по интересам уже идет на другой реплике, пропускаем")
+            return 0
+        with matching_run(uni_id, "interest", MATCHING_ENGINE):
+            return _execute_interest_matching(uni_id, state, scoring_weights, codec_from_config(embedding_config))
+
 
-        # raw similarity без Valentine's буста — для аналитики
-        match_id = create_interest_match(user_i, user_j, raw_sim, uni_id)
-        if match_id:
+def _report_interest_results(results: list) -> int:
+    success_count = 0
+    for entry in results:
+        members, raw_sim = entry["members"], entry["raw"]
+        if entry["entry_type"] == "group":
+            if entry["status"] == "applied":
+                success_count += 1
+                logger.info(
+                    f"Meeting group #{entry['result_id']}: Users {', '.join(map(str, members))}, avg sim={raw_sim:.3f}"
+                )
+            else:
+                logger.warning(f"Не удалось создать группу {tuple(members)}")
+            continue
+
+        user_i, user_j = members
+        effective_sim = entry["score"]
+        if entry["status"] == "applied":
             success_count += 1
-            used_indices.add(i)
-            used_indices.add(j)
             logger.info(
-                f"Interest match #{match_id}: User {user_i} <-> User {user_j}, sim={raw_sim:.3f}"
+                f"Interest match #{entry['result_id']}: User {user_i} <-> User {user_j}, sim={raw_sim:.3f}"
                 + (f" (effective: {effective_sim:.3f})" if effective_sim != raw_sim else "")
             )
         else:
             logger.warning(f"Не удалось создать interest_match для ({user_i}, {user_j})")
 
-    logger.info(f"Мэтчинг по интересам завершен: {success_count} пар создано")
+    groups = sum(1 for e in results if e["entry_type"] == "group" and e["status"] == "applied")
+    count("written", success_count)
+    logger.info(
+        f"Мэтчинг по интересам завершен: {success_count} встреч создано"
+        + (f" (из них групп: {groups})" if groups else "")
+    )
     return success_count
+
+
+def _execute_interest_matching(uni_id: int, state=None, scoring_weights: dict | None = None,
+                               codec: EmbeddingCodec | None = None) -> int:
+    logger.info(f"Запуск мэтчинга по интересам для university_id={uni_id}")
+
+    resumed = resume_unfinished_plan(uni_id, "interest")
+    if resumed is not None:
+        return _report_interest_results(resumed)
+
+    neighbor_edges = None
+    with phase("fetch"):
+        synced = state is not None and state.sync()
+        if synced:
+            user_ids = state.ids.tolist()
+            normed = state.vectors()
+            genders = state.genders
+            # в кластерном режиме кэш соседей не нужен
+            if len(user_ids) >= ANN_MIN_POOL and not 0 < INTEREST_CLUSTER_MIN_POOL <= len(user_ids):
+                neighbor_edges = state.neighbor_edges()
+        else:
+            pool = load_interest_pool(uni_id)
+            user_ids = pool["user_ids"].tolist()
+            normed = None
+            genders = pool["genders"]
+
+    n = len(user_ids)
+    count("pool_size", n)
+
+    if n < 2:
+        logger.info(f"Недостаточно пользователей в пуле ({n})")
+        return 0
+
+    logger.info(f"Пользователей в пуле: {n}")
+
+    if normed is None:
+        with phase("similarity"):
+            normed = (codec or EmbeddingCodec()).prepare(pool["embeddings"])
+
+    valentine_mode = is_valentine_period()
+    if valentine_mode:
+        logger.info("Valentine's Day режим активен, кросс-гендерный буст +%.2f", VALENTINE_CROSS_GENDER_BOOST)
+    scorer = interest_scorer(
+        user_ids, genders, uni_id, interest_scoring_weights(scoring_weights, valentine_mode)
+    )
+
+    with phase("history"):
+        excluded_pairs = get_pool_history_pairs(
+            user_ids, uni_id, interest_cooldown_days=INTEREST_HISTORY_COOLDOWN_DAYS
+        )
+
+    planned, stats = plan_interest_matching(
+        user_ids,
+        normed,
+        excluded_pairs,
+        scorer=scorer,
+        neighbor_edges=neighbor_edges,
+    )
+
+    if not planned:
+        logger.info(
+            f"Нет подходящих пар. Всего: {stats['total']}, "
+            f"порог: {stats['threshold']}, история: {stats['history']}"
+        )
+        return 0
+
+    groups = []
+    if INTEREST_GROUP_SIZE > 2:
+        planned, groups = plan_interest_groups(user_ids, normed, planned, excluded_pairs, INTEREST_GROUP_SIZE)
+
+    count("pairs", len(planned) + len(groups))
+    entries = [
+        {"entry_type": "interest_pair", "members": [user_i, user_j], "raw": raw_sim, "score": effective_sim}
+        for user_i, user_j, raw_sim, effective_sim in planned
+    ] + [
+        {"entry_type": "group", "members": list(members), "raw": avg_sim, "score": avg_sim}
+        for members, avg_sim in groups
+    ]
+    return _report_interest_results(apply_planned(uni_id, entries))
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Снимки пула мэтчинга и офлайн-прогон мэтчера по ним (dry-run, без записи в БД).
+
+    # снять пул из БД
+    python src/matcher_replay.py snapshot --config config/mipt.json --output data/mipt_pool.npz
+    # прогнать мэтчер по снимку
+    python src/matcher_replay.py replay data/mipt_pool.npz --engine max_weight --json report.json
+    # с весами правил скоринга из конфига вуза
+    python src/matcher_replay.py replay data/mipt_pool.npz --config config/mipt.json
+    # кластерный режим поиска по интересам и его потери против точного прогона
+    python src/matcher_replay.py replay data/mipt_pool.npz --mode interest --clustered
+    # компактный формат эмбеддингов: PCA-проекция по снимку полной точности и ее потери
+    python src/matcher_replay.py snapshot --config config/mipt.json --output data/mipt_full.npz --full-precision
+    python src/matcher_replay.py fit-projection data/mipt_full.npz --dim 128 --version 1 \
+        --output data/projections/mipt_pca128_v1.npz
+    python src/matcher_replay.py replay data/mipt_full.npz --config config/mipt.json
+"""
+
+import argparse
+import json
+import logging
+import time
+from datetime import datetime, timezone
+import numpy as np
+from dotenv import load_dotenv
+import src.matcher as matcher
+from src.db import init_db_pool, get_pool_history_pairs, get_user_scoring_features
+from src.embedding_codec import EmbeddingCodec, codec_from_config, fit_projection, rank_quality
+from src.scoring import encode_schools
+
+load_dotenv()
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 3
+# v1 — без признаков пользователей для правил скоринга, v2 — эмбеддинги всегда float32
+SUPPORTED_SNAPSHOT_VERSIONS = (1, 2, 3)
+HISTOGRAM_BINS = np.round(np.linspace(-1.0, 1.0, 21), 2)
+
+
+def load_config(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# --- формат снимка ---
+
+def _genders_to_str(genders) -> np.ndarray:
+    # npz без pickle: None -> ""
+    return np.array(["" if g is None else str(g) for g in genders], dtype="<U1")
+
+
+def _genders_from_str(genders: np.ndarray) -> np.ndarray:
+    return np.array([g or None for g in genders.tolist()], dtype=object)
+
+
+def _user_features(prefix: str, user_ids, uni_id: int) -> dict:
+    features = get_user_scoring_features(user_ids.tolist(), uni_id)
+    if features is None:
+        return {}
+    features["school"] = encode_schools(features["school"])
+    return {f"{prefix}_{key}": value for key, value in features.items()}
+
+
+def _snapshot_user_features(snapshot: dict, prefix: str) -> dict:
+    return {
+        key: snapshot[f"{prefix}_{key}"]
+        for key in matcher.USER_FEATURES
+        if f"{prefix}_{key}" in snapshot
+    }
+
+
+def take_snapshot(uni_id: int, codec: EmbeddingCodec | None = None) -> dict:
+    """
+    Пул заявок и пул поиска по интересам вместе с графами истории и признаками скоринга.
+    Эмбеддинги — коды в формате codec (по умолчанию float32 полной точности).
+    """
+    codec = codec or EmbeddingCodec()
+    interest = matcher.load_interest_pool(uni_id)
+    requests = matcher.load_request_pool(uni_id)
+
+    return {
+        **_user_features("interest", interest["user_ids"], uni_id),
+        **_user_features("request", requests["creator_ids"], uni_id),
+        "version": np.array(SNAPSHOT_VERSION),
+        "university_id": np.array(uni_id),
+        "taken_at": np.array(datetime.now(timezone.utc).isoformat()),
+        "embedding_codec": np.array(codec.describe()),
+        "interest_user_ids": interest["user_ids"],
+        "interest_embeddings": codec.encode(interest["embeddings"]),
+        "interest_genders": _genders_to_str(interest["genders"]),
+        "interest_history": get_pool_history_pairs(
+            interest["user_ids"].tolist(),
+            uni_id,
+            interest_cooldown_days=matcher.INTEREST_HISTORY_COOLDOWN_DAYS,
+        ),
+        "request_ids": requests["request_ids"],
+        "request_creator_ids": requests["creator_ids"],
+        "request_embeddings": codec.encode(requests["embeddings"]),
+        "request_meet_times": requests["meet_times"],
+        "request_shop_ids": requests["shop_ids"],
+        "request_history": get_pool_history_pairs(requests["creator_ids"].tolist(), uni_id),
+    }
+
+
+def save_snapshot(path: str, snapshot: dict):
+    np.savez(path, **snapshot)
+
+
+def load_snapshot(path: str) -> dict:
+    with np.load(path, allow_pickle=False) as data:
+        snapshot = {key: data[key] for key in data.files}
+    if int(snapshot["version"]) not in SUPPORTED_SNAPSHOT_VERSIONS:
+        raise ValueError(f"unsupported snapshot version {int(snapshot['version'])}")
+    snapshot["interest_genders"] = _genders_from_str(snapshot["interest_genders"])
+    snapshot.setdefault("embedding_codec", np.array("float32"))
+    return snapshot
+
+
+def replay_codec(snapshot: dict, codec: EmbeddingCodec) -> EmbeddingCodec:
+    """
+    Кодек для прогона: снимок полной точности кодируется форматом вуза; снимок,
+    уже снятый в компактном формате, прогоняется как есть.
+    """
+    snapshot_codec = str(snapshot["embedding_codec"])
+    if snapshot_codec == "float32":
+        return codec
+    if not codec.is_identity and codec.describe() != snapshot_codec:
+        logger.warning(f"Снимок уже в формате {snapshot_codec}, формат {codec.describe()} не применяем")
+    return EmbeddingCodec()
+
+
+# --- dry-run ---
+
+def similarity_summary(values) -> dict:
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {"count": 0}
+    counts, _ = np.histogram(np.clip(values, -1.0, 1.0), bins=HISTOGRAM_BINS)
+    return {
+        "count": int(len(values)),
+        "mean": round(float(values.mean()), 4),
+        "min": round(float(values.min()), 4),
+        "p10": round(float(np.percentile(values, 10)), 4),
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p90": round(float(np.percentile(values, 90)), 4),
+        "max": round(float(values.max()), 4),
+        "histogram": {
+            f"{lo:+.1f}..{hi:+.1f}": int(c)
+            for lo, hi, c in zip(HISTOGRAM_BINS[:-1], HISTOGRAM_BINS[1:], counts)
+            if c
+        },
+    }
+
+
+def codec_quality(snapshot: dict, codec: EmbeddingCodec) -> dict:
+    """Потери формата эмбеддингов против полной точности на обоих пулах снимка."""
+    return {
+        name: rank_quality(snapshot[f"{name}_embeddings"], codec)
+        for name in ("interest", "request")
+        if len(snapshot[f"{name}_embeddings"]) >= 2
+    }
+
+
+def replay_requests(snapshot: dict, scoring_weights: dict | None, codec: EmbeddingCodec | None = None) -> dict:
+    pool = {
+        "request_ids": snapshot["request_ids"],
+        "creator_ids": snapshot["request_creator_ids"],
+        "embeddings": snapshot["request_embeddings"],
+        "meet_times": snapshot["request_meet_times"],
+        "shop_ids": snapshot["request_shop_ids"],
+    }
+    n = len(pool["request_ids"])
+    uni_id = int(snapshot["university_id"])
+
+    started = time.perf_counter()
+    scorer = matcher.request_scorer(
+        pool, uni_id, scoring_weights, user_features=_snapshot_user_features(snapshot, "request")
+    )
+    planned = matcher.plan_request_matching(
+        pool, uni_id, history=snapshot["request_history"], scorer=scorer, codec=codec
+    )
+    runtime = time.perf_counter() - started
+
+    return {
+        "pool": n,
+        "pairs": len(planned),
+        "unmatched": n - 2 * len(planned),
+        "runtime_s": round(runtime, 4),
+        "similarity": similarity_summary([score for _, _, score in planned]),
+    }
+
+
+def clustered_quality(exact: list, clustered: list, exact_runtime: float, clustered_runtime: float) -> dict:
+    """Потери кластерного режима против точного прогона: пары и сумма effective similarity."""
+    exact_sum = sum(score for _, _, _, score in exact)
+    clustered_sum = sum(score for _, _, _, score in clustered)
+    return {
+        "exact_pairs": len(exact),
+        "exact_score_sum": round(exact_sum, 4),
+        "exact_runtime_s": round(exact_runtime, 4),
+        "score_sum": round(clustered_sum, 4),
+        "pairs_lost": len(exact) - len(clustered),
+        "score_loss_pct": round(100 * (1 - clustered_sum / exact_sum), 3) if exact_sum else 0.0,
+        "speedup": round(exact_runtime / clustered_runtime, 2) if clustered_runtime else None,
+    }
+
+
+def replay_interest(snapshot: dict, valentine: bool, scoring_weights: dict | None,
+                    clustered: bool = False, codec: EmbeddingCodec | None = None) -> dict:
+    user_ids = snapshot["interest_user_ids"].tolist()
+    n = len(user_ids)
+    if n < 2:
+        return {"pool": n, "pairs": 0, "unmatched": n, "runtime_s": 0.0, "similarity": {"count": 0}}
+
+    started = time.perf_counter()
+    normed = (codec or EmbeddingCodec()).prepare(snapshot["interest_embeddings"])
+    scorer = matcher.interest_scorer(
+        user_ids,
+        snapshot["interest_genders"],
+        int(snapshot["university_id"]),
+        matcher.interest_scoring_weights(scoring_weights, valentine),
+        user_features=_snapshot_user_features(snapshot, "interest"),
+    )
+    planned, stats = matcher.plan_interest_matching(
+        user_ids, normed, snapshot["interest_history"], scorer=scorer, clustered=clustered
+    )
+    runtime = time.perf_counter() - started
+
+    quality = None
+    if clustered:
+        started = time.perf_counter()
+        exact, _ = matcher.plan_interest_matching(
+            user_ids, normed, snapshot["interest_history"], scorer=scorer, clustered=False
+        )
+        quality = clustered_quality(exact, planned, time.perf_counter() - started, runtime)
+
+    return {
+        "pool": n,
+        "pairs": len(planned),
+        "unmatched": n - 2 * len(planned),
+        "runtime_s": round(runtime, 4),
+        "filtered": stats,
+        "similarity": similarity_summary([raw for _, _, raw, _ in planned]),
+        "effective_similarity": similarity_summary([score for _, _, _, score in planned]),
+        **({"clustered": quality} if quality else {}),
+    }
+
+
+def print_report(report: dict):
+    print(f"Снимок: university_id={report['university_id']}, снят {report['taken_at']}, движок {report['engine']}, "
+          f"эмбеддинги {report['embedding_codec']}")
+    for name, quality in report.get("codec_quality", {}).items():
+        print(f"[{name}] формат {quality['codec']}: recall@{quality['k']} {quality['recall_at_k']:.3f}, "
+              f"ошибка similarity mean {quality['mean_abs_error']:.4f} / max {quality['max_abs_error']:.4f}, "
+              f"{quality['bytes_per_vector']} байт на вектор вместо {quality['full_bytes_per_vector']}")
+    for name in ("requests", "interest"):
+        part = report.get(name)
+        if part is None:
+            continue
+        sim = part["similarity"]
+        print(f"\n[{name}] пул {part['pool']}, пар {part['pairs']}, без пары {part['unmatched']}, "
+              f"{part['runtime_s']:.3f}s")
+        if sim["count"]:
+            print(f"  similarity: mean {sim['mean']:.3f}, min {sim['min']:.3f}, p10 {sim['p10']:.3f}, "
+                  f"p50 {sim['p50']:.3f}, p90 {sim['p90']:.3f}, max {sim['max']:.3f}")
+            for bucket, count in sim["histogram"].items():
+                print(f"  {bucket}: {count}")
+        quality = part.get("clustered")
+        if quality:
+            print(f"  кластерный режим против точного: пар {part['pairs']} / {quality['exact_pairs']}, "
+                  f"потеря score {quality['score_loss_pct']:.2f}%, ускорение x{quality['speedup']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    snap = commands.add_parser("snapshot", help="снять пул из БД в npz")
+    snap.add_argument("--config", required=True)
+    snap.add_argument("--output", required=True)
+    snap.add_argument("--full-precision", action="store_true",
+                      help="эмбеддинги в float32 независимо от формата вуза (для fit-projection и оценки потерь)")
+
+    fit = commands.add_parser("fit-projection", help="обучить PCA-проекцию эмбеддингов по снимку")
+    fit.add_argument("snapshot")
+    fit.add_argument("--dim", type=int, required=True)
+    fit.add_argument("--version", type=int, required=True)
+    fit.add_argument("--output", required=True)
+
+    replay = commands.add_parser("replay", help="прогнать мэтчер по снимку без записи в БД")
+    replay.add_argument("snapshot")
+    replay.add_argument("--mode", choices=["requests", "interest", "both"], default="both")
+    replay.add_argument("--engine", choices=sorted(matcher.MATCHING_ENGINES), default=matcher.MATCHING_ENGINE)
+    replay.add_argument("--valentine", action="store_true", help="включить кросс-гендерный буст")
+    replay.add_argument("--config", help="конфиг вуза: веса правил скоринга (scoring) и формат эмбеддингов (embedding)")
+    replay.add_argument("--clustered", action="store_true",
+                        help="кластерный режим поиска по интересам + сравнение с точным прогоном")
+    replay.add_argument("--json", help="сохранить отчет в JSON")
+
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        config = load_config(args.config)
+        uni_id = config.get("university_id")
+        codec = EmbeddingCodec() if args.full_precision else codec_from_config(config.get("embedding"))
+        init_db_pool()
+        snapshot = take_snapshot(uni_id, codec)
+        save_snapshot(args.output, snapshot)
+        logger.info(
+            f"Снимок сохранен в {args.output}: {len(snapshot['interest_user_ids'])} в поиске по интересам, "
+            f"{len(snapshot['request_ids'])} заявок"
+        )
+        return
+
+    snapshot = load_snapshot(args.snapshot)
+
+    if args.command == "fit-projection":
+        if str(snapshot["embedding_codec"]) != "float32":
+            raise SystemExit("fit-projection нужен снимок полной точности (snapshot --full-precision)")
+        embeddings = np.concatenate([snapshot["interest_embeddings"], snapshot["request_embeddings"]])
+        projection = fit_projection(embeddings, args.dim, args.version)
+        projection.save(args.output)
+        quality = rank_quality(snapshot["interest_embeddings"], EmbeddingCodec("float16", projection))
+        logger.info(
+            f"Проекция v{projection.version} ({projection.source_dim} -> {projection.dim}) сохранена в "
+            f"{args.output}: объяснено {projection.explained:.1%} дисперсии, "
+            f"recall@{quality.get('k')} {quality.get('recall_at_k')} (float16)"
+        )
+        return
+
+    config = load_config(args.config) if args.config else {}
+    scoring_weights = config.get("scoring")
+    codec = replay_codec(snapshot, codec_from_config(config.get("embedding")))
+    matcher.MATCHING_ENGINE = args.engine
+    logging.getLogger("src.matcher").setLevel(logging.WARNING)
+
+    report = {
+        "university_id": int(snapshot["university_id"]),
+        "taken_at": str(snapshot["taken_at"]),
+        "engine": args.engine,
+        "scoring": scoring_weights or {},
+        "embedding_codec": codec.describe() if not codec.is_identity else str(snapshot["embedding_codec"]),
+    }
+    if not codec.is_identity:
+        report["codec_quality"] = codec_quality(snapshot, codec)
+    if args.mode in ("requests", "both"):
+        report["requests"] = replay_requests(snapshot, scoring_weights, codec)
+    if args.mode in ("interest", "both"):
+        report["interest"] = replay_interest(snapshot, args.valentine, scoring_weights, args.clustered, codec)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
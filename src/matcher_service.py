@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-"""Сервис периодического мэтчинга по интересам."""
+"""Сервис периодического мэтчинга (по интересам и заявок на кофе) для одного или нескольких университетов."""
 
 import os
 import time
@@ -7,9 +7,13 @@ import logging
 import argparse
 import json
 import schedule
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
-from src.db import init_db_pool, count_searching_users_without_embeddings
-from src.matcher import execute_interest_matching
+from src.db import init_db_pool, count_searching_users_without_embeddings, get_pending_requests_load
+from src.matcher import execute_interest_matching, execute_matching
+from src.similarity_state import SimilarityState
+from src.embedding_codec import codec_from_config
 
 load_dotenv()
 
@@ -19,8 +23,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-MATCHER_CONFIG = {}
 MATCHING_INTERVAL_HOURS = int(os.getenv("MATCHING_INTERVAL_HOURS", "6"))
+# Сколько университетов мэтчится одновременно (по процессу на каждый)
+MATCHER_MAX_WORKERS = int(os.getenv("MATCHER_MAX_WORKERS", "2"))
+
+# Пакетный мэтчинг заявок на кофе: интервал подстраивается под нагрузку
+REQUEST_MATCHING_INTERVAL_MINUTES = int(os.getenv("REQUEST_MATCHING_INTERVAL_MINUTES", "30"))
+REQUEST_MATCHING_MIN_INTERVAL_MINUTES = int(os.getenv("REQUEST_MATCHING_MIN_INTERVAL_MINUTES", "5"))
+REQUEST_MATCHING_MAX_INTERVAL_MINUTES = int(os.getenv("REQUEST_MATCHING_MAX_INTERVAL_MINUTES", "60"))
+# «Срочные» заявки — встреча в ближайшие N минут; если их хотя бы две, гоняем чаще
+REQUEST_URGENT_HORIZON_MINUTES = int(os.getenv("REQUEST_URGENT_HORIZON_MINUTES", "120"))
+# Последний шанс: запуск за столько секунд до того, как бот закроет ближайшую заявку
+LAST_CHANCE_LEAD_SECONDS = 120
+SCHEDULER_TICK_SECONDS = 30
+
+# uni_id -> конфиг
+TENANTS = {}
+# (job, uni_id) -> Future текущего запуска (один запуск каждого вида на университет за раз)
+RUNNING = {}
+# uni_id -> time.time() следующего запуска мэтчинга заявок
+NEXT_REQUEST_RUN = {}
+EXECUTOR = None
 
 
 def load_config(path: str):
@@ -35,57 +58,175 @@ def _wait_for_embeddings(uni_id: int, max_retries: int = 2, wait_seconds: int =
         if missing == 0:
             return
         logger.warning(
-            f"{missing} searching user(s) lack embeddings, "
+            f"[uni={uni_id}] {missing} searching user(s) lack embeddings, "
             f"waiting {wait_seconds}s (attempt {attempt + 1}/{max_retries})"
         )
         time.sleep(wait_seconds)
 
     remaining = count_searching_users_without_embeddings(uni_id)
     if remaining > 0:
-        logger.warning(f"Still {remaining} user(s) without embeddings after retries, proceeding")
+        logger.warning(f"[uni={uni_id}] Still {remaining} user(s) without embeddings after retries, proceeding")
 
 
-def run_interest_matching_job():
-    uni_id = MATCHER_CONFIG.get("university_id")
-    if not uni_id:
-        logger.error("university_id is not set in config")
+# --- код, выполняемый в процессах пула ---
+
+def _init_worker_process():
+    # соединения из родителя не наследуем — у каждого процесса свой пул
+    init_db_pool()
+
+
+def next_request_run_delay(load: dict | None) -> float:
+    """Через сколько секунд снова запускать мэтчинг заявок."""
+    if load is None:
+        return REQUEST_MATCHING_INTERVAL_MINUTES * 60
+
+    if load["pending"] < 2:
+        delay = REQUEST_MATCHING_MAX_INTERVAL_MINUTES * 60
+    elif load["urgent"] >= 2:
+        delay = REQUEST_MATCHING_MIN_INTERVAL_MINUTES * 60
+    else:
+        delay = REQUEST_MATCHING_INTERVAL_MINUTES * 60
+
+    # успеть до expire_pending_requests, пока заявка еще в пуле
+    if load["next_expiry_seconds"] is not None and load["pending"] >= 2:
+        delay = min(delay, load["next_expiry_seconds"] - LAST_CHANCE_LEAD_SECONDS)
+
+    return max(delay, SCHEDULER_TICK_SECONDS)
+
+
+def run_request_matching_job(uni_id: int, scoring_weights: dict | None = None,
+                             embedding_config: dict | None = None) -> tuple:
+    """Пакетный мэтчинг заявок. Возвращает (число пар, задержка до следующего запуска)."""
+    logger.info(f"Starting coffee request matching for university_id={uni_id}")
+    matched_count = execute_matching(uni_id, scoring_weights, embedding_config)
+    load = get_pending_requests_load(uni_id, REQUEST_URGENT_HORIZON_MINUTES, LAST_CHANCE_LEAD_SECONDS)
+    delay = next_request_run_delay(load)
+    if load is not None:
+        logger.info(
+            f"[uni={uni_id}] Заявок в пуле: {load['pending']}, срочных: {load['urgent']}, "
+            f"следующий запуск через {delay / 60:.1f} мин"
+        )
+    return matched_count, delay
+
+
+def run_interest_matching_job(uni_id: int, scoring_weights: dict | None = None,
+                              embedding_config: dict | None = None) -> int:
+    _wait_for_embeddings(uni_id)
+
+    # состояние берем с диска: прошлый запуск мог идти в другом процессе пула
+    state = SimilarityState.load(uni_id, codec=codec_from_config(embedding_config))
+
+    logger.info(f"Starting interest matching for university_id={uni_id}")
+    matched_count = execute_interest_matching(
+        uni_id, state=state, scoring_weights=scoring_weights, embedding_config=embedding_config
+    )
+    state.save()
+    return matched_count
+
+
+# --- планировщик в главном процессе ---
+
+def _new_executor() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=MATCHER_MAX_WORKERS, initializer=_init_worker_process)
+
+
+def _on_job_done(job: str, uni_id: int, future):
+    RUNNING.pop((job, uni_id), None)
+    try:
+        result = future.result()
+    except BrokenProcessPool:
+        logger.error(f"[uni={uni_id}] Процесс мэтчинга ({job}) упал, пул будет пересоздан")
+        if job == "requests":
+            NEXT_REQUEST_RUN[uni_id] = time.time() + REQUEST_MATCHING_MIN_INTERVAL_MINUTES * 60
         return
+    except Exception as e:
+        logger.error(f"[uni={uni_id}] {job} matching job: {e}", exc_info=e)
+        if job == "requests":
+            NEXT_REQUEST_RUN[uni_id] = time.time() + REQUEST_MATCHING_MIN_INTERVAL_MINUTES * 60
+        return
+
+    if job == "requests":
+        matched_count, delay = result
+        NEXT_REQUEST_RUN[uni_id] = time.time() + delay
+        logger.info(f"[uni={uni_id}] Coffee request matching completed: {matched_count} pairs created")
+    elif result > 0:
+        logger.info(f"[uni={uni_id}] Interest matching completed: {result} pairs created")
+    else:
+        logger.info(f"[uni={uni_id}] No new interest matches this cycle")
+
+
+JOBS = {
+    "interest": run_interest_matching_job,
+    "requests": run_request_matching_job,
+}
+
+
+def submit_job(job: str, uni_id: int):
+    """Ставит запуск в пул; если предыдущий запуск этого вида для вуза еще идет — пропускаем."""
+    global EXECUTOR
 
+    if (job, uni_id) in RUNNING:
+        logger.warning(f"[uni={uni_id}] Предыдущий запуск ({job}) еще не завершен, пропускаем")
+        return
+
+    # веса правил скоринга и формат эмбеддингов — из разделов "scoring" и "embedding" конфига вуза
+    scoring_weights = TENANTS[uni_id].get("scoring")
+    embedding_config = TENANTS[uni_id].get("embedding")
     try:
-        _wait_for_embeddings(uni_id)
+        future = EXECUTOR.submit(JOBS[job], uni_id, scoring_weights, embedding_config)
+    except BrokenProcessPool:
+        EXECUTOR.shutdown(wait=False, cancel_futures=True)
+        EXECUTOR = _new_executor()
+        future = EXECUTOR.submit(JOBS[job], uni_id, scoring_weights, embedding_config)
 
-        logger.info(f"Starting interest matching for university_id={uni_id}")
-        matched_count = execute_interest_matching(uni_id)
+    RUNNING[(job, uni_id)] = future
+    future.add_done_callback(lambda f: _on_job_done(job, uni_id, f))
 
-        if matched_count > 0:
-            logger.info(f"Interest matching completed: {matched_count} pairs created")
-        else:
-            logger.info("No new interest matches this cycle")
-    except Exception as e:
-        logger.error(f"run_interest_matching_job: {e}", exc_info=True)
+
+def submit_due_request_jobs():
+    now = time.time()
+    for uni_id, next_run in list(NEXT_REQUEST_RUN.items()):
+        if next_run <= now and ("requests", uni_id) not in RUNNING:
+            # до завершения запуска следующее время неизвестно
+            NEXT_REQUEST_RUN[uni_id] = float("inf")
+            submit_job("requests", uni_id)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--config", required=True)
+    parser.add_argument("--config", nargs="+", required=True)
     args = parser.parse_args()
 
-    global MATCHER_CONFIG
-    MATCHER_CONFIG = load_config(args.config)
+    for config_path in args.config:
+        cfg = load_config(config_path)
+        uni_id = cfg.get("university_id")
+        if not uni_id:
+            logger.error(f"university_id is not set in {config_path}")
+            continue
+        TENANTS.setdefault(uni_id, cfg)
 
-    uni_id = MATCHER_CONFIG.get("university_id")
-    logger.info(f"Matcher service starting for university_id={uni_id}, interval={MATCHING_INTERVAL_HOURS}h")
+    if not TENANTS:
+        logger.error("No valid configs, exiting")
+        return
 
-    init_db_pool()
+    global EXECUTOR
+    EXECUTOR = _new_executor()
+
+    for uni_id, cfg in TENANTS.items():
+        interval = cfg.get("matching_interval_hours", MATCHING_INTERVAL_HOURS)
+        logger.info(f"Matcher service: university_id={uni_id}, interval={interval}h")
+        schedule.every(interval).hours.do(submit_job, "interest", uni_id)
 
-    schedule.every(MATCHING_INTERVAL_HOURS).hours.do(run_interest_matching_job)
+        # первый запуск сразу; мэтчинг заявок дальше планирует себя сам
+        submit_job("interest", uni_id)
+        NEXT_REQUEST_RUN[uni_id] = time.time()
 
-    # первый запуск сразу
-    run_interest_matching_job()
+    logger.info(f"Matcher service started for {len(TENANTS)} universities, workers={MATCHER_MAX_WORKERS}")
 
     while True:
         schedule.run_pending()
-        time.sleep(60)
+        submit_due_request_jobs()
+        time.sleep(SCHEDULER_TICK_SECONDS)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Онлайн-мэтчинг заявок на кофе: новая pending заявка сразу сравнивается
+с живым набором pending заявок вуза и, если нашелся совместимый партнер
+с similarity не ниже порога, пара записывается в течение секунд.
+
+Триггер — NOTIFY из migrations/008 (канал ONLINE_MATCH_CHANNEL); если LISTEN
+недоступен или уведомление потерялось, заявки подхватывает опрос раз в
+ONLINE_POLL_SECONDS.
+
+Раз в LAST_CHANCE_INTERVAL_SECONDS лидер прогоняет «последний шанс»: заявки,
+которые expire_pending_requests скоро закроет, мэтчатся с лучшим совместимым
+партнером из живого набора с пониженным порогом.
+
+Реплик может быть несколько: мэтчит только держатель advisory lock
+(online, university_id), остальные держат живой набор теплым и забирают
+lock, как только лидер пропадет.
+"""
+
+import os
+import json
+import time
+import select
+import logging
+import argparse
+import numpy as np
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from src.db import (
+    init_db_pool,
+    get_pending_request_ids,
+    get_user_meeting_history,
+    open_listen_connection,
+    pair_requests_batch,
+    MatcherLock,
+)
+from src.embedding_codec import EmbeddingCodec, codec_from_config
+from src.matcher import (
+    load_request_pool,
+    request_pairs_batch,
+    MATCH_TIME_WINDOW_MINUTES,
+    MATCH_SAME_SHOP_ONLY,
+)
+
+load_dotenv()
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+ONLINE_MATCH_CHANNEL = "coffee_request_pending"
+ONLINE_POLL_SECONDS = float(os.getenv("ONLINE_POLL_SECONDS", "10"))
+ONLINE_MATCH_THRESHOLD = float(os.getenv("ONLINE_MATCH_THRESHOLD", "0.3"))
+# Сколько лучших кандидатов пробуем записать, если партнера успели забрать
+ONLINE_MAX_ATTEMPTS = 3
+
+# expire_pending_requests закрывает pending заявку за 10 минут до встречи
+REQUEST_EXPIRY_LEAD = np.timedelta64(10, "m")
+# Последний шанс: заявки, истекающие в ближайшие LAST_CHANCE_MINUTES
+LAST_CHANCE_MINUTES = int(os.getenv("LAST_CHANCE_MINUTES", "20"))
+LAST_CHANCE_INTERVAL_SECONDS = float(os.getenv("LAST_CHANCE_INTERVAL_SECONDS", "60"))
+LAST_CHANCE_THRESHOLD = float(os.getenv("LAST_CHANCE_THRESHOLD", "0.0"))
+
+
+def load_config(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class OnlineRequestMatcher:
+    """Живой набор pending заявок одного вуза с кодами эмбеддингов (формат вуза)."""
+
+    def __init__(self, uni_id: int, codec: EmbeddingCodec | None = None):
+        self.uni_id = uni_id
+        self.codec = codec or EmbeddingCodec()
+        self.window = np.timedelta64(MATCH_TIME_WINDOW_MINUTES, "m")
+        self.leader_lock = MatcherLock("online", uni_id)
+        self.pool = {
+            "request_ids": np.empty(0, dtype=np.int64),
+            "creator_ids": np.empty(0, dtype=np.int64),
+            "codes": np.empty((0, 0), dtype=self.codec.dtype),
+            "meet_times": np.empty(0, dtype="datetime64[us]"),
+            "shop_ids": np.empty(0, dtype=np.int64),
+        }
+        self.started = False
+        self.leader = False
+
+    def __len__(self):
+        return len(self.pool["request_ids"])
+
+    def _keep(self, mask: np.ndarray):
+        self.pool = {key: values[mask] for key, values in self.pool.items()}
+
+    def _append(self, fresh: dict, rows: np.ndarray):
+        codes = self.codec.encode(fresh["embeddings"][rows])
+        if len(self):
+            codes = np.concatenate([self.pool["codes"], codes])
+        self.pool = {
+            "request_ids": np.concatenate([self.pool["request_ids"], fresh["request_ids"][rows]]),
+            "creator_ids": np.concatenate([self.pool["creator_ids"], fresh["creator_ids"][rows]]),
+            "codes": codes,
+            "meet_times": np.concatenate([self.pool["meet_times"], fresh["meet_times"][rows]]),
+            "shop_ids": np.concatenate([self.pool["shop_ids"], fresh["shop_ids"][rows]]),
+        }
+
+    def _remove_request(self, request_id: int):
+        self._keep(self.pool["request_ids"] != request_id)
+
+    def tick(self):
+        """
+        Синхронизирует живой набор с БД и пытается сразу замэтчить новые заявки.
+        Без лидерства новые заявки только добавляются в набор.
+        """
+        leader = self.leader_lock.acquire()
+        if leader != self.leader:
+            self.leader = leader
+            logger.info(f"[uni={self.uni_id}] Онлайн-мэтчер: " + ("лидер" if leader else "резерв"))
+
+        pending = get_pending_request_ids(self.uni_id)
+        if pending is None:
+            return
+
+        # ушедшие (приняты вручную, отменены, истекли) — выкидываем
+        if len(self):
+            self._keep(np.isin(self.pool["request_ids"], list(pending)))
+
+        new_ids = sorted(pending - set(self.pool["request_ids"].tolist()))
+        if not new_ids:
+            self.started = True
+            return
+
+        fresh = load_request_pool(self.uni_id, request_ids=new_ids)
+        if fresh is None or not len(fresh["request_ids"]):
+            return
+
+        if not self.started or not self.leader:
+            # первый проход (и резерв) — просто загружаем набор, его разберет пакетный мэтчинг
+            self._append(fresh, np.arange(len(fresh["request_ids"])))
+            if not self.started:
+                logger.info(f"[uni={self.uni_id}] Онлайн-мэтчер: {len(self)} pending заявок в наборе")
+            self.started = True
+            return
+
+        for row in np.argsort(fresh["request_ids"], kind="stable"):
+            if not self.try_match(fresh, row):
+                self._append(fresh, np.array([row]))
+
+    def try_match(self, fresh: dict, row: int) -> bool:
+        """Лучший совместимый партнер из живого набора для новой заявки fresh[row]."""
+        if not len(self):
+            return False
+
+        request_id = int(fresh["request_ids"][row])
+        creator_id = int(fresh["creator_ids"][row])
+        vector = self.codec.prepare(fresh["embeddings"][row:row + 1])[0]
+
+        compatible = (
+            (np.abs(self.pool["meet_times"] - fresh["meet_times"][row]) <= self.window)
+            & (self.pool["creator_ids"] != creator_id)
+        )
+        if MATCH_SAME_SHOP_ONLY:
+            compatible &= self.pool["shop_ids"] == fresh["shop_ids"][row]
+        if not compatible.any():
+            return False
+
+        met = get_user_meeting_history(creator_id, self.uni_id)
+        if met:
+            compatible &= ~np.isin(self.pool["creator_ids"], list(met))
+
+        scores = self.codec.decode(self.pool["codes"]) @ vector
+        candidates = np.nonzero(compatible & (scores >= ONLINE_MATCH_THRESHOLD))[0]
+        partner_requests = self.pool["request_ids"][candidates]
+        order = np.argsort(-scores[candidates], kind="stable")[:ONLINE_MAX_ATTEMPTS]
+        return self._pair_with_best(
+            request_id, creator_id, partner_requests[order], scores[candidates][order], "Online match"
+        )
+
+    def _pair_with_best(self, request_id: int, creator_id: int, partner_requests, scores, label: str) -> bool:
+        """Пишет пару с первым свободным из partner_requests (по убыванию score)."""
+        for partner_request, score in zip(partner_requests.tolist(), scores.tolist()):
+            idx = np.nonzero(self.pool["request_ids"] == partner_request)[0]
+            if not len(idx):
+                continue
+            partner_user = int(self.pool["creator_ids"][idx[0]])
+            partner_pool = {
+                "request_ids": np.array([request_id, partner_request]),
+                "creator_ids": np.array([creator_id, partner_user]),
+            }
+            batch = request_pairs_batch(partner_pool, [(request_id, partner_request)])
+            ok = pair_requests_batch(batch, self.uni_id)[0]
+            # в любом случае партнер больше не свободен
+            self._remove_request(partner_request)
+            if ok:
+                logger.info(
+                    f"[uni={self.uni_id}] {label}: Request {request_id} (User {creator_id}) <-> "
+                    f"Request {partner_request} (User {partner_user}), sim={score:.3f}"
+                )
+                return True
+            logger.info(f"[uni={self.uni_id}] Заявка {partner_request} уже занята, пробуем следующего")
+
+        return False
+
+    def last_chance(self, now: np.datetime64) -> int:
+        """
+        Заявки, которые истекут в ближайшие LAST_CHANCE_MINUTES: каждой (самые срочные
+        первыми) — лучший совместимый партнер из живого набора с порогом
+        LAST_CHANCE_THRESHOLD: встреча с невысокой similarity лучше, чем никакой.
+        Возвращает число записанных пар.
+        """
+        if not self.leader or len(self) < 2:
+            return 0
+
+        expires = self.pool["meet_times"] - REQUEST_EXPIRY_LEAD
+        urgent = np.nonzero((expires > now) & (expires <= now + np.timedelta64(LAST_CHANCE_MINUTES, "m")))[0]
+        if not len(urgent):
+            return 0
+        urgent = urgent[np.argsort(self.pool["meet_times"][urgent], kind="stable")]
+
+        # совместимость и similarity для всех срочных заявок разом
+        times, creators = self.pool["meet_times"], self.pool["creator_ids"]
+        compatible = (
+            (np.abs(times[urgent][:, None] - times[None, :]) <= self.window)
+            & (creators[urgent][:, None] != creators[None, :])
+            & (expires > now)[None, :]
+        )
+        if MATCH_SAME_SHOP_ONLY:
+            compatible &= self.pool["shop_ids"][urgent][:, None] == self.pool["shop_ids"][None, :]
+        normed = self.codec.decode(self.pool["codes"])
+        scores = normed[urgent] @ normed.T
+        scores = np.where(compatible & (scores >= LAST_CHANCE_THRESHOLD), scores, -np.inf)
+        request_ids = self.pool["request_ids"].copy()
+
+        matched = 0
+        for row, idx in enumerate(urgent):
+            request_id, creator_id = int(request_ids[idx]), int(creators[idx])
+            # заявку могли забрать в пару на предыдущих шагах
+            if request_id not in self.pool["request_ids"]:
+                continue
+            row_scores = scores[row].copy()
+            row_scores[~np.isin(request_ids, self.pool["request_ids"])] = -np.inf
+            if not np.isfinite(row_scores).any():
+                continue
+            met = get_user_meeting_history(creator_id, self.uni_id)
+            if met:
+                row_scores[np.isin(creators, list(met))] = -np.inf
+
+            order = np.argsort(-row_scores, kind="stable")[:ONLINE_MAX_ATTEMPTS]
+            order = order[np.isfinite(row_scores[order])]
+            if self._pair_with_best(request_id, creator_id, request_ids[order], row_scores[order], "Last-chance match"):
+                self._remove_request(request_id)
+                matched += 1
+
+        if matched:
+            logger.info(f"[uni={self.uni_id}] Последний шанс: {matched} пар из {len(urgent)} истекающих заявок")
+        return matched
+
+
+def _listen():
+    try:
+        conn = open_listen_connection(ONLINE_MATCH_CHANNEL)
+        logger.info(f"LISTEN {ONLINE_MATCH_CHANNEL}")
+        return conn
+    except Exception as e:
+        logger.warning(f"LISTEN недоступен ({e}), работаем опросом раз в {ONLINE_POLL_SECONDS}s")
+        return None
+
+
+def _wait_for_notifications(conn) -> set | None:
+    """
+    Ждет NOTIFY до ONLINE_POLL_SECONDS. Возвращает university_id из уведомлений
+    (пустое множество — таймаут), None — соединение потеряно.
+    """
+    try:
+        ready, _, _ = select.select([conn], [], [], ONLINE_POLL_SECONDS)
+        if not ready:
+            return set()
+        conn.poll()
+        uni_ids = set()
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            try:
+                uni_ids.add(json.loads(notify.payload)["university_id"])
+            except (ValueError, KeyError):
+                logger.warning(f"Некорректный payload уведомления: {notify.payload}")
+        return uni_ids
+    except Exception as e:
+        logger.warning(f"LISTEN-соединение потеряно: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", nargs="+", required=True)
+    args = parser.parse_args()
+
+    matchers = {}
+    for config_path in args.config:
+        config = load_config(config_path)
+        uni_id = config.get("university_id")
+        if uni_id and uni_id not in matchers:
+            matchers[uni_id] = OnlineRequestMatcher(uni_id, codec_from_config(config.get("embedding")))
+
+    logger.info(
+        f"Online matcher starting for university_ids={list(matchers)}, "
+        f"threshold={ONLINE_MATCH_THRESHOLD}, poll={ONLINE_POLL_SECONDS}s"
+    )
+
+    init_db_pool()
+
+    conn = _listen()
+    last_poll = 0.0
+    last_chance = 0.0
+
+    while True:
+        if conn is not None:
+            triggered = _wait_for_notifications(conn)
+            if triggered is None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = _listen()
+                triggered = set()
+        else:
+            time.sleep(ONLINE_POLL_SECONDS)
+            triggered = set()
+
+        # по уведомлению — только нужный вуз, по таймеру — все
+        poll_all = time.monotonic() - last_poll >= ONLINE_POLL_SECONDS
+        if poll_all:
+            last_poll = time.monotonic()
+
+        run_last_chance = time.monotonic() - last_chance >= LAST_CHANCE_INTERVAL_SECONDS
+        if run_last_chance:
+            last_chance = time.monotonic()
+            poll_all = True
+
+        for uni_id, online in matchers.items():
+            if poll_all or uni_id in triggered:
+                try:
+                    online.tick()
+                    if run_last_chance:
+                        online.last_chance(np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "us"))
+                except Exception as e:
+                    logger.error(f"[uni={uni_id}] online tick: {e}", exc_info=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Инструментирование запусков мэтчера: время по фазам, размеры, пиковая память.
+
+Запуск открывается matching_run(...); код мэтчера отмечает фазы через phase(...)
+и счетчики через count(...) — без активного запуска оба вызова ничего не делают.
+Строка в matching_runs открывается при старте (run_id нужен журналу плана),
+по завершении дописываются итоги; метрики — ещё и в textfile для Prometheus.
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from src.db import open_matching_run, record_matching_run
+
+logger = logging.getLogger(__name__)
+
+# Каталог для node_exporter textfile collector
+MATCHER_METRICS_DIR = os.getenv("MATCHER_METRICS_DIR", "/tmp/matcher_metrics")
+
+PHASES = ("fetch", "history", "similarity", "sort", "select", "write")
+COUNTERS = ("pool_size", "candidate_edges", "pairs", "written")
+
+CURRENT_RUN = contextvars.ContextVar("matching_run", default=None)
+
+
+def _reset_peak_rss():
+    # Linux: "5" в clear_refs сбрасывает VmHWM — пик считается с начала запуска
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except Exception:
+        return None
+
+
+class MatchingRun:
+    def __init__(self, uni_id: int, kind: str, engine: str):
+        self.uni_id = uni_id
+        self.kind = kind
+        self.engine = engine
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.peak_memory_mb = None
+        self.error = None
+        self.run_id = None
+        self.resumed_from_run_id = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add(self, name: str, value: int):
+        with self._lock:
+            self.counters[name] += value
+
+    @contextmanager
+    def phase(self, name: str):
+        """Время фазы без вложенных фаз (sort внутри similarity считается только в sort)."""
+        stack = self._local.__dict__.setdefault("stack", [])
+        frame = [time.perf_counter(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            if stack:
+                stack[-1][1] += elapsed
+            with self._lock:
+                self.phase_seconds[name] += elapsed - frame[1]
+
+    def as_row(self) -> dict:
+        return {
+            "university_id": self.uni_id,
+            "kind": self.kind,
+            "engine": self.engine,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **{f"{name}_ms": round(seconds * 1000, 3) for name, seconds in self.phase_seconds.items()},
+            **self.counters,
+            "peak_memory_mb": self.peak_memory_mb,
+            "error": self.error,
+            "resumed_from_run_id": self.resumed_from_run_id,
+        }
+
+
+@contextmanager
+def phase(name: str):
+    run = CURRENT_RUN.get()
+    if run is None:
+        yield
+        return
+    with run.phase(name):
+        yield
+
+
+def current_run() -> MatchingRun | None:
+    return CURRENT_RUN.get()
+
+
+def count(name: str, value: int):
+    run = CURRENT_RUN.get()
+    if run is not None:
+        run.add(name, value)
+
+
+def write_textfile(run: MatchingRun):
+    """Метрики последнего запуска (вуз, вид) в формате Prometheus textfile."""
+    labels = f'university_id="{run.uni_id}",kind="{run.kind}"'
+    lines = [
+        "# TYPE matcher_phase_seconds gauge",
+        *(
+            f'matcher_phase_seconds{{{labels},phase="{name}"}} {seconds:.6f}'
+            for name, seconds in run.phase_seconds.items()
+        ),
+        "# TYPE matcher_run_size gauge",
+        *(f'matcher_run_size{{{labels},what="{name}"}} {value}' for name, value in run.counters.items()),
+        "# TYPE matcher_run_duration_seconds gauge",
+        f"matcher_run_duration_seconds{{{labels}}} "
+        f"{(run.finished_at - run.started_at).total_seconds():.6f}",
+        "# TYPE matcher_run_failed gauge",
+        f"matcher_run_failed{{{labels}}} {int(run.error is not None)}",
+        "# TYPE matcher_last_run_timestamp_seconds gauge",
+        f"matcher_last_run_timestamp_seconds{{{labels}}} {run.finished_at.timestamp():.0f}",
+    ]
+    if run.peak_memory_mb is not None:
+        lines += [
+            "# TYPE matcher_peak_memory_bytes gauge",
+            f"matcher_peak_memory_bytes{{{labels}}} {run.peak_memory_mb * 1024 * 1024:.0f}",
+        ]
+
+    os.makedirs(MATCHER_METRICS_DIR, exist_ok=True)
+    path = os.path.join(MATCHER_METRICS_DIR, f"matcher_{run.kind}_{run.uni_id}.prom")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def matching_run(uni_id: int, kind: str, engine: str):
+    """Открывает запуск мэтчера; по выходу пишет его в matching_runs и в метрики."""
+    run = MatchingRun(uni_id, kind, engine)
+    run.run_id = open_matching_run(uni_id, kind, engine, run.started_at)
+    _reset_peak_rss()
+    token = CURRENT_RUN.set(run)
+    try:
+        yield run
+    except Exception as e:
+        run.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        CURRENT_RUN.reset(token)
+        run.finished_at = datetime.now(timezone.utc)
+        run.peak_memory_mb = _peak_rss_mb()
+
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in run.phase_seconds.items())
+        logger.info(
+            f"[uni={uni_id}] Запуск {kind}: пул {run.counters['pool_size']}, "
+            f"рёбер {run.counters['candidate_edges']}, пар {run.counters['pairs']}, "
+            f"записано {run.counters['written']}; {phases}; пик памяти {run.peak_memory_mb or 0:.0f} MB"
+        )
+
+        record_matching_run(run.as_row(), run.run_id)
+        try:
+            write_textfile(run)
+        except OSError as e:
+            logger.warning(f"Не удалось записать метрики мэтчера: {e}")
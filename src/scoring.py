@@ -0,0 +1,126 @@
+"""
+Правила скоринга пар для мэтчера.
+
+score = min(raw_similarity + Σ weight_rule * rule(i, j), 1.0)
+
+Каждое правило — векторная операция над массивами пула: rows/cols — индексы
+любой совместимой формы ((n, 1) и (1, n) для матрицы, (m,) и (m,) для рёбер),
+поэтому матрица score строится за один проход по правилам.
+Веса задаются per-university в config/*.json, раздел "scoring".
+"""
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Сверх этих значений no_show_count / coffee_streak уже не влияют на score
+RELIABILITY_NO_SHOW_CAP = 3
+STREAK_CAP = 5
+# Ответ «ни один из факультетов» — факультет неизвестен
+UNKNOWN_SCHOOLS = ("Никакая из них", "Никакой из них")
+
+
+def _cross_gender(features):
+    g = np.asarray(features["genders"], dtype=object)
+    male, female = g == "M", g == "F"
+    return lambda rows, cols: (male[rows] & female[cols]) | (female[rows] & male[cols])
+
+
+def _time_proximity(features):
+    # 1 — одно время, 0 — на границе окна совместимости
+    t = features["meet_times"].astype("datetime64[us]").astype(np.int64)
+    window = float(features["time_window"] / np.timedelta64(1, "us"))
+    return lambda rows, cols: np.clip(1.0 - np.abs(t[rows] - t[cols]) / window, 0.0, 1.0)
+
+
+def _reliability(features):
+    # 0 — оба всегда приходят, -1 — оба с no_show_count >= cap
+    penalty = np.minimum(features["no_show_count"], RELIABILITY_NO_SHOW_CAP) / (2 * RELIABILITY_NO_SHOW_CAP)
+    return lambda rows, cols: -(penalty[rows] + penalty[cols])
+
+
+def _streak(features):
+    bonus = np.minimum(features["coffee_streak"], STREAK_CAP) / (2 * STREAK_CAP)
+    return lambda rows, cols: bonus[rows] + bonus[cols]
+
+
+def _school_diversity(features):
+    school = features["school"]
+    known = school >= 0
+    return lambda rows, cols: known[rows] & known[cols] & (school[rows] != school[cols])
+
+
+# имя -> (фабрика правила, нужные признаки пула)
+SCORING_RULES = {
+    "cross_gender": (_cross_gender, ("genders",)),
+    "time_proximity": (_time_proximity, ("meet_times", "time_window")),
+    "reliability": (_reliability, ("no_show_count",)),
+    "streak": (_streak, ("coffee_streak",)),
+    "school_diversity": (_school_diversity, ("school",)),
+}
+
+
+def active_weights(weights: dict | None) -> dict:
+    """Ненулевые веса известных правил."""
+    active = {}
+    for name, weight in (weights or {}).items():
+        if name not in SCORING_RULES:
+            logger.warning(f"Неизвестное правило скоринга '{name}', пропускаем")
+            continue
+        if weight:
+            active[name] = float(weight)
+    return active
+
+
+def required_features(weights: dict | None) -> set:
+    return {feature for name in active_weights(weights) for feature in SCORING_RULES[name][1]}
+
+
+def encode_schools(schools) -> np.ndarray:
+    """Названия факультетов -> коды (-1 — неизвестен)."""
+    codes = {}
+    return np.array(
+        [-1 if not s or s in UNKNOWN_SCHOOLS else codes.setdefault(s, len(codes)) for s in schools],
+        dtype=np.int64,
+    )
+
+
+class Scorer:
+    """Набор правил с весами над признаками конкретного пула."""
+
+    def __init__(self, weights: dict, features: dict, n: int):
+        self.weights = weights
+        self.features = features
+        self.n = n
+        self.rules = [(SCORING_RULES[name][0](features), weight) for name, weight in weights.items()]
+
+    def __call__(self, raw, rows, cols):
+        score = raw
+        for rule, weight in self.rules:
+            score = score + (weight * rule(rows, cols)).astype(raw.dtype, copy=False)
+        return np.minimum(score, 1.0)
+
+    def take(self, index: np.ndarray) -> "Scorer":
+        """Тот же скоринг для подмножества пула (например, корзины заявок)."""
+        features = {
+            key: value[index] if isinstance(value, np.ndarray) and len(value) == self.n else value
+            for key, value in self.features.items()
+        }
+        return Scorer(self.weights, features, len(index))
+
+
+def build_scorer(weights: dict | None, features: dict, n: int) -> Scorer | None:
+    """Scorer для пула или None, если ни одно правило не активно (score = raw)."""
+    weights = active_weights(weights)
+    missing = {
+        name: [f for f in SCORING_RULES[name][1] if features.get(f) is None]
+        for name in weights
+    }
+    for name, absent in missing.items():
+        if absent:
+            logger.warning(f"Правило скоринга '{name}' пропущено: нет признаков {absent}")
+            del weights[name]
+    if not weights:
+        return None
+    return Scorer(weights, features, n)
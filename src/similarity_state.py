@@ -0,0 +1,297 @@
+"""
+Инкрементальное состояние пула мэтчинга по интересам между запусками.
+
+Хранит коды эмбеддингов (src.embedding_codec, формат вуза), индекс
+user_id -> строка и top-k соседей каждой строки. На каждом запуске применяются только
+изменения с прошлой синхронизации (маркер users.matching_updated_at),
+пересчитываются только затронутые строки.
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+from src.db import fetch_interest_pool_arrays, get_db_time, get_deleted_user_ids, get_interest_pool_changes
+from src.embedding_codec import EmbeddingCodec
+from src.matcher import parse_pgvector_string
+
+logger = logging.getLogger(__name__)
+
+STATE_TOP_K = int(os.getenv("STATE_TOP_K", "50"))
+MATCHER_STATE_DIR = os.getenv("MATCHER_STATE_DIR", "/tmp/matcher_state")
+# Полная пересборка раз в N часов — страховка от пропущенных изменений
+STATE_FULL_RESYNC_HOURS = float(os.getenv("STATE_FULL_RESYNC_HOURS", "24"))
+# Перекрытие окна дельты: транзакция могла проставить маркер раньше, а закоммититься позже
+STATE_SYNC_OVERLAP = timedelta(minutes=5)
+# Сколько строк пересчитывать за один matmul
+RECOMPUTE_CHUNK_ROWS = 2048
+
+GENDER_CODES = np.array([None, "M", "F"], dtype=object)
+
+
+def _gender_codes(genders) -> np.ndarray:
+    g = np.asarray(genders, dtype=object)
+    return np.where(g == "M", 1, np.where(g == "F", 2, 0)).astype(np.int8)
+
+
+class SimilarityState:
+    def __init__(self, uni_id: int, top_k: int = STATE_TOP_K, codec: EmbeddingCodec | None = None):
+        self.uni_id = uni_id
+        self.top_k = top_k
+        self.codec = codec or EmbeddingCodec()
+        self.ids = np.empty(0, dtype=np.int64)
+        self.codes = np.empty((0, 0), dtype=self.codec.dtype)
+        self.gender_codes = np.empty(0, dtype=np.int8)
+        self.neighbors = np.empty((0, top_k), dtype=np.int32)
+        self.neighbor_scores = np.empty((0, top_k), dtype=np.float32)
+        self.row_of = {}
+        self.synced_at = None
+        self.full_synced_at = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def genders(self) -> np.ndarray:
+        return GENDER_CODES[self.gender_codes]
+
+    def vectors(self) -> np.ndarray:
+        """Нормированная float32 матрица пула для matmul."""
+        return self.codec.decode(self.codes)
+
+    # --- пересчет ---
+
+    def _k(self) -> int:
+        return max(0, min(self.top_k, len(self.ids) - 1))
+
+    def _recompute_rows(self, rows: np.ndarray):
+        """Полный пересчет top-k для строк rows."""
+        k = self._k()
+        if k == 0 or not len(rows):
+            return
+        normed = self.vectors()
+        for start in range(0, len(rows), RECOMPUTE_CHUNK_ROWS):
+            chunk = rows[start:start + RECOMPUTE_CHUNK_ROWS]
+            scores = normed[chunk] @ normed.T
+            scores[np.arange(len(chunk)), chunk] = -np.inf
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            self.neighbors[chunk, :k] = np.take_along_axis(top, order, axis=1)
+            self.neighbor_scores[chunk, :k] = np.take_along_axis(top_scores, order, axis=1)
+            self.neighbors[chunk, k:] = -1
+            self.neighbor_scores[chunk, k:] = -np.inf
+
+    def _merge_columns(self, rows: np.ndarray, cols: np.ndarray):
+        """Дополняет top-k строк rows новыми similarity со столбцами cols."""
+        k = self._k()
+        if k == 0 or not len(rows) or not len(cols):
+            return
+        normed = self.vectors()
+        col_vectors = normed[cols]
+        for start in range(0, len(rows), RECOMPUTE_CHUNK_ROWS):
+            chunk = rows[start:start + RECOMPUTE_CHUNK_ROWS]
+            scores = normed[chunk] @ col_vectors.T
+            scores[chunk[:, None] == cols[None, :]] = -np.inf
+            merged_idx = np.concatenate(
+                [self.neighbors[chunk, :k], np.broadcast_to(cols, scores.shape)], axis=1
+            )
+            merged_scores = np.concatenate([self.neighbor_scores[chunk, :k], scores], axis=1)
+            order = np.argsort(-merged_scores, axis=1, kind="stable")[:, :k]
+            self.neighbors[chunk, :k] = np.take_along_axis(merged_idx, order, axis=1)
+            self.neighbor_scores[chunk, :k] = np.take_along_axis(merged_scores, order, axis=1)
+
+    def _resize_neighbors(self):
+        n = len(self.ids)
+        self.neighbors = np.full((n, self.top_k), -1, dtype=np.int32)
+        self.neighbor_scores = np.full((n, self.top_k), -np.inf, dtype=np.float32)
+
+    # --- применение изменений ---
+
+    def rebuild(self, ids, embeddings, genders):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.codes = self.codec.encode(embeddings) if len(self.ids) else np.empty((0, 0), self.codec.dtype)
+        self.gender_codes = _gender_codes(genders)
+        self.row_of = {uid: row for row, uid in enumerate(self.ids.tolist())}
+        self._resize_neighbors()
+        self._recompute_rows(np.arange(len(self.ids)))
+
+    def apply_changes(self, upsert_ids, upsert_embeddings, upsert_genders, removed_ids) -> int:
+        """
+        Применяет дельту. Пересчитываются полностью: новые/измененные строки и строки,
+        в чьем top-k был удаленный или измененный пользователь. Остальные строки только
+        дополняются similarity с новыми/измененными. Возвращает число пересчитанных строк.
+        """
+        removed = {uid for uid in removed_ids if uid in self.row_of}
+        upsert_ids = list(upsert_ids)
+        if not removed and not upsert_ids:
+            return 0
+
+        new_codes = self.codec.encode(upsert_embeddings) if upsert_ids else None
+        if len(self.ids) and new_codes is not None and new_codes.shape[1] != self.codes.shape[1]:
+            raise ValueError("embedding dimension changed, full rebuild required")
+
+        # 1. Удаляем ушедших (и старые версии измененных) со сдвигом индексов
+        stale = removed | {uid for uid in upsert_ids if uid in self.row_of}
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[[self.row_of[uid] for uid in stale]] = False
+
+        remap = np.full(len(self.ids) + 1, -1, dtype=np.int32)  # remap[-1] == -1
+        remap[:-1][keep] = np.arange(int(keep.sum()), dtype=np.int32)
+        old_k = self.neighbors.shape[1]
+
+        neighbors = remap[self.neighbors[keep]]
+        neighbor_scores = np.where(neighbors == -1, -np.inf, self.neighbor_scores[keep])
+        # строки, потерявшие соседа, надо пересчитать целиком
+        lost = ((neighbors == -1) & (self.neighbors[keep] != -1)).any(axis=1)
+
+        self.ids = self.ids[keep]
+        self.codes = self.codes[keep] if len(self.codes) else self.codes
+        self.gender_codes = self.gender_codes[keep]
+
+        # 2. Добавляем новые/измененные строки в конец
+        base = len(self.ids)
+        if upsert_ids:
+            self.ids = np.concatenate([self.ids, np.asarray(upsert_ids, dtype=np.int64)])
+            self.codes = new_codes if base == 0 else np.concatenate([self.codes, new_codes])
+            self.gender_codes = np.concatenate([self.gender_codes, _gender_codes(upsert_genders)])
+        self.row_of = {uid: row for row, uid in enumerate(self.ids.tolist())}
+
+        n = len(self.ids)
+        self.neighbors = np.full((n, self.top_k), -1, dtype=np.int32)
+        self.neighbor_scores = np.full((n, self.top_k), -np.inf, dtype=np.float32)
+        self.neighbors[:base, :old_k] = neighbors
+        self.neighbor_scores[:base, :old_k] = neighbor_scores
+
+        fresh = np.arange(base, n)
+        full = np.concatenate([np.nonzero(lost)[0], fresh])
+        partial = np.nonzero(~lost)[0]
+
+        self._merge_columns(partial, fresh)
+        self._recompute_rows(full)
+        return len(full)
+
+    # --- синхронизация с БД ---
+
+    def sync(self) -> bool:
+        """Подтягивает изменения из БД. False — синхронизироваться не удалось."""
+        needs_full = (
+            self.synced_at is None
+            or self.full_synced_at is None
+            or datetime.now(self.full_synced_at.tzinfo) - self.full_synced_at
+            > timedelta(hours=STATE_FULL_RESYNC_HOURS)
+        )
+        if needs_full:
+            return self._full_sync()
+
+        rows, db_now = get_interest_pool_changes(self.uni_id, self.synced_at - STATE_SYNC_OVERLAP)
+        if rows is None:
+            return False
+        # удаленных из users дельта не видит — иначе их пары упадут на FK при записи
+        deleted = get_deleted_user_ids(self.ids.tolist()) if len(self.ids) else []
+        if deleted is None:
+            return False
+
+        upserts = [r for r in rows if r[1]]
+        upsert_ids, upsert_embeddings, upsert_genders = [], [], []
+        for user_id, _, embedding, gender in upserts:
+            embedding = parse_pgvector_string(embedding)
+            row = self.row_of.get(user_id)
+            # перекрытие окна возвращает и уже примененные изменения — пропускаем
+            if (
+                row is not None
+                and np.array_equal(self.codes[row], self.codec.encode([embedding])[0])
+                and self.gender_codes[row] == _gender_codes([gender])[0]
+            ):
+                continue
+            upsert_ids.append(user_id)
+            upsert_embeddings.append(embedding)
+            upsert_genders.append(gender)
+        # дельта общая для всех вузов — считаем только ушедших из нашего пула
+        removed_ids = [r[0] for r in rows if not r[1] and r[0] in self.row_of]
+        removed_ids += deleted
+
+        try:
+            recomputed = self.apply_changes(upsert_ids, upsert_embeddings, upsert_genders, removed_ids)
+        except ValueError as e:
+            logger.warning(f"[uni={self.uni_id}] {e}")
+            return self._full_sync()
+
+        self.synced_at = db_now
+        logger.info(
+            f"[uni={self.uni_id}] Состояние мэтчера: +{len(upsert_ids)} изменено/добавлено, "
+            f"-{len(removed_ids)} вышли, пересчитано строк: {recomputed}, в пуле: {len(self)}"
+        )
+        return True
+
+    def _full_sync(self) -> bool:
+        db_now = get_db_time()
+        pool = fetch_interest_pool_arrays(self.uni_id)
+        if db_now is None or pool is None:
+            return False
+        self.rebuild(pool["user_ids"], pool["embeddings"], pool["genders"])
+        self.synced_at = self.full_synced_at = db_now
+        logger.info(f"[uni={self.uni_id}] Состояние мэтчера пересобрано: {len(self)} пользователей")
+        return True
+
+    # --- кандидаты для мэтчинга ---
+
+    def neighbor_edges(self):
+        """Рёбра (rows, cols, raw similarity) из кэшированных top-k списков."""
+        k = self._k()
+        rows = np.repeat(np.arange(len(self.ids)), k)
+        cols = self.neighbors[:, :k].ravel().astype(np.int64)
+        scores = self.neighbor_scores[:, :k].ravel()
+        found = cols >= 0
+        return rows[found], cols[found], scores[found]
+
+    # --- сохранение между перезапусками ---
+
+    def path(self) -> str:
+        return os.path.join(MATCHER_STATE_DIR, f"similarity_state_{self.uni_id}.npz")
+
+    def save(self):
+        os.makedirs(MATCHER_STATE_DIR, exist_ok=True)
+        tmp_path = self.path() + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            ids=self.ids,
+            codec=np.array(self.codec.describe()),
+            codes=self.codes,
+            gender_codes=self.gender_codes,
+            neighbors=self.neighbors,
+            neighbor_scores=self.neighbor_scores,
+            synced_at=np.array(self.synced_at.isoformat() if self.synced_at else ""),
+            full_synced_at=np.array(self.full_synced_at.isoformat() if self.full_synced_at else ""),
+        )
+        os.replace(tmp_path, self.path())
+
+    @classmethod
+    def load(cls, uni_id: int, top_k: int = STATE_TOP_K, codec: EmbeddingCodec | None = None) -> "SimilarityState":
+        """
+        Состояние с диска или пустое (первый sync сделает полную сборку) — в том
+        числе если на диске коды в другом формате эмбеддингов.
+        """
+        state = cls(uni_id, top_k, codec)
+        try:
+            with np.load(state.path(), allow_pickle=False) as data:
+                if data["neighbors"].shape[1] != top_k:
+                    return state
+                if "codec" not in data.files or str(data["codec"]) != state.codec.describe():
+                    logger.info(f"[uni={uni_id}] Формат эмбеддингов изменился — состояние мэтчера соберем заново")
+                    return state
+                state.ids = data["ids"]
+                state.codes = data["codes"]
+                state.gender_codes = data["gender_codes"]
+                state.neighbors = data["neighbors"]
+                state.neighbor_scores = data["neighbor_scores"]
+                synced_at, full_synced_at = str(data["synced_at"]), str(data["full_synced_at"])
+            state.row_of = {uid: row for row, uid in enumerate(state.ids.tolist())}
+            state.synced_at = datetime.fromisoformat(synced_at) if synced_at else None
+            state.full_synced_at = datetime.fromisoformat(full_synced_at) if full_synced_at else None
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[uni={uni_id}] Не удалось загрузить состояние мэтчера: {e}")
+            state = cls(uni_id, top_k, codec)
+        return state
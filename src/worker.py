@@ -4,9 +4,18 @@ import logging
 import argparse
 import json
 import schedule
+import numpy as np
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
-from db import init_db_pool, get_users_without_embeddings, update_user_embedding
+from src.db import (
+    init_db_pool,
+    get_users_without_embeddings,
+    update_user_embedding,
+    fetch_user_embedding_arrays,
+    replace_user_neighbors,
+)
+from src.embedding_store import EmbeddingStoreWriter
+from src.similarity_state import SimilarityState
 
 load_dotenv()
 
@@ -20,6 +29,18 @@ MODEL = None
 WORKER_CONFIG = {}
 UNIVERSITY_IDS = []
 
+EMBEDDING_DIM = 384
+# Общее memory-mapped хранилище эмбеддингов для мэтчеров на этом хосте (src/embedding_store.py)
+EMBEDDING_STORE_ENABLED = os.getenv("EMBEDDING_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_STORE_RECONCILE_MINUTES = int(os.getenv("EMBEDDING_STORE_RECONCILE_MINUTES", "30"))
+STORES = {}
+# Граф top-k соседей в таблице user_neighbors (лента заявок, ре-мэтч)
+USER_NEIGHBORS_ENABLED = os.getenv("USER_NEIGHBORS_ENABLED", "true").lower() in ("1", "true", "yes")
+USER_NEIGHBORS_K = int(os.getenv("USER_NEIGHBORS_K", "20"))
+# Изменения similarity меньше этого не переписывают список соседей
+NEIGHBOR_SCORE_TOLERANCE = 1e-4
+GRAPHS = {}
+
 
 def load_model():
     global MODEL
@@ -28,6 +49,138 @@ def load_model():
     logger.info("Model loaded (dim=384)")
 
 
+def get_store(uni_id: int):
+    if not EMBEDDING_STORE_ENABLED:
+        return None
+    if uni_id not in STORES:
+        try:
+            STORES[uni_id] = EmbeddingStoreWriter(uni_id, EMBEDDING_DIM)
+        except OSError as e:
+            logger.error(f"[uni={uni_id}] Embedding store unavailable: {e}")
+            return None
+    return STORES[uni_id]
+
+
+def publish_embeddings(uni_id: int, user_ids: list, embeddings: list):
+    """Дописывает новые эмбеддинги в хранилище; без них — heartbeat для читателей."""
+    store = get_store(uni_id)
+    if store is None:
+        return
+    try:
+        if user_ids:
+            store.upsert(user_ids, embeddings)
+        else:
+            store.touch()
+    except OSError as e:
+        logger.error(f"[uni={uni_id}] Failed to update embedding store: {e}")
+
+
+def _neighbor_lists(graph: SimilarityState) -> tuple:
+    """(user_ids (n,), user_id соседей (n, k) с -1 для пустых, scores (n, k))."""
+    rows = graph.neighbors
+    if not len(graph):
+        return graph.ids, rows.astype(np.int64), graph.neighbor_scores
+    neighbor_ids = np.where(rows >= 0, graph.ids[np.maximum(rows, 0)], -1)
+    return graph.ids, neighbor_ids, graph.neighbor_scores
+
+
+def _changed_neighbor_lists(before: tuple, after: tuple) -> tuple:
+    """Маска пользователей after с изменившимся списком соседей и user_id ушедших из графа."""
+    old_ids, old_neighbors, old_scores = before
+    new_ids, new_neighbors, new_scores = after
+    removed = np.setdiff1d(old_ids, new_ids)
+    if not len(old_ids):
+        return np.ones(len(new_ids), dtype=bool), removed
+
+    order = np.argsort(old_ids)
+    pos = order[np.minimum(np.searchsorted(old_ids[order], new_ids), len(order) - 1)]
+    known = old_ids[pos] == new_ids
+    changed = ~known
+    old, new = pos[known], np.nonzero(known)[0]
+    with np.errstate(invalid="ignore"):
+        # -inf - -inf = nan: пустые позиции совпадают, если совпали соседи
+        score_moved = np.abs(old_scores[old] - new_scores[new]) > NEIGHBOR_SCORE_TOLERANCE
+    changed[new] = (old_neighbors[old] != new_neighbors[new]).any(axis=1) | score_moved.any(axis=1)
+    return changed, removed
+
+
+def update_neighbor_graph(uni_id: int, user_ids: list, embeddings, removed_ids=()):
+    """
+    Применяет новые эмбеддинги к графу соседей вуза и переписывает в user_neighbors
+    только изменившиеся списки. Графа еще нет — соберется при сверке.
+    """
+    graph = GRAPHS.get(uni_id)
+    if graph is None or (not len(user_ids) and not len(removed_ids)):
+        return
+    before = _neighbor_lists(graph)
+    try:
+        recomputed = graph.apply_changes(user_ids, embeddings, [None] * len(user_ids), removed_ids)
+    except ValueError as e:
+        logger.warning(f"[uni={uni_id}] Neighbor graph: {e}")
+        GRAPHS.pop(uni_id, None)
+        return
+
+    user_ids_after, neighbor_ids, scores = _neighbor_lists(graph)
+    changed, removed = _changed_neighbor_lists(before, (user_ids_after, neighbor_ids, scores))
+    if not changed.any() and not len(removed):
+        return
+    if replace_user_neighbors(uni_id, user_ids_after[changed], neighbor_ids[changed], scores[changed], removed):
+        logger.info(
+            f"[uni={uni_id}] Neighbor graph: +{len(user_ids)}/-{len(removed)} users, "
+            f"recomputed {recomputed}, rewritten {int(changed.sum())} lists"
+        )
+    else:
+        # таблица разошлась с графом в памяти — пересоберем при следующей сверке
+        GRAPHS.pop(uni_id, None)
+
+
+def sync_neighbor_graph(uni_id: int, user_ids: np.ndarray, embeddings: np.ndarray):
+    """Сверка графа с полным набором эмбеддингов из БД; графа нет — полная сборка и запись."""
+    graph = GRAPHS.get(uni_id)
+    if graph is None:
+        graph = SimilarityState(uni_id, USER_NEIGHBORS_K)
+        graph.rebuild(user_ids, embeddings, [None] * len(user_ids))
+        if replace_user_neighbors(uni_id, *_neighbor_lists(graph), removed_user_ids=None):
+            GRAPHS[uni_id] = graph
+            logger.info(f"[uni={uni_id}] Neighbor graph built: {len(graph)} users, k={USER_NEIGHBORS_K}")
+        return
+
+    changed = np.ones(len(user_ids), dtype=bool)
+    if len(user_ids):
+        rows = np.array([graph.row_of.get(uid, -1) for uid in user_ids.tolist()], dtype=np.int64)
+        known = rows >= 0
+        codes = graph.codec.encode(embeddings[known])
+        changed[known] = (graph.codes[rows[known]] != codes).any(axis=1)
+    removed = np.setdiff1d(graph.ids, user_ids)
+    update_neighbor_graph(uni_id, user_ids[changed].tolist(), embeddings[changed], removed.tolist())
+
+
+def reconcile_embeddings():
+    """
+    Сверка хранилищ и графа соседей с БД: ушедшие и сброшенные (новое bio)
+    эмбеддинги, пропущенные записи.
+    """
+    for uni_id in UNIVERSITY_IDS:
+        data = fetch_user_embedding_arrays(uni_id)
+        if data is None:
+            continue
+
+        store = get_store(uni_id)
+        if store is not None:
+            try:
+                appended, removed = store.reconcile(data["user_ids"], data["embeddings"])
+                if appended or removed:
+                    logger.info(f"[uni={uni_id}] Embedding store reconciled: +{appended}, -{removed}, live {len(store)}")
+            except OSError as e:
+                logger.error(f"[uni={uni_id}] Embedding store reconcile failed: {e}")
+
+        if USER_NEIGHBORS_ENABLED:
+            try:
+                sync_neighbor_graph(uni_id, data["user_ids"], data["embeddings"])
+            except Exception as e:
+                logger.error(f"[uni={uni_id}] Neighbor graph sync failed: {e}")
+
+
 def vectorize_users():
     if not MODEL:
         logger.error("Model is not loaded, skipping")
@@ -39,6 +192,7 @@ def vectorize_users():
         try:
             users = get_users_without_embeddings(uni_id=uni_id, limit=batch_size)
             if not users:
+                publish_embeddings(uni_id, [], [])
                 continue
 
             logger.info(f"[uni={uni_id}] {len(users)} users without embeddings, vectorizing")
@@ -59,12 +213,19 @@ def vectorize_users():
             embeddings = MODEL.encode(enriched_texts, convert_to_numpy=True, show_progress_bar=False)
 
             success_count = 0
+            stored_ids, stored_embeddings = [], []
             for user_id, embedding in zip(user_ids, embeddings):
                 if update_user_embedding(user_id, embedding.tolist(), uni_id):
                     success_count += 1
+                    stored_ids.append(user_id)
+                    stored_embeddings.append(embedding)
                 else:
                     logger.warning(f"Failed to update embedding for user {user_id}")
 
+            publish_embeddings(uni_id, stored_ids, stored_embeddings)
+            if USER_NEIGHBORS_ENABLED:
+                update_neighbor_graph(uni_id, stored_ids, np.asarray(stored_embeddings))
+
             logger.info(f"[uni={uni_id}] Vectorized {success_count}/{len(users)} users")
 
         except Exception as e:
@@ -98,6 +259,9 @@ def main():
     load_model()
 
     schedule.every(60).seconds.do(vectorize_users)
+    if EMBEDDING_STORE_ENABLED or USER_NEIGHBORS_ENABLED:
+        schedule.every(EMBEDDING_STORE_RECONCILE_MINUTES).minutes.do(reconcile_embeddings)
+        reconcile_embeddings()
 
     # первая проверка сразу, не ждем 60с
     vectorize_users()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк мэтчера на синтетических пулах (БД не нужна).
+
+Логика:
+1. Генерирует пул: эмбеддинги вокруг N «тем», пол, историю встреч,
+   для заявок — время встречи и кофейню.
+2. Подменяет функции src.db в модуле src.matcher in-memory версиями.
+3. Замеряет greedy_matching, execute_matching и execute_interest_matching
+   для каждого движка по фазам (load/parse, history, normalize, candidates,
+   select, write).
+4. Печатает/сохраняет JSON; --compare сравнивает с прошлым прогоном.
+
+Запуск:
+    python tests/bench_matcher.py --sizes 1000 5000 20000 --output bench.json
+    python tests/bench_matcher.py --sizes 1000 5000 20000 --compare bench.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import src.matcher as matcher  # noqa: E402
+import src.run_metrics as run_metrics  # noqa: E402
+
+EMBEDDING_DIM = 384
+N_TOPICS = 50
+SHOP_IDS = [1, 2, 3, 4, 5]
+
+
+# --- синтетические данные ---
+
+def make_pool(n: int, history_per_user: float, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(N_TOPICS, EMBEDDING_DIM)).astype(np.float32)
+    embeddings = topics[rng.integers(0, N_TOPICS, n)] + rng.normal(
+        scale=1.5, size=(n, EMBEDDING_DIM)
+    ).astype(np.float32)
+
+    start = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0), "us")
+    meet_times = start + np.timedelta64(1, "h") + rng.integers(0, 3 * 48, n) * np.timedelta64(30, "m")
+
+    n_history = int(n * history_per_user / 2)
+    history = rng.integers(0, n, size=(n_history, 2)) if n > 1 else np.empty((0, 2), np.int64)
+    history = np.unique(np.sort(history[history[:, 0] != history[:, 1]], axis=1), axis=0)
+
+    return {
+        "user_ids": np.arange(1_000_000, 1_000_000 + n, dtype=np.int64),
+        "request_ids": np.arange(1, n + 1, dtype=np.int64),
+        "embeddings": embeddings,
+        "genders": rng.choice(np.array(["M", "F", None], dtype=object), size=n, p=[0.45, 0.45, 0.1]),
+        "meet_times": meet_times,
+        "shop_ids": rng.choice(SHOP_IDS, size=n).astype(np.int64),
+        "history": history,
+    }
+
+
+class InMemoryDB:
+    """Подмена функций src.db, которые использует src.matcher."""
+
+    def __init__(self, pool: dict):
+        self.pool = pool
+        self.index_of = {uid: i for i, uid in enumerate(pool["user_ids"].tolist())}
+        self.written = 0
+        self.runs = []
+        self.plans = {}
+
+    def fetch_interest_pool_arrays(self, uni_id, with_embeddings=True):
+        pool = {"user_ids": self.pool["user_ids"], "genders": self.pool["genders"]}
+        if with_embeddings:
+            pool["embeddings"] = self.pool["embeddings"]
+        return pool
+
+    def fetch_request_pool_arrays(self, uni_id, request_ids=None, with_embeddings=True):
+        rows = np.arange(len(self.pool["request_ids"]))
+        if request_ids is not None:
+            rows = rows[np.isin(self.pool["request_ids"], request_ids)]
+        pool = {
+            "request_ids": self.pool["request_ids"][rows],
+            "creator_ids": self.pool["user_ids"][rows],
+            "meet_times": self.pool["meet_times"][rows],
+            "shop_ids": self.pool["shop_ids"][rows],
+        }
+        if with_embeddings:
+            pool["embeddings"] = self.pool["embeddings"][rows]
+        return pool
+
+    def get_pending_requests_for_matching(self, uni_id):
+        return request_rows(self.pool)
+
+    def get_pool_history_pairs(self, user_ids, uni_id, interest_cooldown_days=None):
+        # история задана в индексах исходного пула -> индексы переданного user_ids
+        position = np.full(len(self.pool["user_ids"]), -1, dtype=np.int64)
+        idx = np.array([self.index_of[uid] for uid in user_ids], dtype=np.int64)
+        position[idx] = np.arange(len(idx))
+        pairs = position[self.pool["history"]]
+        pairs = pairs[(pairs >= 0).all(axis=1)]
+        return np.sort(pairs, axis=1)
+
+    def save_run_plan(self, run_id, entries):
+        self.plans[run_id] = entries
+        return True
+
+    def apply_run_plan(self, run_id, uni_id):
+        start = self.written
+        entries = self.plans.pop(run_id, [])
+        self.written += len(entries)
+        return [
+            {**e, "ord": k, "status": "applied", "result_id": start + k + 1}
+            for k, e in enumerate(entries)
+        ]
+
+    def get_resumable_run(self, uni_id, kind, max_age_minutes):
+        return None
+
+    def get_interest_search_users(self, uni_id):
+        raise RuntimeError("текстовый путь в бенчмарке не используется")
+
+    def open_matching_run(self, uni_id, kind, engine, started_at):
+        self.runs.append(None)
+        return len(self.runs)
+
+    def record_matching_run(self, run, run_id=None):
+        self.runs[run_id - 1] = run
+        return run_id
+
+    @contextmanager
+    def matcher_lock(self, job, uni_id):
+        # одна реплика — lock всегда наш
+        yield True
+
+
+def request_rows(pool: dict) -> list:
+    """Строки в формате get_pending_requests_for_matching (эмбеддинг — текст pgvector)."""
+    meet_times = pool["meet_times"].astype(datetime)
+    return [
+        (
+            int(pool["request_ids"][i]),
+            int(pool["user_ids"][i]),
+            "[" + ",".join(f"{v:.6f}" for v in pool["embeddings"][i]) + "]",
+            meet_times[i].replace(tzinfo=timezone.utc),
+            int(pool["shop_ids"][i]),
+        )
+        for i in range(len(pool["request_ids"]))
+    ]
+
+
+# --- замер фаз ---
+
+PHASES = {
+    "load": ["load_request_pool", "load_interest_pool"],
+    "parse": ["request_pool_from_rows"],
+    "history": ["get_pool_history_pairs"],
+    # мэтчер нормирует эмбеддинги через кодек вуза (src.embedding_codec)
+    "normalize": ["EmbeddingCodec.prepare"],
+    "candidates": ["generate_candidates", "build_candidate_pairs_from_edges"],
+    "select": ["select_pairs"],
+    "write": ["apply_run_plan"],
+}
+
+
+class PhaseTimer:
+    """
+    Оборачивает функции модуля matcher и суммирует время по фазам.
+    Корзины заявок считаются в потоках — их фазы суммируются по всем потокам.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.pairs = 0
+        self.score_sum = 0.0
+        self.depth = threading.local()
+
+    def wrap(self, phase: str, func):
+        def timed(*args, **kwargs):
+            # вложенные вызовы (generate_candidates -> build_candidate_pairs_from_edges) не считаем дважды
+            depth = getattr(self.depth, "value", 0)
+            self.depth.value = depth + 1
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self.depth.value = depth
+            if depth == 0:
+                with self.lock:
+                    self.seconds[phase] += time.perf_counter() - started
+                    if phase == "select":
+                        candidates = args[0]
+                        self.pairs += len(result)
+                        self.score_sum += float(candidates.score[result].sum()) if result else 0.0
+            return result
+
+        return timed
+
+
+def _resolve(name: str) -> tuple:
+    """Имя из модуля matcher ("func" или "Class.method") -> (объект-владелец, атрибут)."""
+    owner, _, attr = name.rpartition(".")
+    return (getattr(matcher, owner) if owner else matcher), attr
+
+
+@contextmanager
+def patched_matcher(db: InMemoryDB, timer: PhaseTimer, engine: str):
+    originals = {}
+
+    def patch(name, value):
+        owner, attr = _resolve(name)
+        originals.setdefault((owner, attr), getattr(owner, attr))
+        setattr(owner, attr, value)
+
+    for name in (
+        "fetch_interest_pool_arrays",
+        "fetch_request_pool_arrays",
+        "get_pending_requests_for_matching",
+        "get_pool_history_pairs",
+        "save_run_plan",
+        "apply_run_plan",
+        "get_resumable_run",
+        "get_interest_search_users",
+        "matcher_lock",
+    ):
+        patch(name, getattr(db, name))
+    # векторы только из InMemoryDB, даже если на хосте работает worker с хранилищем
+    patch("embedding_store", lambda uni_id: None)
+
+    for phase, names in PHASES.items():
+        for name in names:
+            patch(name, timer.wrap(phase, getattr(*_resolve(name))))
+
+    patch("MATCHING_ENGINE", engine)
+    original_record = run_metrics.open_matching_run, run_metrics.record_matching_run
+    run_metrics.open_matching_run = db.open_matching_run
+    run_metrics.record_matching_run = db.record_matching_run
+    try:
+        yield
+    finally:
+        for (owner, attr), value in originals.items():
+            setattr(owner, attr, value)
+        run_metrics.open_matching_run, run_metrics.record_matching_run = original_record
+
+
+# --- сценарии ---
+
+def run_scenario(scenario: str, pool: dict, engine: str, rows=None) -> dict:
+    db = InMemoryDB(pool)
+    timer = PhaseTimer()
+    with patched_matcher(db, timer, engine):
+        started = time.perf_counter()
+        if scenario == "greedy_matching":
+            matcher.greedy_matching(rows, uni_id=1)
+        elif scenario == "execute_matching":
+            matcher.execute_matching(uni_id=1)
+        else:
+            matcher.execute_interest_matching(uni_id=1)
+        total = time.perf_counter() - started
+
+    return {
+        "scenario": scenario,
+        "n": len(pool["user_ids"]),
+        "engine": engine,
+        "total_s": round(total, 4),
+        "phases_s": {phase: round(timer.seconds.get(phase, 0.0), 4) for phase in PHASES},
+        "pairs": timer.pairs,
+        "score_sum": round(timer.score_sum, 4),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["scenario"], r["n"], r["engine"]): r for r in baseline["results"]}
+
+    print(f"\nСравнение с {baseline_path} (commit {baseline.get('commit')}):")
+    print(f"{'scenario':<26}{'n':>8}  {'engine':<16}{'old, s':>10}{'new, s':>10}{'x':>8}{'pairs':>14}")
+    for r in results:
+        key = (r["scenario"], r["n"], r["engine"])
+        if key not in old:
+            continue
+        before = old[key]
+        speedup = before["total_s"] / r["total_s"] if r["total_s"] else float("inf")
+        print(
+            f"{r['scenario']:<26}{r['n']:>8}  {r['engine']:<16}"
+            f"{before['total_s']:>10.3f}{r['total_s']:>10.3f}{speedup:>8.2f}"
+            f"{before['pairs']:>7}->{r['pairs']:<6}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 5000, 20000, 100000])
+    parser.add_argument("--engines", nargs="+", default=["greedy"],
+                        choices=sorted(matcher.MATCHING_ENGINES))
+    parser.add_argument("--scenarios", nargs="+",
+                        default=["greedy_matching", "execute_matching", "execute_interest_matching"],
+                        choices=["greedy_matching", "execute_matching", "execute_interest_matching"])
+    parser.add_argument("--history-per-user", type=float, default=3.0,
+                        help="среднее число прошлых встреч на пользователя")
+    parser.add_argument("--text-max-size", type=int, default=20000,
+                        help="greedy_matching парсит pgvector-текст — для больших пулов пропускаем")
+    parser.add_argument("--repeat", type=int, default=1, help="берется лучший из повторов")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="куда сохранить JSON (по умолчанию stdout)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    logging.getLogger("src").setLevel(logging.WARNING)
+
+    results = []
+    for n in args.sizes:
+        pool = make_pool(n, args.history_per_user, args.seed)
+        rows = None
+        for scenario in args.scenarios:
+            if scenario == "greedy_matching":
+                if n > args.text_max_size:
+                    print(f"skip greedy_matching n={n} (> --text-max-size)", file=sys.stderr)
+                    continue
+                rows = rows or request_rows(pool)
+            for engine in args.engines:
+                runs = [run_scenario(scenario, pool, engine, rows) for _ in range(args.repeat)]
+                best = min(runs, key=lambda r: r["total_s"])
+                results.append(best)
+                print(
+                    f"{scenario:<26} n={n:<7} {engine:<16} {best['total_s']:.3f}s "
+                    f"pairs={best['pairs']}",
+                    file=sys.stderr,
+                )
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "similarity_mode": matcher.SIMILARITY_MODE,
+            "ann_min_pool": matcher.ANN_MIN_POOL,
+            "matcher_memory_limit_mb": matcher.MATCHER_MEMORY_LIMIT_MB,
+            "match_time_window_minutes": matcher.MATCH_TIME_WINDOW_MINUTES,
+            "history_per_user": args.history_per_user,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Тест ANN-кандидатов мэтчера (IVF top-k) против точного перебора (БД не нужна).
+
+Проверяет:
+1. ann_neighbors — recall@k на сидированном пуле с темами не ниже ANN_TARGET_RECALL
+   (считается по всем точкам, а не по выборке, которой ann_neighbors подбирает nprobe)
+2. ann_candidate_pairs — каждое ребро есть среди плотных кандидатов с тем же score,
+   greedy по ANN-кандидатам теряет не больше 2% пар и суммарного score
+3. generate_candidates в режиме auto — ниже ANN_MIN_POOL плотный перебор
+   (ANN не вызывается, результат совпадает с build_candidate_pairs), от ANN_MIN_POOL — ANN
+
+Запуск:
+    python tests/test_ann_candidates.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import src.matcher as matcher  # noqa: E402
+from src.ann_index import ann_neighbors, exact_top_k  # noqa: E402
+
+EMBEDDING_DIM = 32
+POOL_SIZE = 1500
+
+
+def make_pool(n: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(24, EMBEDDING_DIM)).astype(np.float32)
+    embeddings = topics[rng.integers(0, len(topics), n)] + rng.normal(scale=1.2, size=(n, EMBEDDING_DIM))
+    return matcher.normalize_embeddings(embeddings.astype(np.float32))
+
+
+def check_recall(normed: np.ndarray):
+    n = normed.shape[0]
+    k = matcher.ANN_TOP_K
+    neighbors, _, stats = ann_neighbors(
+        normed, k=k, nprobe=matcher.ANN_NPROBE,
+        target_recall=matcher.ANN_TARGET_RECALL, recall_sample=matcher.ANN_RECALL_SAMPLE,
+    )
+    exact = exact_top_k(normed, np.arange(n), k)
+    hits = sum(len(np.intersect1d(neighbors[row], exact[row])) for row in range(n))
+    recall = hits / (n * k)
+    # выборка оценивает recall с погрешностью — допускаем 2 п.п. ниже цели
+    assert recall >= matcher.ANN_TARGET_RECALL - 0.02, (
+        f"recall@{k} = {recall:.3f} < {matcher.ANN_TARGET_RECALL} (nprobe={stats['nprobe']})"
+    )
+    print(f"✅ recall@{k} по всему пулу: {recall:.3f} (nprobe={stats['nprobe']}, по выборке {stats['recall']:.3f})")
+
+
+def check_candidates(normed: np.ndarray):
+    n = normed.shape[0]
+    history = np.random.default_rng(1).integers(0, n, size=(300, 2))
+    history = history[history[:, 0] != history[:, 1]]
+    scoring = {"threshold": 0.15, "excluded_pairs": history}
+
+    dense, _ = matcher.build_candidate_pairs(normed, **scoring)
+    ann, _ = matcher.ann_candidate_pairs(normed, **scoring)
+
+    dense_score = dict(zip((dense.rows * n + dense.cols).tolist(), dense.score.tolist()))
+    ann_keys = (ann.rows * n + ann.cols).tolist()
+    missing = [key for key in ann_keys if key not in dense_score]
+    assert not missing, f"{len(missing)} ANN-рёбер нет среди плотных кандидатов (порог/история не применены?)"
+    assert np.allclose([dense_score[key] for key in ann_keys], ann.score, atol=1e-5), "score ANN-рёбер отличается"
+    assert len(ann_keys) < len(dense_score), "ANN не сократил число кандидатов"
+
+    dense_picked = matcher.greedy_select(dense, n)
+    ann_picked = matcher.greedy_select(ann, n)
+    dense_total = float(dense.score[dense_picked].sum())
+    ann_total = float(ann.score[ann_picked].sum())
+    assert len(ann_picked) >= 0.98 * len(dense_picked), f"ANN: {len(ann_picked)} пар против {len(dense_picked)}"
+    assert ann_total >= 0.98 * dense_total, f"ANN: суммарный score {ann_total:.2f} против {dense_total:.2f}"
+    print(
+        f"✅ ANN-кандидаты: {len(ann_keys)} рёбер из {len(dense_score)}, "
+        f"greedy {len(ann_picked)}/{len(dense_picked)} пар, score {ann_total:.2f}/{dense_total:.2f}"
+    )
+
+
+def check_auto_mode(normed: np.ndarray):
+    calls = []
+    ann_candidate_pairs = matcher.ann_candidate_pairs
+
+    def counting_ann(*args, **kwargs):
+        calls.append(args[0].shape[0])
+        return ann_candidate_pairs(*args, **kwargs)
+
+    saved = matcher.SIMILARITY_MODE, matcher.ANN_MIN_POOL, matcher.ann_candidate_pairs
+    matcher.SIMILARITY_MODE, matcher.ann_candidate_pairs = "auto", counting_ann
+    try:
+        small = normed[:400]
+        matcher.ANN_MIN_POOL = 401
+        auto, _ = matcher.generate_candidates(small, threshold=0.15)
+        dense, _ = matcher.build_candidate_pairs(small, threshold=0.15)
+        assert not calls, "ниже ANN_MIN_POOL вызван ANN"
+        assert np.array_equal(auto.rows, dense.rows) and np.array_equal(auto.cols, dense.cols), (
+            "ниже ANN_MIN_POOL кандидаты отличаются от плотного перебора"
+        )
+        print(f"✅ auto: {len(small)} < ANN_MIN_POOL={matcher.ANN_MIN_POOL} — плотный перебор")
+
+        matcher.ANN_MIN_POOL = 400
+        matcher.generate_candidates(small, threshold=0.15)
+        assert calls == [len(small)], "от ANN_MIN_POOL ANN не вызван"
+        print(f"✅ auto: {len(small)} >= ANN_MIN_POOL={matcher.ANN_MIN_POOL} — ANN")
+    finally:
+        matcher.SIMILARITY_MODE, matcher.ANN_MIN_POOL, matcher.ann_candidate_pairs = saved
+
+
+def main():
+    print("🧪 ANN vs плотный перебор")
+    normed = make_pool(POOL_SIZE, seed=7)
+    check_recall(normed)
+    check_candidates(normed)
+    check_auto_mode(normed)
+    print("✅ Все проверки пройдены")
+
+
+if __name__ == "__main__":
+    main()
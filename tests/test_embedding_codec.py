@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Тест кодека эмбеддингов (src/embedding_codec.py, БД не нужна).
+
+Проверяет на сидированной матрице:
+1. float32 — коды совпадают с нормированными эмбеддингами, decode без копии
+2. float16 — round-trip: единичные строки, ошибка similarity и recall@10 в допуске
+3. PCA — fit_projection + encode: размерность, нормировка, describe с версией,
+   save/load и codec_from_config дают те же коды, потери в допуске
+4. Нулевой вектор остается нулевым, некорректные формат/размерность — ValueError
+
+Запуск:
+    python tests/test_embedding_codec.py
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.embedding_codec import (  # noqa: E402
+    EmbeddingCodec,
+    PcaProjection,
+    codec_from_config,
+    fit_projection,
+    normalize_embeddings,
+    rank_quality,
+)
+
+EMBEDDING_DIM = 384
+N_TOPICS = 40
+PCA_DIM = 128
+# допуски: float16 почти без потерь, PCA — заметные, но ограниченные
+FLOAT16_MAX_ERROR = 2e-3
+FLOAT16_MIN_RECALL = 0.95
+PCA_MEAN_ERROR = 0.05
+PCA_MIN_RECALL = 0.6
+
+
+def make_embeddings(n: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(N_TOPICS, EMBEDDING_DIM)).astype(np.float32)
+    return topics[rng.integers(0, N_TOPICS, n)] + rng.normal(scale=1.0, size=(n, EMBEDDING_DIM)).astype(np.float32)
+
+
+def check(name: str, condition: bool, details: str) -> bool:
+    print(f"{'✅' if condition else '❌'} {name}: {details}")
+    return condition
+
+
+def test_float32(embeddings):
+    codec = EmbeddingCodec("float32")
+    codes = codec.encode(embeddings)
+    decoded = codec.decode(codes)
+    return check(
+        "float32",
+        codec.is_identity and codes.dtype == np.float32
+        and np.allclose(codes, normalize_embeddings(embeddings)) and np.shares_memory(codes, decoded),
+        f"коды = нормированные эмбеддинги, describe={codec.describe()}",
+    )
+
+
+def test_float16(embeddings):
+    codec = EmbeddingCodec("float16")
+    codes = codec.encode(embeddings)
+    decoded = codec.decode(codes)
+    norms = np.linalg.norm(decoded, axis=1)
+    quality = rank_quality(embeddings, codec, k=10, queries=500)
+    return check(
+        "float16",
+        codes.dtype == np.float16 and decoded.dtype == np.float32 and np.allclose(norms, 1.0, atol=1e-3)
+        and quality["max_abs_error"] <= FLOAT16_MAX_ERROR and quality["recall_at_k"] >= FLOAT16_MIN_RECALL
+        and quality["bytes_per_vector"] * 2 == quality["full_bytes_per_vector"],
+        f"recall@10 {quality['recall_at_k']}, max ошибка similarity {quality['max_abs_error']}",
+    )
+
+
+def test_pca(embeddings):
+    projection = fit_projection(embeddings, PCA_DIM, version=3)
+    codec = EmbeddingCodec("float16", projection)
+    codes = codec.encode(embeddings)
+    quality = rank_quality(embeddings, codec, k=10, queries=500)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "pca.npz")
+        projection.save(path)
+        loaded = PcaProjection.load(path)
+        from_config = codec_from_config({"format": "float16", "projection": path})
+        same_codes = np.array_equal(from_config.encode(embeddings), codes)
+
+    return check(
+        "PCA",
+        codes.shape == (len(embeddings), PCA_DIM)
+        and np.allclose(np.linalg.norm(codec.decode(codes), axis=1), 1.0, atol=1e-3)
+        and codec.describe() == f"float16+pca{PCA_DIM}v3"
+        and loaded.version == 3 and np.array_equal(loaded.components, projection.components)
+        and same_codes and from_config.describe() == codec.describe()
+        and quality["mean_abs_error"] <= PCA_MEAN_ERROR and quality["recall_at_k"] >= PCA_MIN_RECALL,
+        f"{codec.describe()}: recall@10 {quality['recall_at_k']}, средняя ошибка {quality['mean_abs_error']}, "
+        f"объяснено {projection.explained:.2f}",
+    )
+
+
+def test_edge_cases(embeddings):
+    zero = np.zeros((1, EMBEDDING_DIM), dtype=np.float32)
+    zero_stays = not EmbeddingCodec("float16").prepare(zero).any()
+
+    errors = 0
+    for bad in (
+        lambda: EmbeddingCodec("int8"),
+        lambda: fit_projection(embeddings, EMBEDDING_DIM, version=1),
+        lambda: fit_projection(embeddings[:, :64], 8, version=1).project(normalize_embeddings(embeddings)),
+    ):
+        try:
+            bad()
+        except ValueError:
+            errors += 1
+    return check(
+        "граничные случаи",
+        zero_stays and errors == 3,
+        "нулевой вектор остается нулевым, некорректный формат/размерность — ValueError",
+    )
+
+
+def main():
+    print("🧪 Кодек эмбеддингов")
+    embeddings = make_embeddings(2000, seed=5)
+    results = [
+        test_float32(embeddings),
+        test_float16(embeddings),
+        test_pca(embeddings),
+        test_edge_cases(embeddings),
+    ]
+    if all(results):
+        print("✅ Все проверки пройдены")
+    else:
+        print(f"❌ Провалено проверок: {results.count(False)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
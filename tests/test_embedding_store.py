@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Тест memory-mapped хранилища эмбеддингов (src/embedding_store.py, БД не нужна).
+
+Проверяет во временном каталоге:
+1. Публикация — читатель видит векторы писателя бит в бит, неизвестные user_id не найдены
+2. Новая версия эмбеддинга — читатель после refresh берет последнюю, старая в tombstones
+3. remove и reconcile — ушедшие пропадают, дописываются только новые/измененные
+4. Компактация — новое поколение файлов, читатель после refresh видит те же векторы
+5. Восстановление — хвост, записанный после последней публикации meta, обрезается
+6. Мэтчер — свежее хранилище отдает векторы пула, устаревшее или неполное —
+   fallback на выгрузку из БД (функция src.db подменена in-memory версией)
+
+Запуск:
+    python tests/test_embedding_store.py
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import src.matcher as matcher  # noqa: E402
+from src.embedding_store import STORE_COMPACT_MIN_ROWS, EmbeddingStore, EmbeddingStoreWriter  # noqa: E402
+
+EMBEDDING_DIM = 16
+UNI_ID = 42
+
+
+def check(name: str, condition: bool, details: str) -> bool:
+    print(f"{'✅' if condition else '❌'} {name}: {details}")
+    return condition
+
+
+def vectors(n: int, rng) -> np.ndarray:
+    return rng.normal(size=(n, EMBEDDING_DIM)).astype(np.float32)
+
+
+def test_publish_and_update(root: str, rng) -> bool:
+    writer = EmbeddingStoreWriter(UNI_ID, EMBEDDING_DIM, root=root)
+    ids = np.arange(100, 150)
+    data = vectors(len(ids), rng)
+    writer.upsert(ids, data)
+
+    reader = EmbeddingStore.open(UNI_ID, root=root)
+    found, got = reader.get(np.concatenate([ids, [999]]))
+    ok_publish = found[:-1].all() and not found[-1] and np.array_equal(got[:-1], data)
+
+    updated = vectors(5, rng)
+    writer.upsert(ids[:5], updated)
+    reader.refresh()
+    _, got = reader.get(ids[:5])
+    ok_update = len(reader) == len(ids) and reader.rows == len(ids) + 5 and np.array_equal(got, updated)
+
+    return (
+        check("публикация", ok_publish, f"{len(reader)} векторов совпадают, user_id 999 не найден")
+        and check("новая версия", ok_update, f"последняя версия 5 векторов, строк {reader.rows}, живых {len(reader)}")
+    )
+
+
+def test_remove_and_reconcile(root: str, rng) -> bool:
+    writer = EmbeddingStoreWriter(UNI_ID, EMBEDDING_DIM, root=root)
+    ids = np.arange(100, 150)
+    _, current = writer.get(ids)
+
+    writer.remove(ids[:3])
+    removed_ok = not writer.get(ids[:3])[0].any()
+
+    # БД: ушли 100..109, у 110..114 новое bio, добавились 200..204
+    db_ids = np.concatenate([ids[10:], np.arange(200, 205)])
+    db_vectors = np.concatenate([current[10:], vectors(5, rng)])
+    db_vectors[:5] = vectors(5, rng)
+    appended, removed = writer.reconcile(db_ids, db_vectors)
+
+    reader = EmbeddingStore.open(UNI_ID, root=root)
+    found, got = reader.get(db_ids)
+    ok = (
+        removed_ok and appended == 10 and removed == 7
+        and found.all() and np.array_equal(got, db_vectors) and len(reader) == len(db_ids)
+    )
+    return check("remove/reconcile", ok, f"дописано {appended}, удалено {removed}, живых {len(reader)}")
+
+
+def test_compaction(root: str, rng) -> bool:
+    writer = EmbeddingStoreWriter(UNI_ID + 1, EMBEDDING_DIM, root=root)
+    ids = np.arange(1, STORE_COMPACT_MIN_ROWS + 1)
+    data = vectors(len(ids), rng)
+    writer.upsert(ids, data)
+    reader = EmbeddingStore.open(UNI_ID + 1, root=root)
+    generation = writer.meta["generation"]
+
+    writer.remove(ids[: len(ids) // 2])
+    compacted = writer.maybe_compact()
+    reader.refresh()
+    found, got = reader.get(ids)
+    keep = len(ids) // 2
+    ok = (
+        compacted and writer.meta["generation"] == generation + 1 and reader.rows == len(ids) - keep
+        and found[keep:].all() and not found[:keep].any() and np.array_equal(got[keep:], data[keep:])
+    )
+    return check("компактация", ok, f"поколение {generation} -> {writer.meta['generation']}, строк {reader.rows}")
+
+
+def test_recovery(root: str, rng) -> bool:
+    writer = EmbeddingStoreWriter(UNI_ID + 2, EMBEDDING_DIM, root=root)
+    writer.upsert([1, 2, 3], vectors(3, rng))
+    # запись после последней публикации meta (worker упал посреди upsert)
+    with open(writer._file("vectors"), "ab") as f:
+        f.write(vectors(2, rng).tobytes())
+    with open(writer._file("ids"), "ab") as f:
+        f.write(np.array([4, 5], dtype="<i8").tobytes())
+
+    restarted = EmbeddingStoreWriter(UNI_ID + 2, EMBEDDING_DIM, root=root)
+    size = os.path.getsize(restarted._file("vectors"))
+    found = restarted.get([1, 2, 3, 4, 5])[0]
+    ok = size == 3 * EMBEDDING_DIM * 4 and found.tolist() == [True, True, True, False, False]
+    return check("восстановление", ok, f"хвост обрезан до {size} байт, видны только опубликованные строки")
+
+
+def test_matcher_fallback(root: str, rng) -> bool:
+    writer = EmbeddingStoreWriter(UNI_ID + 3, EMBEDDING_DIM, root=root)
+    creators = np.array([11, 12, 13], dtype=np.int64)
+    stored = vectors(3, rng)
+    writer.upsert(creators, stored)
+    db_vectors = vectors(3, rng)
+
+    calls = []
+
+    def fetch_request_pool_arrays(uni_id, request_ids=None, with_embeddings=True):
+        calls.append(with_embeddings)
+        pool = {"request_ids": np.array([1, 2, 3], dtype=np.int64), "creator_ids": creators.copy()}
+        if with_embeddings:
+            pool["embeddings"] = db_vectors
+        return pool
+
+    saved = matcher.fetch_request_pool_arrays, matcher.EMBEDDING_STORES.get(UNI_ID + 3)
+    matcher.fetch_request_pool_arrays = fetch_request_pool_arrays
+    matcher.EMBEDDING_STORES[UNI_ID + 3] = EmbeddingStore(UNI_ID + 3, root=root)
+    try:
+        fresh = matcher.load_request_pool(UNI_ID + 3)
+        ok_fresh = calls == [False] and np.array_equal(fresh["embeddings"], stored)
+
+        # worker перестал обновлять хранилище — устарело
+        calls.clear()
+        meta_path = os.path.join(writer.path, "meta.json")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["updated_at"] = time.time() - matcher.EMBEDDING_STORE_MAX_AGE_SECONDS - 60
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        stale = matcher.load_request_pool(UNI_ID + 3)
+        ok_stale = calls == [True] and np.array_equal(stale["embeddings"], db_vectors)
+
+        # свежее, но без одного из создателей
+        calls.clear()
+        writer.remove([13])
+        partial = matcher.load_request_pool(UNI_ID + 3)
+        ok_partial = calls == [False, True] and np.array_equal(partial["embeddings"], db_vectors)
+    finally:
+        matcher.fetch_request_pool_arrays = saved[0]
+        if saved[1] is None:
+            matcher.EMBEDDING_STORES.pop(UNI_ID + 3, None)
+        else:
+            matcher.EMBEDDING_STORES[UNI_ID + 3] = saved[1]
+
+    return (
+        check("мэтчер: свежее хранилище", ok_fresh, "векторы из хранилища, БД без эмбеддингов")
+        and check("мэтчер: устаревшее хранилище", ok_stale, "fallback на выгрузку из БД")
+        and check("мэтчер: неполное хранилище", ok_partial, "нет одного создателя — fallback на БД")
+    )
+
+
+def main():
+    print("🧪 Хранилище эмбеддингов")
+    rng = np.random.default_rng(9)
+    with tempfile.TemporaryDirectory() as root:
+        results = [
+            test_publish_and_update(root, rng),
+            test_remove_and_reconcile(root, rng),
+            test_compaction(root, rng),
+            test_recovery(root, rng),
+            test_matcher_fallback(root, rng),
+        ]
+    if all(results):
+        print("✅ Все проверки пройдены")
+    else:
+        print(f"❌ Провалено проверок: {results.count(False)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
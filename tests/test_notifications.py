@@ -4,9 +4,11 @@
 
 Логика:
 1. Проверяет наличие флага is_match_notification_sent в БД
-2. Создает тестовую ситуацию с matched заявкой без уведомления
-3. Проверяет, что get_new_matches_for_notification корректно её получает
-4. Проверяет, что флаг обновляется после получения
+2. Создает две pending заявки и пишет пару так же, как мэтчер (pair_requests_batch)
+3. Проверяет результат записи: основная заявка matched с партнером и
+   is_match_notification_sent = FALSE, собственная заявка партнера cancelled
+4. Проверяет, что get_new_matches_for_notification корректно её получает
+5. Проверяет, что флаг обновляется после получения
 
 Запуск:
     python test_notifications.py --config config/mipt.json
@@ -14,7 +16,7 @@
 import argparse
 import json
 from datetime import datetime, timedelta, timezone
-from src.db import init_db_pool, get_db_connection
+from src.db import init_db_pool, get_db_connection, pair_requests_batch
 
 
 def load_config(path: str):
@@ -49,7 +51,10 @@ def check_migration_applied(uni_id: int):
 
 
 def create_test_matched_request(uni_id: int):
-    """Создает тестовую matched заявку с is_match_notification_sent = FALSE."""
+    """
+    Создает по pending заявке от двух тестовых пользователей и пишет их пару через
+    pair_requests_batch. Возвращает (request_id основной заявки, request_id заявки партнера).
+    """
     # Создаем двух тестовых пользователей
     user_sql = """
         INSERT INTO users (user_id, username, first_name, bio, is_active, created_at, last_seen, university_id)
@@ -102,31 +107,74 @@ def create_test_matched_request(uni_id: int):
                     return None
                 shop_id = result[0]
 
-                # Создаем matched заявку
+                # Создаем pending заявки обоих пользователей
                 meet_time = datetime.now(timezone.utc) + timedelta(hours=2)
                 request_sql = """
                     INSERT INTO coffee_requests
-                    (creator_user_id, partner_user_id, shop_id, meet_time, status,
-                     university_id, created_at, is_match_notification_sent)
-                    VALUES (%s, %s, %s, %s, 'matched', %s, %s, FALSE)
+                    (creator_user_id, shop_id, meet_time, status, university_id, created_at)
+                    VALUES (%s, %s, %s, 'pending', %s, %s)
                     RETURNING request_id;
                 """
 
-                cur.execute(
-                    request_sql,
-                    (test_users[0]["user_id"], test_users[1]["user_id"], shop_id, meet_time, uni_id, now),
-                )
-                request_id = cur.fetchone()[0]
+                request_ids = []
+                for user in test_users:
+                    cur.execute(request_sql, (user["user_id"], shop_id, meet_time, uni_id, now))
+                    request_ids.append(cur.fetchone()[0])
 
                 conn.commit()
-                print(f"✅ Создана тестовая matched заявка: request_id={request_id}")
-                print(f"   Creator: {test_users[0]['first_name']} (ID: {test_users[0]['user_id']})")
-                print(f"   Partner: {test_users[1]['first_name']} (ID: {test_users[1]['user_id']})")
-                return request_id
     except Exception as e:
         print(f"❌ Ошибка создания тестовой заявки: {e}")
         return None
 
+    # Пара пишется тем же путем, что и у мэтчера: основная — заявка с меньшим ID
+    request_id, partner_request_id = request_ids
+    if pair_requests_batch([(request_id, test_users[1]["user_id"], partner_request_id)], uni_id) != [True]:
+        print("❌ pair_requests_batch не записал пару")
+        return None
+
+    print(f"✅ Создана тестовая matched заявка: request_id={request_id}")
+    print(f"   Creator: {test_users[0]['first_name']} (ID: {test_users[0]['user_id']})")
+    print(f"   Partner: {test_users[1]['first_name']} (ID: {test_users[1]['user_id']}), "
+          f"его заявка {partner_request_id}")
+    return request_id, partner_request_id
+
+
+def verify_pairing_result(request_id: int, partner_request_id: int, uni_id: int):
+    """
+    Проверяет запись пары мэтчером: основная заявка matched и ждет уведомления
+    (is_match_notification_sent = FALSE — его отправит notify_new_matches_job),
+    заявка партнера закрыта (cancelled), чтобы его не замэтчили второй раз.
+    """
+    sql = """
+        SELECT request_id, status, partner_user_id, is_match_notification_sent
+        FROM coffee_requests
+        WHERE request_id = ANY(%s) AND university_id = %s;
+    """
+
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, ([request_id, partner_request_id], uni_id))
+                rows = {row[0]: row[1:] for row in cur.fetchall()}
+    except Exception as e:
+        print(f"❌ Ошибка проверки записи пары: {e}")
+        return False
+
+    status, partner_user_id, notification_sent = rows.get(request_id, (None, None, None))
+    partner_status = rows.get(partner_request_id, (None,))[0]
+    ok = (
+        status == "matched"
+        and partner_user_id is not None
+        and notification_sent is False
+        and partner_status == "cancelled"
+    )
+    if ok:
+        print(f"✅ Заявка {request_id}: matched, уведомление ожидает отправки; заявка партнера {partner_request_id}: cancelled")
+    else:
+        print(f"❌ Заявка {request_id}: status={status}, partner={partner_user_id}, "
+              f"is_match_notification_sent={notification_sent}; заявка партнера: {partner_status}")
+    return ok
+
 
 def test_get_new_matches(uni_id: int):
     """Тестирует функцию get_new_matches_for_notification."""
@@ -198,19 +246,26 @@ def main():
         return
 
     # Шаг 2: Создание тестовой matched заявки
-    print("\nШаг 2: Создание тестовой matched заявки...")
-    request_id = create_test_matched_request(uni_id)
-    if not request_id:
+    print("\nШаг 2: Создание тестовой пары через pair_requests_batch...")
+    created = create_test_matched_request(uni_id)
+    if not created:
         print("\n❌ ТЕСТ ПРОВАЛЕН: Не удалось создать тестовую заявку.")
         return
+    request_id, partner_request_id = created
+
+    # Шаг 3: Проверка записи пары
+    print("\nШаг 3: Проверка статусов и флага уведомления после записи пары...")
+    if not verify_pairing_result(request_id, partner_request_id, uni_id):
+        print("\n❌ ТЕСТ ПРОВАЛЕН: Пара записана не так, как ожидает бот.")
+        return
 
-    # Шаг 3: Проверка get_new_matches_for_notification
-    print("\nШаг 3: Проверка get_new_matches_for_notification...")
+    # Шаг 4: Проверка get_new_matches_for_notification
+    print("\nШаг 4: Проверка get_new_matches_for_notification...")
     if not test_get_new_matches(uni_id):
         print("\n⚠️  ВНИМАНИЕ: Функция не вернула матчи (может быть нормально, если все уже отправлены).")
 
-    # Шаг 4: Проверка обновления флага
-    print("\nШаг 4: Проверка обновления флага...")
+    # Шаг 5: Проверка обновления флага
+    print("\nШаг 5: Проверка обновления флага...")
     if verify_flag_updated(request_id, uni_id):
         print("\n✅ ТЕСТ ПРОЙДЕН: Система уведомлений работает корректно!")
         print("\n📝 Следующий шаг: Запустите бот и проверьте логи:")
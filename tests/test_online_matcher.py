@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Тест онлайн-мэтчера заявок (src/online_matcher.py, БД не нужна).
+
+Функции src.db, которые использует OnlineRequestMatcher, подменены in-memory
+набором заявок (как в bench_matcher.py); similarity задается векторами напрямую.
+
+Проверяет:
+1. tick — первый проход только загружает живой набор, без мэтчинга
+2. try_match — лучший совместимый партнер: вне окна времени, своя же заявка,
+   уже встречавшийся и ниже ONLINE_MATCH_THRESHOLD отсекаются; занятый
+   партнер пропускается и выбывает из набора, пара пишется со следующим
+3. try_match без подходящих партнеров — заявка остается в живом наборе
+4. last_chance — срочные заявки (самые ранние первыми) получают партнера
+   с пониженным порогом; истекающие партнеры и несрочные пары не трогаются
+5. last_chance без лидерства ничего не пишет
+
+Запуск:
+    python tests/test_online_matcher.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import src.online_matcher as online_matcher  # noqa: E402
+from src.online_matcher import OnlineRequestMatcher  # noqa: E402
+
+EMBEDDING_DIM = 16
+NOW = np.datetime64("2026-03-02T12:00:00", "us")
+SHOP_ID = 1
+
+
+def vector(axis: int, similarity: float = 0.0, to: int = 0) -> np.ndarray:
+    """Единичный вектор с cosine similarity = similarity к оси `to` (остальное — ось axis)."""
+    v = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    v[to] = similarity
+    v[axis] += np.sqrt(1.0 - similarity ** 2)
+    return v
+
+
+def minutes(m: int) -> np.datetime64:
+    return NOW + np.timedelta64(m, "m")
+
+
+class InMemoryRequests:
+    """Подмена функций src.db, которые использует src.online_matcher."""
+
+    def __init__(self):
+        self.requests = {}  # request_id -> (creator_id, embedding, meet_time)
+        self.pending = set()
+        self.history = {}
+        self.pairs = []
+
+    def add(self, request_id: int, creator_id: int, embedding: np.ndarray, meet_time: np.datetime64):
+        self.requests[request_id] = (creator_id, embedding, meet_time)
+        self.pending.add(request_id)
+
+    def get_pending_request_ids(self, uni_id):
+        return set(self.pending)
+
+    def load_request_pool(self, uni_id, request_ids=None):
+        ids = sorted(self.pending if request_ids is None else request_ids)
+        return {
+            "request_ids": np.array(ids, dtype=np.int64),
+            "creator_ids": np.array([self.requests[r][0] for r in ids], dtype=np.int64),
+            "embeddings": np.array([self.requests[r][1] for r in ids], dtype=np.float32).reshape(-1, EMBEDDING_DIM),
+            "meet_times": np.array([self.requests[r][2] for r in ids], dtype="datetime64[us]"),
+            "shop_ids": np.full(len(ids), SHOP_ID, dtype=np.int64),
+        }
+
+    def get_user_meeting_history(self, user_id, uni_id):
+        return self.history.get(user_id, set())
+
+    def pair_requests_batch(self, pairs, uni_id):
+        results = []
+        for main_request, _, partner_request in pairs:
+            ok = main_request in self.pending and partner_request in self.pending
+            if ok:
+                self.pending -= {main_request, partner_request}
+                self.pairs.append((main_request, partner_request))
+            results.append(ok)
+        return results
+
+
+class Leader:
+    def __init__(self, leader: bool = True):
+        self.leader = leader
+
+    def acquire(self) -> bool:
+        return self.leader
+
+
+def patched(db: InMemoryRequests):
+    names = ("get_pending_request_ids", "load_request_pool", "get_user_meeting_history", "pair_requests_batch")
+    saved = {name: getattr(online_matcher, name) for name in names}
+    for name in names:
+        setattr(online_matcher, name, getattr(db, name))
+    return saved
+
+
+def restore(saved: dict):
+    for name, func in saved.items():
+        setattr(online_matcher, name, func)
+
+
+def live_ids(online: OnlineRequestMatcher) -> set:
+    return set(online.pool["request_ids"].tolist())
+
+
+def test_try_match():
+    print("\n🧪 try_match")
+    db = InMemoryRequests()
+    db.add(1, 101, vector(1, 0.9), minutes(180))  # лучший, но вне окна времени
+    db.add(2, 102, vector(2, 0.85), minutes(60))  # уже встречался с создателем новой заявки
+    db.add(3, 200, vector(3, 0.99), minutes(60))  # своя же заявка создателя
+    db.add(4, 104, vector(4, 0.7), minutes(70))  # лучший допустимый, но его успеют забрать
+    db.add(5, 105, vector(5, 0.5), minutes(50))  # должен стать партнером
+    db.add(6, 106, vector(6, 0.2), minutes(60))  # ниже ONLINE_MATCH_THRESHOLD
+    db.history[200] = {102}
+
+    online = OnlineRequestMatcher(uni_id=1)
+    online.leader_lock = Leader()
+    saved = patched(db)
+    try:
+        online.tick()
+        ok = db.pairs == [] and live_ids(online) == {1, 2, 3, 4, 5, 6}
+        print(f"{'✅' if ok else '❌'} первый tick: {len(online)} заявок в наборе, пар {len(db.pairs)}")
+
+        db.pending.discard(4)  # заявку 4 забрали вручную между tick'ами — набор об этом еще не знает
+        db.add(10, 200, vector(10, 1.0), minutes(60))
+        fresh = db.load_request_pool(1, [10])
+        matched = online.try_match(fresh, 0)
+        ok_match = matched and db.pairs == [(5, 10)] and live_ids(online) == {1, 2, 3, 6}
+        print(
+            f"{'✅' if ok_match else '❌'} новая заявка: пары {db.pairs}, "
+            f"занятая 4 и партнер 5 ушли из набора, осталось {sorted(live_ids(online))}"
+        )
+
+        db.add(11, 201, vector(11), minutes(60))
+        online.tick()
+        ok_left = db.pairs == [(5, 10)] and 11 in live_ids(online)
+        print(f"{'✅' if ok_left else '❌'} без подходящего партнера: заявка 11 осталась в наборе")
+    finally:
+        restore(saved)
+    return ok and ok_match and ok_left
+
+
+def test_last_chance():
+    print("\n🧪 last_chance")
+    db = InMemoryRequests()
+    # истекают через 15 и 18 минут (встреча - 10 минут) — срочные
+    db.add(1, 301, vector(0), minutes(25))
+    db.add(2, 302, vector(1), minutes(28))
+    db.add(3, 303, vector(2, 0.1, to=0), minutes(40))  # слабый, но совместимый с 1
+    db.add(4, 304, vector(3, 0.9, to=0), minutes(5))  # лучший для 1, но уже истекает
+    db.add(5, 305, vector(4, 0.2, to=1), minutes(50))  # партнер для 2
+    db.add(6, 306, vector(5, 0.9, to=1), minutes(300))  # вне окна
+    db.add(7, 307, vector(6), minutes(290))  # несрочная, в окне только с 6
+    db.add(8, 308, vector(7), minutes(310))
+
+    online = OnlineRequestMatcher(uni_id=1)
+    saved = patched(db)
+    try:
+        online.leader_lock = Leader(False)
+        online.tick()
+        not_leader = online.last_chance(NOW) == 0 and db.pairs == []
+        print(f"{'✅' if not_leader else '❌'} без лидерства: пар {len(db.pairs)}")
+
+        online.leader_lock = Leader()
+        online.tick()
+        matched = online.last_chance(NOW)
+        ok = matched == 2 and db.pairs == [(1, 3), (2, 5)] and live_ids(online) == {4, 6, 7, 8}
+        print(
+            f"{'✅' if ok else '❌'} срочные: {matched} пар {db.pairs}, "
+            f"истекающая 4 и несрочные {sorted(live_ids(online) - {4})} не тронуты"
+        )
+    finally:
+        restore(saved)
+    return not_leader and ok
+
+
+def main():
+    print("🔍 Тест онлайн-мэтчера")
+    print("=" * 80)
+    results = [test_try_match(), test_last_chance()]
+    print("\n" + "=" * 80)
+    if all(results):
+        print("✅ ВСЕ ТЕСТЫ ПРОЙДЕНЫ")
+    else:
+        print("❌ ТЕСТЫ НЕ ПРОЙДЕНЫ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
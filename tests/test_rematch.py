@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Тест мгновенного ре-мэтча (find_rematch_request).
+
+Пользователь VIEWER остался без пары по заявке FREED (партнер отказался).
+Кандидаты — pending заявки с заранее заданной cosine similarity к VIEWER,
+каждая отсекается ровно одним фильтром:
+1. Базовый случай — лучший кандидат, прошедший все фильтры
+2. Окно времени — кандидат за пределами ±window_minutes появляется при широком окне
+3. exclude_user_ids — исключенный создатель не предлагается
+4. История — с уже встречавшимся не мэтчит даже при высокой similarity
+5. Истекающие (встреча раньше чем через 10 минут) не предлагаются
+6. same_shop — кандидат из другой кофейни только при same_shop=False
+7. min_similarity — ниже порога ничего не возвращается
+
+Все данные — в фиктивном вузе FAKE_UNI_ID.
+
+Запуск:
+    DB_PORT=5433 python tests/test_rematch.py
+"""
+import json
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from src.db import init_db_pool, get_db_connection, find_rematch_request
+
+# Тестовые user_id (гарантированно не конфликтуют с production)
+VIEWER = 7774001
+FAR = 7774002  # similarity 1.0, встреча на 90 минут позже FREED
+EXCLUDED = 7774003  # 0.95, передается в exclude_user_ids
+MET = 7774004  # 0.9, уже встречался с VIEWER
+EXPIRING = 7774005  # 0.85, встреча через 8 минут
+OTHER_SHOP = 7774006  # 0.8, другая кофейня
+LOW = 7774007  # 0.2, ниже порога
+BEST = 7774008  # 0.6 — ожидаемый кандидат
+SECOND = 7774009  # 0.5
+EX_PARTNER = 7774010  # создатель FREED, отказался от встречи
+TEST_USERS = [VIEWER, FAR, EXCLUDED, MET, EXPIRING, OTHER_SHOP, LOW, BEST, SECOND, EX_PARTNER]
+SIMILARITY = {FAR: 1.0, EXCLUDED: 0.95, MET: 0.9, EXPIRING: 0.85, OTHER_SHOP: 0.8, LOW: 0.2, BEST: 0.6, SECOND: 0.5}
+FAKE_UNI_ID = 99993
+EMBEDDING_DIM = 384
+WINDOW_MINUTES = 60
+MIN_SIMILARITY = 0.3
+
+
+def embedding(axis: int, similarity: float) -> str:
+    """Единичный вектор с cosine similarity = similarity к оси 0 (эмбеддинг VIEWER)."""
+    vector = np.zeros(EMBEDDING_DIM)
+    vector[0] = similarity
+    vector[axis] += np.sqrt(1.0 - similarity ** 2)
+    return json.dumps(vector.tolist())
+
+
+def cleanup():
+    """Удаляет все тестовые данные."""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM coffee_requests WHERE creator_user_id = ANY(%s);", (TEST_USERS,))
+                cur.execute("DELETE FROM users WHERE user_id = ANY(%s);", (TEST_USERS,))
+                cur.execute("DELETE FROM coffee_shops WHERE university_id = %s;", (FAKE_UNI_ID,))
+                cur.execute("DELETE FROM universities WHERE id = %s;", (FAKE_UNI_ID,))
+                conn.commit()
+        print("   Тестовые данные очищены.")
+    except Exception as e:
+        print(f"   Ошибка очистки: {e}")
+
+
+def setup():
+    """Пользователи, две кофейни, отмененная заявка FREED и pending заявки кандидатов. Возвращает FREED."""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """INSERT INTO universities (id, slug, name, is_active)
+                       VALUES (%s, %s, %s, TRUE)
+                       ON CONFLICT (id) DO NOTHING;""",
+                    (FAKE_UNI_ID, "rematch_test_uni", "Rematch Test University"),
+                )
+
+                now = datetime.now(timezone.utc)
+                for k, uid in enumerate(TEST_USERS):
+                    vector = embedding(k + 1, SIMILARITY.get(uid, 1.0 if uid == VIEWER else 0.0))
+                    cur.execute(
+                        """INSERT INTO users (user_id, username, first_name, is_active,
+                                             created_at, last_seen, university_id, embedding)
+                           VALUES (%s, %s, %s, TRUE, %s, %s, %s, %s)
+                           ON CONFLICT (user_id) DO UPDATE SET
+                               university_id = EXCLUDED.university_id,
+                               embedding = EXCLUDED.embedding;""",
+                        (uid, f"rematch_test_{k + 1}", f"Rematch {k + 1}", now, now, FAKE_UNI_ID, vector),
+                    )
+
+                shops = []
+                for name in ("Rematch Test Coffee", "Rematch Test Other Coffee"):
+                    cur.execute(
+                        "INSERT INTO coffee_shops (name, university_id) VALUES (%s, %s) RETURNING shop_id;",
+                        (name, FAKE_UNI_ID),
+                    )
+                    shops.append(cur.fetchone()[0])
+
+                freed_time = now + timedelta(minutes=30)
+                cur.execute(
+                    """INSERT INTO coffee_requests (creator_user_id, partner_user_id, shop_id, meet_time,
+                                                   status, university_id)
+                       VALUES (%s, %s, %s, %s, 'cancelled', %s)
+                       RETURNING request_id;""",
+                    (EX_PARTNER, VIEWER, shops[0], freed_time, FAKE_UNI_ID),
+                )
+                freed = cur.fetchone()[0]
+
+                # прошлая встреча VIEWER и MET
+                cur.execute(
+                    """INSERT INTO coffee_requests (creator_user_id, partner_user_id, shop_id, meet_time,
+                                                   status, university_id)
+                       VALUES (%s, %s, %s, %s, 'matched', %s);""",
+                    (MET, VIEWER, shops[0], now - timedelta(days=2), FAKE_UNI_ID),
+                )
+
+                candidates = [
+                    (FAR, shops[0], freed_time + timedelta(minutes=90)),
+                    (EXCLUDED, shops[0], freed_time),
+                    (MET, shops[0], freed_time),
+                    (EXPIRING, shops[0], now + timedelta(minutes=8)),
+                    (OTHER_SHOP, shops[1], freed_time),
+                    (LOW, shops[0], freed_time),
+                    (BEST, shops[0], freed_time + timedelta(minutes=30)),
+                    (SECOND, shops[0], freed_time - timedelta(minutes=15)),
+                ]
+                for creator, shop_id, meet_time in candidates:
+                    cur.execute(
+                        """INSERT INTO coffee_requests (creator_user_id, shop_id, meet_time, status, university_id)
+                           VALUES (%s, %s, %s, 'pending', %s);""",
+                        (creator, shop_id, meet_time, FAKE_UNI_ID),
+                    )
+
+                conn.commit()
+
+        print(f"   Пользователи: {TEST_USERS}")
+        print(f"   Освободившаяся заявка: {freed}")
+        return freed
+    except Exception as e:
+        print(f"   ❌ Ошибка setup: {e}")
+        return None
+
+
+def check(name: str, freed: int, expected_creator, **overrides) -> bool:
+    params = {
+        "exclude_user_ids": [EX_PARTNER, EXCLUDED],
+        "window_minutes": WINDOW_MINUTES,
+        "same_shop": True,
+        "min_similarity": MIN_SIMILARITY,
+        **overrides,
+    }
+    result = find_rematch_request(VIEWER, freed, FAKE_UNI_ID, **params)
+    creator = result[1] if result else None
+    ok = creator == expected_creator
+    if ok and result:
+        ok = abs(result[2] - SIMILARITY[creator]) < 1e-3
+    print(f"   {'✅' if ok else '❌'} {name}: {result} (ожидали создателя {expected_creator})")
+    return ok
+
+
+def main():
+    print("🔍 Тест мгновенного ре-мэтча")
+    print(f"   university_id: {FAKE_UNI_ID} (фиктивный)")
+    print("=" * 80)
+
+    init_db_pool()
+
+    print("\n📋 Очистка и создание тестовых данных...")
+    cleanup()
+    freed = setup()
+    if not freed:
+        print("❌ Не удалось создать тестовые данные.")
+        return
+
+    print("\n🧪 find_rematch_request")
+    results = [
+        check("Тест 1, 3-5: окно, exclude, история, истекающие", freed, BEST),
+        check("Тест 2: широкое окно", freed, FAR, window_minutes=2 * WINDOW_MINUTES),
+        check("Тест 3: без exclude", freed, EXCLUDED, exclude_user_ids=[EX_PARTNER]),
+        check("Тест 6: same_shop=False", freed, OTHER_SHOP, same_shop=False),
+        check("Тест 1: лучший исключен — следующий", freed, SECOND, exclude_user_ids=[EX_PARTNER, EXCLUDED, BEST]),
+        check("Тест 7: порог выше всех кандидатов", freed, None, min_similarity=0.99),
+    ]
+
+    print("\n📋 Очистка тестовых данных...")
+    cleanup()
+
+    print("\n" + "=" * 80)
+    passed = sum(results)
+    total = len(results)
+    if all(results):
+        print(f"✅ ВСЕ ТЕСТЫ ПРОЙДЕНЫ ({passed}/{total})")
+    else:
+        print(f"❌ ТЕСТЫ НЕ ПРОЙДЕНЫ ({passed}/{total})")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Тест similarity в ленте заявок (get_pending_requests) с графом соседей user_neighbors.
+
+Проверяет, для каждой заявки отдельно:
+1. Создатель есть среди соседей зрителя — similarity_percent из user_neighbors
+2. Создателя нет среди соседей — similarity_percent считает pgvector
+3. У создателя нет эмбеддинга — similarity_percent NULL, заявка в конце ленты
+4. Соседи, записанные под другим вузом, не используются
+
+Все данные — в фиктивном вузе FAKE_UNI_ID.
+
+Запуск:
+    DB_PORT=5433 python tests/test_request_feed.py
+"""
+import json
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from src.db import init_db_pool, get_db_connection, get_pending_requests
+
+# Тестовые user_id (гарантированно не конфликтуют с production)
+VIEWER = 7773001
+NEIGHBOR_CREATOR = 7773002  # в графе соседей зрителя с similarity 0.9
+PLAIN_CREATOR = 7773003  # не в графе, эмбеддинг совпадает со зрителем
+NO_EMBEDDING_CREATOR = 7773004
+OTHER_UNI_NEIGHBOR = 7773005  # запись в user_neighbors под OTHER_UNI_ID
+TEST_USERS = [VIEWER, NEIGHBOR_CREATOR, PLAIN_CREATOR, NO_EMBEDDING_CREATOR, OTHER_UNI_NEIGHBOR]
+FAKE_UNI_ID = 99995
+OTHER_UNI_ID = 99994
+EMBEDDING_DIM = 384
+
+
+def unit_vector(axis: int) -> str:
+    vector = np.zeros(EMBEDDING_DIM)
+    vector[axis] = 1.0
+    return json.dumps(vector.tolist())
+
+
+def cleanup():
+    """Удаляет все тестовые данные."""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM user_neighbors WHERE user_id = ANY(%s);", (TEST_USERS,))
+                cur.execute("DELETE FROM coffee_requests WHERE creator_user_id = ANY(%s);", (TEST_USERS,))
+                cur.execute("DELETE FROM users WHERE user_id = ANY(%s);", (TEST_USERS,))
+                cur.execute("DELETE FROM coffee_shops WHERE university_id = %s;", (FAKE_UNI_ID,))
+                cur.execute("DELETE FROM universities WHERE id IN (%s, %s);", (FAKE_UNI_ID, OTHER_UNI_ID))
+                conn.commit()
+        print("   Тестовые данные очищены.")
+    except Exception as e:
+        print(f"   Ошибка очистки: {e}")
+
+
+def setup():
+    """
+    Зритель и создатели с ортогональными эмбеддингами (pgvector дает 0%), кроме
+    PLAIN_CREATOR (100%); по заявке от каждого создателя. Возвращает {request_id: creator}.
+    """
+    embeddings = {
+        VIEWER: unit_vector(0),
+        NEIGHBOR_CREATOR: unit_vector(1),
+        PLAIN_CREATOR: unit_vector(0),
+        NO_EMBEDDING_CREATOR: None,
+        OTHER_UNI_NEIGHBOR: unit_vector(2),
+    }
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                for uni_id, slug in ((FAKE_UNI_ID, "feed_test_uni"), (OTHER_UNI_ID, "feed_test_other_uni")):
+                    cur.execute(
+                        """INSERT INTO universities (id, slug, name, is_active)
+                           VALUES (%s, %s, %s, TRUE)
+                           ON CONFLICT (id) DO NOTHING;""",
+                        (uni_id, slug, f"Feed Test {uni_id}"),
+                    )
+
+                now = datetime.now(timezone.utc)
+                for k, uid in enumerate(TEST_USERS):
+                    cur.execute(
+                        """INSERT INTO users (user_id, username, first_name, is_active,
+                                             created_at, last_seen, university_id, embedding)
+                           VALUES (%s, %s, %s, TRUE, %s, %s, %s, %s)
+                           ON CONFLICT (user_id) DO UPDATE SET
+                               university_id = EXCLUDED.university_id,
+                               embedding = EXCLUDED.embedding;""",
+                        (uid, f"feed_test_{k + 1}", f"Feed {k + 1}", now, now, FAKE_UNI_ID, embeddings[uid]),
+                    )
+
+                cur.execute(
+                    """INSERT INTO user_neighbors (user_id, neighbor_id, university_id, rank, similarity)
+                       VALUES (%s, %s, %s, 1, 0.9), (%s, %s, %s, 2, 0.8);""",
+                    (VIEWER, NEIGHBOR_CREATOR, FAKE_UNI_ID, VIEWER, OTHER_UNI_NEIGHBOR, OTHER_UNI_ID),
+                )
+
+                cur.execute(
+                    """INSERT INTO coffee_shops (name, university_id)
+                       VALUES (%s, %s)
+                       RETURNING shop_id;""",
+                    ("Feed Test Coffee", FAKE_UNI_ID),
+                )
+                shop_id = cur.fetchone()[0]
+
+                requests = {}
+                for k, uid in enumerate(TEST_USERS[1:]):
+                    cur.execute(
+                        """INSERT INTO coffee_requests (creator_user_id, shop_id, meet_time, status, university_id)
+                           VALUES (%s, %s, %s, 'pending', %s)
+                           RETURNING request_id;""",
+                        (uid, shop_id, now + timedelta(hours=2, minutes=k), FAKE_UNI_ID),
+                    )
+                    requests[cur.fetchone()[0]] = uid
+
+                conn.commit()
+
+        print(f"   Пользователи: {TEST_USERS}")
+        print(f"   Заявки: {requests}")
+        return requests
+    except Exception as e:
+        print(f"   ❌ Ошибка setup: {e}")
+        return None
+
+
+def test_feed_similarity(requests: dict):
+    """Тест 1-4: similarity_percent каждой заявки и порядок ленты."""
+    print("\n🧪 Тест 1-4: similarity в ленте заявок")
+    rows = get_pending_requests(VIEWER, FAKE_UNI_ID)
+    percents = {requests[row[0]]: row[5] for row in rows if row[0] in requests}
+
+    expected = {
+        NEIGHBOR_CREATOR: 90,  # из графа, pgvector дал бы 0
+        PLAIN_CREATOR: 100,  # pgvector
+        NO_EMBEDDING_CREATOR: None,
+        OTHER_UNI_NEIGHBOR: 0,  # сосед чужого вуза игнорируется — pgvector
+    }
+    ok = True
+    for creator, percent in expected.items():
+        actual = percents.get(creator, "нет в ленте")
+        if actual is not None and actual != "нет в ленте":
+            actual = int(actual)
+        if actual != percent:
+            print(f"   ❌ Создатель {creator}: similarity_percent {actual}, ожидали {percent}")
+            ok = False
+
+    order = [requests[row[0]] for row in rows if row[0] in requests]
+    if order[-1:] != [NO_EMBEDDING_CREATOR]:
+        print(f"   ❌ Заявка без эмбеддинга не в конце ленты: {order}")
+        ok = False
+
+    if ok:
+        print(f"   ✅ Лента: {[(creator, percents[creator]) for creator in order]}")
+    return ok
+
+
+def main():
+    print("🔍 Тест similarity в ленте заявок")
+    print(f"   university_id: {FAKE_UNI_ID} (фиктивный)")
+    print("=" * 80)
+
+    init_db_pool()
+
+    print("\n📋 Очистка и создание тестовых данных...")
+    cleanup()
+    requests = setup()
+    if not requests:
+        print("❌ Не удалось создать тестовые данные.")
+        return
+
+    results = [test_feed_similarity(requests)]
+
+    print("\n📋 Очистка тестовых данных...")
+    cleanup()
+
+    print("\n" + "=" * 80)
+    if all(results):
+        print("✅ ВСЕ ТЕСТЫ ПРОЙДЕНЫ")
+    else:
+        print("❌ ТЕСТЫ НЕ ПРОЙДЕНЫ")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
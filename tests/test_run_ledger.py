@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Тест журнала планов мэтчинга (matching_run_pairs).
+
+Проверяет:
+1. save_run_plan + apply_run_plan — interest_pair и group применяются, plan_status = applied
+2. Повторный apply_run_plan ничего не меняет (идемпотентность)
+3. Частично примененный план (упал после первой порции) доприменяется
+   resume_unfinished_plan — без повторного применения уже записанного
+4. Доприменённый план больше не подхватывается
+
+Все данные — в фиктивном вузе FAKE_UNI_ID, чтобы не задеть чужие планы.
+
+Запуск:
+    DB_PORT=5433 python tests/test_run_ledger.py
+"""
+import json
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from src.db import (
+    init_db_pool,
+    get_db_connection,
+    open_matching_run,
+    save_run_plan,
+    apply_run_plan,
+    get_resumable_run,
+    _apply_plan_chunk,
+)
+from src.matcher import resume_unfinished_plan, MATCHER_RESUME_MAX_AGE_MINUTES
+
+# Тестовые user_id (гарантированно не конфликтуют с production)
+TEST_USERS = [7772001, 7772002, 7772003, 7772004, 7772005, 7772006]
+FAKE_UNI_ID = 99996
+
+
+def cleanup():
+    """Удаляет все тестовые данные."""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                # matching_run_pairs удаляются каскадом
+                cur.execute("DELETE FROM matching_runs WHERE university_id = %s;", (FAKE_UNI_ID,))
+                cur.execute("DELETE FROM meeting_groups WHERE university_id = %s;", (FAKE_UNI_ID,))
+                cur.execute(
+                    "DELETE FROM interest_matches WHERE user_1_id = ANY(%s) OR user_2_id = ANY(%s);",
+                    (TEST_USERS, TEST_USERS),
+                )
+                cur.execute("DELETE FROM coffee_requests WHERE creator_user_id = ANY(%s);", (TEST_USERS,))
+                cur.execute("DELETE FROM users WHERE user_id = ANY(%s);", (TEST_USERS,))
+                cur.execute("DELETE FROM coffee_shops WHERE university_id = %s;", (FAKE_UNI_ID,))
+                cur.execute("DELETE FROM universities WHERE id = %s;", (FAKE_UNI_ID,))
+                conn.commit()
+        print("   Тестовые данные очищены.")
+    except Exception as e:
+        print(f"   Ошибка очистки: {e}")
+
+
+def setup():
+    """Фиктивный вуз, пользователи с эмбеддингами, кофейня и 4 pending заявки."""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """INSERT INTO universities (id, slug, name, is_active)
+                       VALUES (%s, %s, %s, TRUE)
+                       ON CONFLICT (id) DO NOTHING;""",
+                    (FAKE_UNI_ID, "ledger_test_uni", "Ledger Test University"),
+                )
+
+                now = datetime.now(timezone.utc)
+                for k, uid in enumerate(TEST_USERS):
+                    cur.execute(
+                        """INSERT INTO users (user_id, username, first_name, is_active,
+                                             created_at, last_seen, university_id, embedding)
+                           VALUES (%s, %s, %s, TRUE, %s, %s, %s, %s)
+                           ON CONFLICT (user_id) DO UPDATE SET
+                               university_id = EXCLUDED.university_id,
+                               embedding = EXCLUDED.embedding;""",
+                        (uid, f"ledger_test_{k + 1}", f"Ledger {k + 1}", now, now, FAKE_UNI_ID,
+                         json.dumps(np.random.rand(384).tolist())),
+                    )
+
+                cur.execute(
+                    """INSERT INTO coffee_shops (name, university_id)
+                       VALUES (%s, %s)
+                       RETURNING shop_id;""",
+                    ("Ledger Test Coffee", FAKE_UNI_ID),
+                )
+                shop_id = cur.fetchone()[0]
+
+                request_ids = []
+                for uid in TEST_USERS[:4]:
+                    cur.execute(
+                        """INSERT INTO coffee_requests (creator_user_id, shop_id, meet_time, status, university_id)
+                           VALUES (%s, %s, %s, 'pending', %s)
+                           RETURNING request_id;""",
+                        (uid, shop_id, now + timedelta(hours=3), FAKE_UNI_ID),
+                    )
+                    request_ids.append(cur.fetchone()[0])
+
+                conn.commit()
+
+        print(f"   Пользователи: {TEST_USERS}")
+        print(f"   Заявки: {request_ids}")
+        return request_ids
+    except Exception as e:
+        print(f"   ❌ Ошибка setup: {e}")
+        return None
+
+
+def fetch_one(sql: str, params: tuple):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchone()
+
+
+def plan_status(run_id: int):
+    return fetch_one("SELECT plan_status FROM matching_runs WHERE run_id = %s;", (run_id,))[0]
+
+
+def plan_entries(run_id: int) -> list:
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT ord, status, result_id FROM matching_run_pairs WHERE run_id = %s ORDER BY ord;",
+                (run_id,),
+            )
+            return cur.fetchall()
+
+
+def interest_state() -> tuple:
+    """(число interest_matches тестовых пользователей, число групп фиктивного вуза)."""
+    matches = fetch_one(
+        "SELECT COUNT(*) FROM interest_matches WHERE user_1_id = ANY(%s) OR user_2_id = ANY(%s);",
+        (TEST_USERS, TEST_USERS),
+    )[0]
+    groups = fetch_one("SELECT COUNT(*) FROM meeting_groups WHERE university_id = %s;", (FAKE_UNI_ID,))[0]
+    return matches, groups
+
+
+def request_state(request_id: int) -> tuple:
+    return fetch_one(
+        "SELECT status::text, partner_user_id FROM coffee_requests WHERE request_id = %s;", (request_id,)
+    )
+
+
+def test_apply_plan():
+    """Тест 1: план по интересам пишется в журнал и применяется."""
+    print("\n--- Тест 1: save_run_plan + apply_run_plan ---")
+    run_id = open_matching_run(FAKE_UNI_ID, "interest", "greedy", datetime.now(timezone.utc))
+    entries = [
+        {"entry_type": "interest_pair", "members": TEST_USERS[4:6], "raw": 0.8, "score": 0.8},
+        {"entry_type": "group", "members": TEST_USERS[:3], "raw": 0.6, "score": 0.6},
+    ]
+    if run_id is None or not save_run_plan(run_id, entries):
+        print("   ❌ FAIL: не удалось открыть запуск или сохранить план")
+        return None
+
+    passed = True
+    if plan_status(run_id) != "planned":
+        print("   ❌ FAIL: после save_run_plan plan_status != planned")
+        passed = False
+
+    results = apply_run_plan(run_id, FAKE_UNI_ID)
+    if [r["status"] for r in results] != ["applied", "applied"]:
+        print(f"   ❌ FAIL: статусы записей {[r['status'] for r in results]}, ожидалось applied x2")
+        passed = False
+    if interest_state() != (1, 1):
+        print(f"   ❌ FAIL: (interest_matches, groups) = {interest_state()}, ожидалось (1, 1)")
+        passed = False
+    if plan_status(run_id) != "applied":
+        print("   ❌ FAIL: после применения plan_status != applied")
+        passed = False
+
+    if passed:
+        print("   ✅ PASS: План записан в журнал и применен")
+    return run_id if passed else None
+
+
+def test_reapply_is_noop(run_id: int):
+    """Тест 2: повторное применение плана ничего не меняет."""
+    print("\n--- Тест 2: повторный apply_run_plan ---")
+    passed = True
+    before_entries, before_state = plan_entries(run_id), interest_state()
+
+    results = apply_run_plan(run_id, FAKE_UNI_ID)
+    if results:
+        print(f"   ❌ FAIL: повторный вызов обработал {len(results)} записей")
+        passed = False
+    if interest_state() != before_state:
+        print(f"   ❌ FAIL: состояние изменилось: {before_state} -> {interest_state()}")
+        passed = False
+    if plan_entries(run_id) != before_entries:
+        print("   ❌ FAIL: записи журнала изменились")
+        passed = False
+    if get_resumable_run(FAKE_UNI_ID, "interest", MATCHER_RESUME_MAX_AGE_MINUTES) is not None:
+        print("   ❌ FAIL: примененный план считается незавершенным")
+        passed = False
+
+    if passed:
+        print("   ✅ PASS: Повторное применение — no-op")
+    return passed
+
+
+def test_resume_partial_plan(request_ids: list):
+    """Тест 3: план, упавший после первой порции, доприменяется без повторов."""
+    print("\n--- Тест 3: resume_unfinished_plan для частично примененного плана ---")
+    r1, r2, r3, r4 = request_ids
+    u1, u2, u3, u4 = TEST_USERS[:4]
+    run_id = open_matching_run(FAKE_UNI_ID, "requests", "greedy", datetime.now(timezone.utc))
+    entries = [
+        {"entry_type": "request_pair", "members": [u1, u2], "request_ids": [r1, r2]},
+        {"entry_type": "request_pair", "members": [u3, u4], "request_ids": [r3, r4]},
+    ]
+    if run_id is None or not save_run_plan(run_id, entries):
+        print("   ❌ FAIL: не удалось открыть запуск или сохранить план")
+        return False
+
+    # То, что оставляет apply_run_plan, упавший после первой порции: порция и ее
+    # статус закоммичены, plan_status запуска остался planned
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            first = {**entries[0], "ord": 0, "raw": None, "score": None}
+            result_id = _apply_plan_chunk(cur, [first], FAKE_UNI_ID).get(0)
+            cur.execute(
+                """UPDATE matching_run_pairs SET status = 'applied', result_id = %s, applied_at = NOW()
+                   WHERE run_id = %s AND ord = 0;""",
+                (result_id, run_id),
+            )
+            conn.commit()
+
+    passed = True
+    if result_id != r1:
+        print(f"   ❌ FAIL: первая порция не применилась (result_id={result_id})")
+        return False
+    if get_resumable_run(FAKE_UNI_ID, "requests", MATCHER_RESUME_MAX_AGE_MINUTES) != run_id:
+        print("   ❌ FAIL: частично примененный план не найден как незавершенный")
+        passed = False
+
+    resumed = resume_unfinished_plan(FAKE_UNI_ID, "requests")
+    if not resumed or [(r["ord"], r["status"]) for r in resumed] != [(1, "applied")]:
+        print(f"   ❌ FAIL: доприменено {resumed}, ожидалась только запись 1")
+        passed = False
+
+    expected = {r1: ("matched", u2), r2: ("cancelled", None), r3: ("matched", u4), r4: ("cancelled", None)}
+    for request_id, state in expected.items():
+        if request_state(request_id) != state:
+            print(f"   ❌ FAIL: заявка {request_id}: {request_state(request_id)}, ожидалось {state}")
+            passed = False
+    if plan_entries(run_id) != [(0, "applied", r1), (1, "applied", r3)]:
+        print(f"   ❌ FAIL: журнал {plan_entries(run_id)}")
+        passed = False
+    if plan_status(run_id) != "applied":
+        print("   ❌ FAIL: после доприменения plan_status != applied")
+        passed = False
+
+    if passed:
+        print("   ✅ PASS: Частично примененный план доприменен")
+    return passed
+
+
+def test_resume_is_noop():
+    """Тест 4: доприменённый план больше не подхватывается."""
+    print("\n--- Тест 4: повторный resume_unfinished_plan ---")
+    if resume_unfinished_plan(FAKE_UNI_ID, "requests") is not None:
+        print("   ❌ FAIL: завершенный план доприменяется повторно")
+        return False
+    print("   ✅ PASS: Незавершенных планов нет")
+    return True
+
+
+def main():
+    print("🔍 Тест журнала планов мэтчинга")
+    print(f"   university_id: {FAKE_UNI_ID} (фиктивный)")
+    print("=" * 80)
+
+    init_db_pool()
+
+    print("\n📋 Очистка и создание тестовых данных...")
+    cleanup()
+    request_ids = setup()
+    if not request_ids:
+        print("❌ Не удалось создать тестовые данные.")
+        return
+
+    results = []
+    run_id = test_apply_plan()
+    results.append(run_id is not None)
+    results.append(test_reapply_is_noop(run_id) if run_id is not None else False)
+    results.append(test_resume_partial_plan(request_ids))
+    results.append(test_resume_is_noop())
+
+    print("\n📋 Очистка тестовых данных...")
+    cleanup()
+
+    print("\n" + "=" * 80)
+    passed = sum(results)
+    total = len(results)
+    if all(results):
+        print(f"✅ ВСЕ ТЕСТЫ ПРОЙДЕНЫ ({passed}/{total})")
+    else:
+        print(f"❌ ТЕСТЫ НЕ ПРОЙДЕНЫ ({passed}/{total})")
+        failed = [i + 1 for i, r in enumerate(results) if not r]
+        print(f"   Провалены тесты: {failed}")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
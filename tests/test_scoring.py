@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Тест правил скоринга пар (src/scoring.py, БД не нужна).
+
+Для каждого правила включается только его вес, и проверяется, что score
+сдвигается от raw similarity в ожидаемую сторону:
+1. time_proximity — ближе время встречи — выше score, на границе окна бонуса нет
+2. school_diversity — бонус только разным известным факультетам
+3. cross_gender — бонус только паре M/F
+4. reliability — штраф за no_show_count, не больше RELIABILITY_NO_SHOW_CAP
+5. streak — бонус за coffee_streak, не больше STREAK_CAP
+6. score не выше 1.0
+7. take() на подмножестве пула — те же score, что у полного Scorer
+8. build_scorer — нулевые веса и правила без признаков отключаются
+
+Запуск:
+    python tests/test_scoring.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.scoring import (  # noqa: E402
+    RELIABILITY_NO_SHOW_CAP,
+    STREAK_CAP,
+    build_scorer,
+    encode_schools,
+)
+
+RAW = 0.5
+WEIGHT = 0.2
+WINDOW = np.timedelta64(60, "m")
+START = np.datetime64("2026-03-02T12:00:00", "us")
+
+# пул из 6 участников: признаки подобраны так, чтобы пары отличались одним признаком
+FEATURES = {
+    "meet_times": START + np.array([0, 0, 30, 60, 90, 15]) * np.timedelta64(1, "m"),
+    "time_window": WINDOW,
+    "genders": np.array(["M", "F", "M", None, "F", "M"], dtype=object),
+    "school": encode_schools(["ФПМИ", "ФПМИ", "ФРКТ", "Никакой из них", None, "ФРКТ"]),
+    "no_show_count": np.array([0, 0, 1, RELIABILITY_NO_SHOW_CAP, RELIABILITY_NO_SHOW_CAP + 5, 0]),
+    "coffee_streak": np.array([0, 0, 2, STREAK_CAP, STREAK_CAP + 10, 0]),
+}
+N = 6
+
+
+def scores(weights: dict, pairs: list, features: dict = FEATURES, n: int = N, raw: float = RAW) -> list:
+    scorer = build_scorer(weights, features, n)
+    rows = np.array([i for i, _ in pairs])
+    cols = np.array([j for _, j in pairs])
+    return scorer(np.full(len(pairs), raw, dtype=np.float32), rows, cols).tolist()
+
+
+def check(name: str, condition: bool, details: str) -> bool:
+    print(f"{'✅' if condition else '❌'} {name}: {details}")
+    return condition
+
+
+def test_time_proximity():
+    same, half, edge, outside = scores({"time_proximity": WEIGHT}, [(0, 1), (0, 2), (0, 3), (0, 4)])
+    return check(
+        "time_proximity",
+        np.isclose(same, RAW + WEIGHT) and np.isclose(half, RAW + WEIGHT / 2)
+        and np.isclose(edge, RAW) and np.isclose(outside, RAW),
+        f"0 мин {same:.3f}, 30 мин {half:.3f}, 60 мин {edge:.3f}, 90 мин {outside:.3f}",
+    )
+
+
+def test_school_diversity():
+    same, different, unknown, missing = scores({"school_diversity": WEIGHT}, [(0, 1), (0, 2), (0, 3), (2, 4)])
+    return check(
+        "school_diversity",
+        np.isclose(different, RAW + WEIGHT) and np.isclose(same, RAW)
+        and np.isclose(unknown, RAW) and np.isclose(missing, RAW),
+        f"разные {different:.3f}, один {same:.3f}, «никакой» {unknown:.3f}, не указан {missing:.3f}",
+    )
+
+
+def test_cross_gender():
+    cross, cross_reversed, same, unknown = scores({"cross_gender": WEIGHT}, [(0, 1), (1, 2), (0, 2), (0, 3)])
+    return check(
+        "cross_gender",
+        np.isclose(cross, RAW + WEIGHT) and np.isclose(cross_reversed, RAW + WEIGHT)
+        and np.isclose(same, RAW) and np.isclose(unknown, RAW),
+        f"M/F {cross:.3f}, F/M {cross_reversed:.3f}, M/M {same:.3f}, M/? {unknown:.3f}",
+    )
+
+
+def test_reliability():
+    clean, one, capped, over_cap = scores({"reliability": WEIGHT}, [(0, 1), (0, 2), (0, 3), (0, 4)])
+    return check(
+        "reliability",
+        np.isclose(clean, RAW) and clean > one > capped and np.isclose(capped, over_cap)
+        and np.isclose(capped, RAW - WEIGHT / 2),
+        f"0 неявок {clean:.3f}, 1 {one:.3f}, {RELIABILITY_NO_SHOW_CAP} {capped:.3f}, "
+        f"{RELIABILITY_NO_SHOW_CAP + 5} {over_cap:.3f}",
+    )
+
+
+def test_streak():
+    none, some, capped, over_cap = scores({"streak": WEIGHT}, [(0, 1), (0, 2), (0, 3), (0, 4)])
+    return check(
+        "streak",
+        np.isclose(none, RAW) and none < some < capped and np.isclose(capped, over_cap)
+        and np.isclose(capped, RAW + WEIGHT / 2),
+        f"streak 0 {none:.3f}, 2 {some:.3f}, {STREAK_CAP} {capped:.3f}, {STREAK_CAP + 10} {over_cap:.3f}",
+    )
+
+
+def test_clipped():
+    weights = {"time_proximity": 0.5, "cross_gender": 0.5, "streak": 0.5}
+    (score,) = scores(weights, [(0, 1)], raw=0.9)
+    return check("clip", np.isclose(score, 1.0), f"0.9 + бонусы -> {score:.3f}")
+
+
+def test_take():
+    weights = {name: WEIGHT for name in ("time_proximity", "school_diversity", "cross_gender", "reliability", "streak")}
+    subset = np.array([4, 2, 0, 5])
+    full = build_scorer(weights, FEATURES, N)
+    part = full.take(subset)
+
+    local_rows, local_cols = np.triu_indices(len(subset), k=1)
+    raw = np.full(len(local_rows), RAW, dtype=np.float32)
+    expected = full(raw, subset[local_rows], subset[local_cols])
+    actual = part(raw, local_rows, local_cols)
+    return check(
+        "take",
+        part.n == len(subset) and part.features["time_window"] == WINDOW and np.allclose(actual, expected),
+        f"{len(local_rows)} пар подмножества {subset.tolist()} совпадают с полным Scorer",
+    )
+
+
+def test_build_scorer():
+    disabled = build_scorer({"streak": 0.0, "cross_gender": 0}, FEATURES, N)
+    no_features = build_scorer({"time_proximity": WEIGHT}, {"genders": FEATURES["genders"]}, N)
+    partial = build_scorer({"time_proximity": WEIGHT, "cross_gender": WEIGHT}, {"genders": FEATURES["genders"]}, N)
+    return check(
+        "build_scorer",
+        disabled is None and no_features is None and partial is not None
+        and list(partial.weights) == ["cross_gender"],
+        "нулевые веса и правила без признаков отключены",
+    )
+
+
+def main():
+    print("🧪 Правила скоринга")
+    results = [
+        test_time_proximity(),
+        test_school_diversity(),
+        test_cross_gender(),
+        test_reliability(),
+        test_streak(),
+        test_clipped(),
+        test_take(),
+        test_build_scorer(),
+    ]
+    if all(results):
+        print("✅ Все проверки пройдены")
+    else:
+        print(f"❌ Провалено проверок: {results.count(False)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
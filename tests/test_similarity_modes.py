@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Тест: плотный (dense) и блочный (tiled) пути мэтчера дают одинаковый результат (БД не нужна).
+
+Проверяет:
+1. plan_request_matching — одна кофейня, время встреч разбросано на 12ч
+   (несовместимые по окну пары должны отсекаться до выбора пар)
+2. plan_request_matching — у каждого создателя по две заявки
+3. plan_request_matching — с правилами скоринга (time_proximity, streak)
+4. plan_interest_matching — с порогом и историей встреч
+Для каждого — движки greedy и max_weight.
+
+Запуск:
+    python tests/test_similarity_modes.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import src.matcher as matcher  # noqa: E402
+from src.scoring import build_scorer  # noqa: E402
+
+EMBEDDING_DIM = 32
+# лимит памяти, при котором tiled-путь режет матрицу на несколько блоков
+TILED_MEMORY_LIMIT_MB = 0.5
+
+
+def make_embeddings(n: int, rng) -> np.ndarray:
+    topics = rng.normal(size=(8, EMBEDDING_DIM)).astype(np.float32)
+    return topics[rng.integers(0, 8, n)] + rng.normal(scale=1.0, size=(n, EMBEDDING_DIM)).astype(np.float32)
+
+
+def make_request_pool(n: int, creators: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2026-03-02T09:00:00", "us")
+    return {
+        "request_ids": np.arange(1, n + 1, dtype=np.int64),
+        "creator_ids": rng.permutation(np.arange(n) % creators).astype(np.int64) + 1000,
+        "embeddings": make_embeddings(n, rng),
+        "meet_times": start + rng.integers(0, 12 * 60, n) * np.timedelta64(1, "m"),
+        "shop_ids": np.ones(n, dtype=np.int64),
+    }
+
+
+def run_in_mode(mode: str, engine: str, plan, *args, **kwargs):
+    saved = matcher.SIMILARITY_MODE, matcher.MATCHING_ENGINE, matcher.MATCHER_MEMORY_LIMIT_MB
+    matcher.SIMILARITY_MODE, matcher.MATCHING_ENGINE = mode, engine
+    if mode == "tiled":
+        matcher.MATCHER_MEMORY_LIMIT_MB = TILED_MEMORY_LIMIT_MB
+    try:
+        return plan(*args, **kwargs)
+    finally:
+        matcher.SIMILARITY_MODE, matcher.MATCHING_ENGINE, matcher.MATCHER_MEMORY_LIMIT_MB = saved
+
+
+def assert_same_plans(name: str, engine: str, dense: list, tiled: list):
+    dense_pairs = sorted((p[0], p[1]) for p in dense)
+    tiled_pairs = sorted((p[0], p[1]) for p in tiled)
+    assert dense_pairs == tiled_pairs, (
+        f"{name} [{engine}]: dense {len(dense_pairs)} пар, tiled {len(tiled_pairs)} пар — результаты различаются"
+    )
+    dense_scores = np.sort([p[-1] for p in dense])
+    tiled_scores = np.sort([p[-1] for p in tiled])
+    assert np.allclose(dense_scores, tiled_scores, atol=1e-5), f"{name} [{engine}]: различаются score пар"
+    print(f"✅ {name} [{engine}]: {len(dense_pairs)} пар, dense == tiled")
+
+
+def check_requests(name: str, pool: dict, scorer=None):
+    no_history = np.empty((0, 2), dtype=np.int64)
+    for engine in ("greedy", "max_weight"):
+        dense, tiled = (
+            run_in_mode(mode, engine, matcher.plan_request_matching, pool, 0, no_history, scorer)
+            for mode in ("dense", "tiled")
+        )
+        assert dense, f"{name} [{engine}]: пустой результат"
+        assert_same_plans(name, engine, dense, tiled)
+
+        window = np.timedelta64(matcher.MATCH_TIME_WINDOW_MINUTES, "m")
+        for i, j, _ in tiled:
+            assert abs(pool["meet_times"][i] - pool["meet_times"][j]) <= window, f"{name}: пара вне окна"
+            assert pool["creator_ids"][i] != pool["creator_ids"][j], f"{name}: пара из заявок одного создателя"
+
+
+def check_interests(seed: int):
+    rng = np.random.default_rng(seed)
+    n = 240
+    user_ids = list(range(2_000_000, 2_000_000 + n))
+    normed = matcher.normalize_embeddings(make_embeddings(n, rng))
+    history = rng.integers(0, n, size=(150, 2))
+    history = history[history[:, 0] != history[:, 1]]
+
+    for engine in ("greedy", "max_weight"):
+        (dense, _), (tiled, _) = (
+            run_in_mode(mode, engine, matcher.plan_interest_matching, user_ids, normed, history, clustered=False)
+            for mode in ("dense", "tiled")
+        )
+        assert dense, f"interest [{engine}]: пустой результат"
+        assert_same_plans("interest", engine, dense, tiled)
+
+
+def main():
+    print("🧪 dense vs tiled")
+
+    check_requests("requests, разные создатели", make_request_pool(400, 400, seed=1))
+    check_requests("requests, по 2 заявки на создателя", make_request_pool(300, 150, seed=2))
+
+    pool = make_request_pool(400, 250, seed=3)
+    scorer = build_scorer(
+        {"time_proximity": 0.1, "streak": 0.05},
+        {
+            "meet_times": pool["meet_times"],
+            "time_window": np.timedelta64(matcher.MATCH_TIME_WINDOW_MINUTES, "m"),
+            "coffee_streak": np.random.default_rng(3).integers(0, 8, 400),
+        },
+        400,
+    )
+    check_requests("requests, правила скоринга", pool, scorer)
+
+    check_interests(seed=4)
+    print("✅ Все проверки пройдены")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Тест инкрементального состояния пула по интересам (src/similarity_state.py, БД не нужна).
+
+Проверяет:
+1. apply_changes — после серии дельт (новые, измененные, ушедшие пользователи)
+   top-k соседей каждого пользователя совпадают с полной пересборкой rebuild
+2. sync — пользователи, удаленные из users после прошлой синхронизации, уходят
+   из состояния, хотя дельта get_interest_pool_changes их не возвращает
+   (функции src.db подменены in-memory версиями, как в bench_matcher.py)
+
+Запуск:
+    python tests/test_similarity_state.py
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import src.similarity_state as similarity_state  # noqa: E402
+from src.similarity_state import SimilarityState  # noqa: E402
+
+EMBEDDING_DIM = 32
+TOP_K = 10
+
+
+def neighbor_sets(state: SimilarityState) -> dict:
+    """user_id -> {user_id соседа: score} — не зависит от порядка строк."""
+    result = {}
+    for row, uid in enumerate(state.ids.tolist()):
+        found = state.neighbors[row] >= 0
+        neighbor_ids = state.ids[state.neighbors[row][found]].tolist()
+        result[uid] = dict(zip(neighbor_ids, state.neighbor_scores[row][found].tolist()))
+    return result
+
+
+def assert_same_neighbors(step: str, state: SimilarityState, ids: list, embeddings: dict, genders: dict):
+    fresh = SimilarityState(0, TOP_K)
+    fresh.rebuild(ids, np.array([embeddings[uid] for uid in ids]), [genders[uid] for uid in ids])
+
+    assert sorted(state.ids.tolist()) == sorted(ids), f"{step}: набор пользователей отличается от пересборки"
+    actual, expected = neighbor_sets(state), neighbor_sets(fresh)
+    for uid in ids:
+        assert actual[uid].keys() == expected[uid].keys(), f"{step}: соседи {uid} отличаются от пересборки"
+        for neighbor, score in expected[uid].items():
+            assert abs(actual[uid][neighbor] - score) < 1e-5, f"{step}: score {uid}-{neighbor} отличается"
+    genders_after = dict(zip(state.ids.tolist(), state.genders.tolist()))
+    assert all(genders_after[uid] == genders[uid] for uid in ids), f"{step}: пол отличается"
+    print(f"✅ {step}: {len(ids)} пользователей, top-{TOP_K} совпадает с пересборкой")
+
+
+def test_apply_changes():
+    rng = np.random.default_rng(11)
+    ids = list(range(5000, 5300))
+    embeddings = {uid: rng.normal(size=EMBEDDING_DIM) for uid in ids}
+    genders = {uid: rng.choice(["M", "F", None]) for uid in ids}
+
+    state = SimilarityState(0, TOP_K)
+    state.rebuild(ids, np.array([embeddings[uid] for uid in ids]), [genders[uid] for uid in ids])
+
+    for step in range(6):
+        new_ids = list(range(6000 + 20 * step, 6000 + 20 * step + 20))
+        changed = rng.choice(ids, size=15, replace=False).tolist()
+        removed = [uid for uid in rng.choice(ids, size=15, replace=False).tolist() if uid not in changed]
+        # соседи удаленного тоже должны пересчитаться — удаляем и самого похожего на первого
+        first = state.row_of[ids[0]]
+        removed.append(int(state.ids[state.neighbors[first, 0]]))
+        removed = [uid for uid in dict.fromkeys(removed) if uid not in changed]
+
+        for uid in new_ids + changed:
+            embeddings[uid] = rng.normal(size=EMBEDDING_DIM)
+            genders[uid] = rng.choice(["M", "F", None])
+        upserts = new_ids + changed
+        state.apply_changes(
+            upserts, np.array([embeddings[uid] for uid in upserts]), [genders[uid] for uid in upserts], removed
+        )
+        ids = [uid for uid in ids if uid not in removed] + new_ids
+        assert_same_neighbors(f"дельта {step + 1}", state, ids, embeddings, genders)
+
+    # удаление пользователя, которого нет в состоянии, ничего не меняет
+    assert state.apply_changes([], [], [], [123]) == 0, "удаление неизвестного пользователя что-то пересчитало"
+    assert_same_neighbors("удаление неизвестного", state, ids, embeddings, genders)
+
+
+class InMemoryUsers:
+    """Подмена функций src.db, которые использует SimilarityState.sync."""
+
+    def __init__(self, embeddings: dict):
+        self.embeddings = dict(embeddings)
+        self.now = datetime.now(timezone.utc)
+
+    def get_interest_pool_changes(self, uni_id, since):
+        # удаление строки не проставляет matching_updated_at — дельта пустая
+        return [], self.now
+
+    def get_deleted_user_ids(self, user_ids):
+        return [uid for uid in user_ids if uid not in self.embeddings]
+
+
+def test_sync_drops_deleted_users():
+    rng = np.random.default_rng(12)
+    ids = list(range(7000, 7100))
+    db = InMemoryUsers({uid: rng.normal(size=EMBEDDING_DIM) for uid in ids})
+
+    state = SimilarityState(0, TOP_K)
+    state.rebuild(ids, np.array([db.embeddings[uid] for uid in ids]), [None] * len(ids))
+    state.synced_at = state.full_synced_at = db.now - timedelta(minutes=10)
+
+    deleted = ids[:7]
+    for uid in deleted:
+        del db.embeddings[uid]
+
+    saved = similarity_state.get_interest_pool_changes, similarity_state.get_deleted_user_ids
+    similarity_state.get_interest_pool_changes = db.get_interest_pool_changes
+    similarity_state.get_deleted_user_ids = db.get_deleted_user_ids
+    try:
+        assert state.sync(), "sync не удался"
+    finally:
+        similarity_state.get_interest_pool_changes, similarity_state.get_deleted_user_ids = saved
+
+    left = ids[7:]
+    assert not set(deleted) & set(state.ids.tolist()), "удаленные пользователи остались в состоянии"
+    assert_same_neighbors("sync после удаления из users", state, left, db.embeddings, {uid: None for uid in left})
+
+
+def main():
+    print("🧪 SimilarityState")
+    test_apply_changes()
+    test_sync_drops_deleted_users()
+    print("✅ Все проверки пройдены")
+
+
+if __name__ == "__main__":
+    main()